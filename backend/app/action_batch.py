@@ -0,0 +1,121 @@
+"""
+Fan-out testing of one action over many parameter sets: POST /actions/{id}/test-batch.
+
+Parameter sets run on a shared thread pool with a bounded number in flight per
+batch, each on its own database session, so calls go out concurrently over the
+pooled HTTP sessions of the API host. Every item reports its status, latency
+and result size; the summary adds latency percentiles, which makes a batch a
+quick benchmark of the upstream API as well as a validation run.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+import json
+import os
+import time
+
+from app.action_cache import cache_bypass
+from app.action_manager import ActionManager
+from app.utils import percentile
+
+ACTION_TEST_BATCH_DEFAULT_CONCURRENCY = int(os.getenv("ACTION_TEST_BATCH_DEFAULT_CONCURRENCY", "8"))
+# Threads shared by all batches; a single batch never has more than its concurrency in flight
+ACTION_TEST_BATCH_MAX_CONCURRENCY = int(os.getenv("ACTION_TEST_BATCH_MAX_CONCURRENCY", "32"))
+ACTION_TEST_BATCH_MAX_ITEMS = int(os.getenv("ACTION_TEST_BATCH_MAX_ITEMS", "1000"))
+
+_test_pool = ThreadPoolExecutor(max_workers=ACTION_TEST_BATCH_MAX_CONCURRENCY, thread_name_prefix="action-test-batch")
+
+
+def _item_status(result: Dict[str, Any]) -> str:
+    # Native actions report no success flag; failures of custom actions do
+    return "failed" if result.get("success") is False else "success"
+
+
+def _test_item(session_factory: Callable, action_name: str, index: int, parameters: Dict[str, Any],
+               context: Dict[str, Any], bypass_cache: bool, include_result: bool) -> Dict[str, Any]:
+    db = session_factory()
+    start = time.perf_counter()
+    try:
+        with cache_bypass(bypass_cache):
+            result = ActionManager.execute_action(db, action_name, parameters, dict(context))
+        status, error = _item_status(result), result.get("error")
+    except Exception as e:
+        result, status, error = None, "failed", str(e)
+    finally:
+        db.close()
+
+    item = {
+        "index": index,
+        "status": status,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+        "result_bytes": len(json.dumps(result, default=str)) if result is not None else 0
+    }
+    if result is not None:
+        item["status_code"] = result.get("status_code")
+        item["cache_hit"] = bool((result.get("cache") or {}).get("hit"))
+        item["coalesced"] = bool(result.get("coalesced"))
+    if error:
+        item["error"] = error
+    if include_result:
+        item["result"] = result
+    return item
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Any]:
+    if not latencies:
+        return {}
+    return {
+        "min_ms": round(min(latencies), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3)
+    }
+
+
+def run_action_test_batch(session_factory: Callable, action_name: str, parameter_sets: List[Dict[str, Any]],
+                          context: Dict[str, Any] = None, concurrency: int = ACTION_TEST_BATCH_DEFAULT_CONCURRENCY,
+                          bypass_cache: bool = False, include_results: bool = False) -> Dict[str, Any]:
+    """Execute the action once per parameter set; items are returned in input order with a summary"""
+    concurrency = max(1, min(concurrency, ACTION_TEST_BATCH_MAX_CONCURRENCY))
+    context = context or {}
+    items: List[Dict[str, Any]] = [None] * len(parameter_sets)
+    pending = set()
+    started = time.perf_counter()
+
+    def collect(futures):
+        for future in futures:
+            item = future.result()
+            items[item["index"]] = item
+
+    for index, parameters in enumerate(parameter_sets):
+        if len(pending) >= concurrency:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending.add(_test_pool.submit(_test_item, session_factory, action_name, index, parameters,
+                                      context, bypass_cache, include_results))
+    collect(wait(pending)[0])
+
+    duration = time.perf_counter() - started
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    successful = [item["latency_ms"] for item in items if item["status"] == "success"]
+
+    return {
+        "action_name": action_name,
+        "items": items,
+        "summary": {
+            "items": len(items),
+            "concurrency": concurrency,
+            "by_status": counts,
+            "latency": latency_summary([item["latency_ms"] for item in items]),
+            "success_latency": latency_summary(successful),
+            "result_bytes": sum(item["result_bytes"] for item in items),
+            "cache_hits": sum(1 for item in items if item.get("cache_hit")),
+            "coalesced": sum(1 for item in items if item.get("coalesced")),
+            "duration_ms": round(duration * 1000, 3),
+            "throughput_per_second": round(len(items) / duration, 3) if duration > 0 else None
+        }
+    }
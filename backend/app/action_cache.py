@@ -0,0 +1,298 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Hashable, Mapping, Optional, Tuple
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Total size of cached custom action results kept per process
+ACTION_CACHE_MAX_BYTES = int(os.getenv("ACTION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Total size of responses kept for HTTP caching (Cache-Control / ETag / Last-Modified)
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# How long a stale response is kept around to be revalidated with a conditional request
+HTTP_CACHE_RETENTION_SECONDS = float(os.getenv("HTTP_CACHE_RETENTION_SECONDS", "3600"))
+
+# Set while a run asked to re-fetch instead of reusing cached results. Kept out of
+# the run context, which is forwarded to the APIs that actions call
+_cache_bypass: ContextVar[bool] = ContextVar("action_cache_bypass", default=False)
+
+
+class ByteLRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    Entries expire after their own TTL; when a new entry does not fit, the least
+    recently used entries are evicted until it does. Values are copied on the
+    way in and out so callers can mutate what they get back.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Return `(value, age_seconds)` or None if the key is missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, stored_at, expires_at = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value), now - stored_at
+
+    def set(self, key: Hashable, value: Any, size: int, ttl_seconds: float) -> bool:
+        """Store a value; values larger than the whole cache are not stored"""
+        if ttl_seconds <= 0 or size > self.max_bytes:
+            return False
+        now = time.monotonic()
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._entries[key] = (value, size, now, now + ttl_seconds)
+            self.current_bytes += size
+        return True
+
+    def invalidate(self, predicate) -> int:
+        """Drop every entry whose key matches the predicate"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key: Hashable):
+        _, size, _, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+@contextmanager
+def cache_bypass(enabled: bool = True):
+    """Skip cached results (but still refresh them) for action calls made in the block"""
+    token = _cache_bypass.set(bool(enabled))
+    try:
+        yield
+    finally:
+        _cache_bypass.reset(token)
+
+
+def cache_bypassed() -> bool:
+    return _cache_bypass.get()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller (the leader) runs the function; callers arriving while it is
+    in flight wait for it and get their own deep copy of its result, or its
+    exception. Nothing is kept once the call finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn, timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Return `(result, shared)`; raises TimeoutError when a waiter gives up after `timeout`"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "waiters": 0}
+                self.executions += 1
+            else:
+                call["waiters"] += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                result = fn()
+                call["error"] = None
+            except BaseException as e:
+                result, call["error"] = None, e
+            with self._lock:
+                del self._calls[key]
+            # Waiters copy a snapshot taken before the leader hands its result back
+            call["result"] = copy.deepcopy(result) if call["waiters"] else None
+            call["done"].set()
+            if call["error"] is not None:
+                raise call["error"]
+            return result, False
+
+        if not call["done"].wait(timeout):
+            raise TimeoutError("Timed out waiting for an identical in-flight call")
+        if call["error"] is not None:
+            raise call["error"]
+        return copy.deepcopy(call["result"]), True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "executions": self.executions, "coalesced": self.coalesced}
+
+
+def action_cache_ttl(action) -> float:
+    """Seconds a GET result of the action may be reused (`cache_ttl_seconds` in Action.config)"""
+    try:
+        return float((action.config or {}).get("cache_ttl_seconds") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def action_cache_key(action, endpoint: str, query_params: Dict[str, Any], headers: Dict[str, Any]) -> Tuple[int, str]:
+    """Key a result by action, resolved endpoint, query and credentials.
+
+    Headers are part of the key so callers with different API keys never share
+    results; they are hashed so no credential is kept in memory as a key.
+    """
+    digest = hashlib.sha256(json.dumps(
+        [endpoint, query_params, headers, action.api_key], sort_keys=True, default=str
+    ).encode("utf-8")).hexdigest()
+    return action.id, digest
+
+
+def invalidate_action(action_id: int) -> int:
+    """Forget cached results of an action after it is changed or deleted (this process only)"""
+    return (action_result_cache.invalidate(lambda key: key[0] == action_id)
+            + http_response_cache.invalidate(lambda key: key[0] == action_id))
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Cache-Control directives, lower-cased, with their argument (or None)"""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip().strip('"') or None
+    return directives
+
+
+def http_freshness(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds a response may be served without revalidation; None when it must not be stored"""
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+
+    age = 0.0
+    try:
+        age = float(headers.get("Age") or 0)
+    except ValueError:
+        pass
+    for directive in ("s-maxage", "max-age"):
+        if directives.get(directive):
+            try:
+                return max(float(directives[directive]) - age, 0.0)
+            except ValueError:
+                return 0.0
+
+    if headers.get("Expires"):
+        try:
+            expires = parsedate_to_datetime(headers["Expires"]).timestamp()
+            return max(expires - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+def http_cache_lookup(key: Hashable) -> Optional[Dict[str, Any]]:
+    """Stored response for the key, with "fresh" telling whether it can be served without revalidation"""
+    cached = http_response_cache.get(key)
+    if cached is None:
+        return None
+    entry, _ = cached
+    entry["fresh"] = entry["fresh_until"] > time.monotonic()
+    entry["age_seconds"] = max(time.monotonic() - entry["stored_at"], 0.0)
+    return entry
+
+
+def conditional_headers(entry: Dict[str, Any]) -> Dict[str, str]:
+    """Validators of a stored response, as request headers for revalidating it"""
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def http_cache_store(key: Hashable, status_code: int, result: Any, size: int,
+                     response_headers: Mapping[str, str]) -> bool:
+    """Keep a response the server allows to cache: fresh for its max-age, then revalidated with its validators"""
+    fresh_for = http_freshness(response_headers)
+    etag, last_modified = response_headers.get("ETag"), response_headers.get("Last-Modified")
+    if fresh_for is None or (fresh_for <= 0 and not etag and not last_modified):
+        return False
+
+    now = time.monotonic()
+    entry = {
+        "status_code": status_code,
+        "result": result,
+        "etag": etag,
+        "last_modified": last_modified,
+        "stored_at": now,
+        "fresh_until": now + fresh_for
+    }
+    # Validators keep a stale entry useful; without them it is dropped once stale
+    retention = max(HTTP_CACHE_RETENTION_SECONDS, fresh_for) if (etag or last_modified) else fresh_for
+    return http_response_cache.set(key, entry, size, retention)
+
+
+def http_cache_revalidated(key: Hashable, entry: Dict[str, Any], response_headers: Mapping[str, str]) -> bool:
+    """Refresh a stored response after a 304, taking the new freshness and validators"""
+    merged = {
+        "Cache-Control": response_headers.get("Cache-Control"),
+        "Age": response_headers.get("Age"),
+        "Expires": response_headers.get("Expires"),
+        "ETag": response_headers.get("ETag") or entry.get("etag"),
+        "Last-Modified": response_headers.get("Last-Modified") or entry.get("last_modified")
+    }
+    size = len(json.dumps(entry["result"], default=str))
+    return http_cache_store(key, entry["status_code"], entry["result"], size,
+                            {name: value for name, value in merged.items() if value})
+
+
+# Identical custom action GETs in flight at the same time share one upstream request
+action_call_flight = SingleFlight()
+# Results of idempotent custom action calls, shared across runs
+action_result_cache = ByteLRUCache(ACTION_CACHE_MAX_BYTES)
+# Responses the upstream API marked cacheable, served fresh or revalidated with If-None-Match/If-Modified-Since
+http_response_cache = ByteLRUCache(HTTP_CACHE_MAX_BYTES)
@@ -1,15 +1,50 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, object_session
 from app import models, schemas
 from app.utils import (
     safe_json_parse, mask_sensitive_fields, validate_url, 
     extract_id_from_url, handle_exceptions, build_error_response,
-    build_success_response, sanitize_yaml_content
+    build_success_response, sanitize_yaml_content, project_context
+)
+from app.telemetry import record_http_call
+from app import conversation_memory
+from app.http_pool import http_pool
+from app.deadline import (
+    call_timeout, deadline_exceeded, raise_if_deadline_exceeded, remaining_seconds, DeadlineExceeded
+)
+from app.action_spec import spec_hash, compiled_spec_cache, load_compiled_spec, store_compiled_spec
+from app.response_projection import compile_projection, build_projector, projector_for, keep_paths
+from app.pagination import pagination_settings, kept_paths, fetch_all_pages
+from app.spec_refs import RefResolver, ref_name
+from app.response_stream import read_response, response_limits, ResponseTooLarge
+from app.resilience import (
+    send_with_retries, retry_policy, outbound_limits, CircuitOpenError, OutboundLimitExceeded
+)
+from app.action_cache import (
+    action_result_cache, action_cache_ttl, action_cache_key, invalidate_action, cache_bypassed,
+    http_cache_lookup, http_cache_store, http_cache_revalidated, conditional_headers, action_call_flight
 )
 import requests
 import json
+import logging
+import os
+import re
+import time
 import yaml
 from typing import Dict, Any
 
+logger = logging.getLogger(__name__)
+
+YAML_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Upper bound for a custom action HTTP call; a run deadline can shorten it further
+ACTION_TIMEOUT_SECONDS = float(os.getenv("ACTION_TIMEOUT_SECONDS", "30"))
+
+
+def _request_key(query_params: Dict[str, Any], body_params: Dict[str, Any]) -> Dict[str, Any]:
+    """What a GET sends besides its URL and headers, for its cache and coalescing keys"""
+    return {"query": query_params, "body": body_params} if body_params else query_params
+
+
 class ActionManager:
     @staticmethod
     def create_action(db: Session, action: schemas.ActionCreate):
@@ -33,6 +68,7 @@ class ActionManager:
             yaml_spec=sanitized_yaml_spec,
             api_key=action.api_key
         )
+        ActionManager.store_compiled_spec(db, db_action)
         db.add(db_action)
         db.commit()
         db.refresh(db_action)
@@ -50,8 +86,77 @@ class ActionManager:
 
         if action.action_type == "native":
             return ActionManager._execute_native_action(db, action, parameters, context)
-        else:
+
+        flight_key = ActionManager._coalescing_key(action, parameters)
+        if flight_key is None:
+            return ActionManager._execute_custom_action(action, parameters, context)
+
+        # Identical GETs in flight share one request; the run context is per caller, so
+        # it is left out of the shared call and added back to each copy
+        try:
+            response, shared = action_call_flight.do(
+                flight_key, lambda: ActionManager._execute_custom_action(action, parameters, None),
+                timeout=remaining_seconds()
+            )
+        except TimeoutError:
+            # The run deadline passed while waiting; a call of its own reports it
+            return ActionManager._execute_custom_action(action, parameters, context)
+        if shared and response.get("deadline_exceeded"):
+            # The leader ran out of its own budget; this caller may still have time left
             return ActionManager._execute_custom_action(action, parameters, context)
+        if "context" in response:
+            response["context"] = context
+        if shared:
+            response["coalesced"] = True
+        return response
+
+    @staticmethod
+    def _coalescing_key(action: models.Action, parameters: dict):
+        """Key identifying a GET by action, resolved URL, query and credentials; None when calls must not be shared.
+
+        Calls bypassing the cache are never shared: they ask for a request of their own.
+        """
+        if cache_bypassed():
+            return None
+        spec = ActionManager.get_compiled_spec(action)
+        if spec["method"] != "GET" or spec["endpoint_error"] or any(key not in parameters for key in spec["path_params"]):
+            return None
+        endpoint = spec["endpoint"]
+        for key in spec["path_params"]:
+            endpoint = endpoint.replace(f"{{{key}}}", extract_id_from_url(str(parameters[key]), key))
+        query_params, body_params, header_params = ActionManager._route_parameters(
+            action, spec["method"], parameters, spec["path_params"])
+        return ("GET",) + action_cache_key(action, endpoint, _request_key(query_params, body_params),
+                                           {**spec["headers"], **header_params})
+
+    @staticmethod
+    def _route_parameters(action: models.Action, method: str, parameters: dict, path_params: list):
+        """Split call parameters into query, JSON body and header parameters.
+
+        Imported actions declare where each parameter goes ("in": path, query,
+        header, cookie or body); parameters without a location go in the query
+        string of GET/DELETE and in the body of POST/PUT.
+        """
+        declared = action.parameters if isinstance(action.parameters, dict) else {}
+        default = "query" if method in ("GET", "DELETE") else "body"
+        routed = {"query": {}, "body": {}, "header": {}, "cookie": {}}
+        for name, value in parameters.items():
+            if name in path_params:
+                continue
+            definition = declared.get(name)
+            location = definition.get("in") if isinstance(definition, dict) else None
+            if location == "path":
+                continue
+            if location not in routed:
+                location = default
+            if name == "context" and location != "body":
+                continue
+            routed[location][name] = value
+
+        headers = {name: str(value) for name, value in routed["header"].items()}
+        if routed["cookie"]:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in routed["cookie"].items())
+        return routed["query"], routed["body"], headers
 
     @staticmethod
     def _execute_native_action(db: Session, action: models.Action, parameters: dict, context: dict = None):
@@ -107,6 +212,8 @@ Provide a focused analysis that highlights the most important aspects for fulfil
                     validation_criteria = parameters.get('validation_criteria', 'Validate the provided information')
                     user_input = parameters.get('input', context.get('user_input', ''))
                     context_data = context.get('shared_context', {}) if context else {}
+                    conversation = conversation_memory.memory_view(context)
+                    conversation_section = f"\nCONVERSATION SO FAR:\n{conversation}\n" if conversation else ""
                     
                     # Build validation prompt
                     choice_prompt = f"""You are making a decision based on validation criteria. Analyze the information and determine if it meets the specified criteria.
@@ -114,7 +221,7 @@ Provide a focused analysis that highlights the most important aspects for fulfil
 VALIDATION CRITERIA: {validation_criteria}
 
 USER INPUT: {user_input}
-
+{conversation_section}
 AVAILABLE CONTEXT: {json.dumps(context_data, indent=2)}
 
 INSTRUCTIONS:
@@ -150,6 +257,7 @@ Decision:"""
                             "next_flow": "valid_flow" if is_valid else "invalid_flow"
                         }
                     except Exception as e:
+                        raise_if_deadline_exceeded(e)
                         return {
                             "type": "choice",
                             "decision": "error",
@@ -207,6 +315,11 @@ Decision:"""
 USER REQUEST: {user_input}
 
 AVAILABLE INFORMATION:"""
+
+                    # Earlier turns of the conversation, compacted to a fixed budget
+                    conversation = conversation_memory.memory_view(context)
+                    if conversation:
+                        response_prompt += f"\n\nCONVERSATION SO FAR:\n{conversation}"
                     
                     # Add data from custom actions (like Rootly API calls) in a structured way
                     available_data = {}
@@ -271,6 +384,7 @@ Respond directly to the user's request now:"""
                             }
                         }
                     except Exception as e:
+                        raise_if_deadline_exceeded(e)
                         # Fallback with context information
                         fallback_response = f"I've processed your request about: {user_input}\n\n"
                         
@@ -334,165 +448,384 @@ Respond directly to the user's request now:"""
             
         return endpoint
 
+    @staticmethod
+    def compile_action_spec(action: models.Action, parsed_spec: dict = None) -> Dict[str, Any]:
+        """Derive everything a call needs from the action definition, once per definition.
+
+        `parsed_spec` is the already parsed yaml_spec, when the caller has it.
+        """
+        endpoint_error = None
+        endpoint = ActionManager._fix_endpoint_url(action.endpoint, action.name) if action.endpoint else ""
+        if not action.endpoint:
+            endpoint_error = f"Action '{action.name}' has no endpoint configured"
+        elif not validate_url(endpoint):
+            endpoint_error = f"Action '{action.name}' endpoint must be a complete URL starting with http:// or https://. Current endpoint: '{action.endpoint}'. Please update the action with a complete URL like 'https://api.rootly.com/v1/incidents/{{id}}'"
+
+        method = (action.method or "").upper()
+        headers = dict(action.headers or {})
+        # Add default Content-Type if not present
+        if 'Content-Type' not in headers and method == "POST":
+            headers['Content-Type'] = 'application/json'
+        # The API key becomes a Bearer token unless a concrete Authorization header is configured
+        authorization = headers.get('Authorization')
+        auth_from_api_key = authorization is None or (
+            authorization.startswith('{{') and authorization.endswith('}}'))
+
+        if action.yaml_spec and parsed_spec is None:
+            try:
+                parsed_spec = ActionManager.parse_yaml_spec(action.yaml_spec)
+            except ValueError as e:
+                logger.warning("Error parsing YAML spec of action %s: %s", action.name, e)
+        resolver = RefResolver(parsed_spec)
+        response_schema = ActionManager._response_schema_from_spec(parsed_spec, resolver) if parsed_spec else {}
+
+        return {
+            "spec_hash": spec_hash(action),
+            "endpoint": endpoint,
+            "endpoint_error": endpoint_error,
+            "method": method,
+            "path_params": list(dict.fromkeys(re.findall(r'\{([^}]+)\}', endpoint))),
+            "headers": headers,
+            "auth_from_api_key": auth_from_api_key,
+            "has_yaml_spec": bool(action.yaml_spec),
+            "response_schema": response_schema,
+            "projection": compile_projection(response_schema, parsed_spec, resolver)
+        }
+
+    @staticmethod
+    def store_compiled_spec(db: Session, action: models.Action, parsed_spec: dict = None) -> Dict[str, Any]:
+        """Compile the action definition and persist it; called whenever an action is saved"""
+        key = spec_hash(action)
+        compiled = compiled_spec_cache.get(key) or ActionManager.compile_action_spec(action, parsed_spec)
+        store_compiled_spec(db, key, compiled)
+        compiled_spec_cache.set(key, compiled)
+        action.spec_hash = key
+        return compiled
+
+    @staticmethod
+    def get_compiled_spec(action: models.Action) -> Dict[str, Any]:
+        """Compiled spec of an action: process cache, then the stored row, compiling only as a last resort"""
+        key = spec_hash(action)
+        compiled = compiled_spec_cache.get(key)
+        if compiled is None:
+            db = object_session(action)
+            compiled = load_compiled_spec(db, key) if db is not None else None
+            if compiled is None:
+                # Saved before specs were compiled, or changed outside create/update
+                compiled = ActionManager.compile_action_spec(action)
+            compiled_spec_cache.set(key, compiled)
+        return compiled
+
+    @staticmethod
+    def _custom_action_response(action: models.Action, status_code: int, result: Dict[str, Any], context: dict,
+                                endpoint: str, original_endpoint: str, request_params: dict, headers: dict,
+                                path_params_used: list, cache: Dict[str, Any] = None):
+        # Return detailed result with context for future actions
+        # Mask sensitive data for logging/display
+        safe_headers = mask_sensitive_fields(headers)
+        safe_params = mask_sensitive_fields(request_params)
+
+        response = {
+            "type": "custom_action",
+            "success": True,
+            "status_code": status_code,
+            "result": result,
+            "context": context,
+            "action_name": action.name,
+            "endpoint_called": endpoint,
+            "original_endpoint": original_endpoint,
+            "method_used": action.method.upper(),
+            "parameters_sent": safe_params,
+            "headers_sent": safe_headers,
+            "path_params_used": path_params_used,
+            "authentication_used": bool(action.api_key),
+            "background": False
+        }
+        if cache is not None:
+            response["cache"] = cache
+        return response
+
     @staticmethod
     def _execute_custom_action(action: models.Action, parameters: dict, context: dict = None):
+        held_bulkhead = None
         try:
-            # Validate that we have an endpoint
-            if not action.endpoint:
-                raise ValueError(f"Action '{action.name}' has no endpoint configured")
-            
-            # Try to fix incomplete endpoint URLs
+            # URL fixing, validation and YAML parsing were done when the action was saved
             original_endpoint = action.endpoint
-            fixed_endpoint = ActionManager._fix_endpoint_url(action.endpoint, action.name)
-            
-            # Validate that endpoint is a complete URL
-            if not validate_url(fixed_endpoint):
-                raise ValueError(f"Action '{action.name}' endpoint must be a complete URL starting with http:// or https://. Current endpoint: '{original_endpoint}'. Please update the action with a complete URL like 'https://api.rootly.com/v1/incidents/{{id}}'")
-            
-            # Use the fixed endpoint
-            base_endpoint = fixed_endpoint
-            
+            spec = ActionManager.get_compiled_spec(action)
+            if spec["endpoint_error"]:
+                raise ValueError(spec["endpoint_error"])
+
             # Prepare request based on action method
-            headers = action.headers or {}
-            
-            # Add default Content-Type if not present
-            if 'Content-Type' not in headers and action.method.upper() == "POST":
-                headers['Content-Type'] = 'application/json'
-
-            # Add API Key to headers if provided
-            if action.api_key:
-                # Check if Authorization header already exists
-                if 'Authorization' not in headers:
-                    # For Rootly API, use Bearer token format
-                    if 'rootly' in action.name.lower() or 'rootly.com' in base_endpoint:
-                        headers['Authorization'] = f'Bearer {action.api_key}'
-                    else:
-                        # Default to Bearer token for most APIs
-                        headers['Authorization'] = f'Bearer {action.api_key}'
-                # If Authorization header exists but is a template, replace it
-                elif headers['Authorization'].startswith('{{') and headers['Authorization'].endswith('}}'):
-                    headers['Authorization'] = f'Bearer {action.api_key}'
+            headers = dict(spec["headers"])
+
+            # Add API Key to headers if provided (Bearer token for most APIs)
+            if action.api_key and spec["auth_from_api_key"]:
+                headers['Authorization'] = f'Bearer {action.api_key}'
 
             # Create a copy of parameters to avoid modifying the original
             request_params = parameters.copy()
             
-            # Add context to parameters if available (but don't include in path replacement)
-            if context:
-                request_params["context"] = context
+            # Request bodies carry only the context paths the action declares in
+            # config["context_projection"] ({"body_field": "context.path"}); by default
+            # nothing from the run context leaves the process
+            if spec["method"] in ("POST", "PUT"):
+                projected = project_context(context, (action.config or {}).get("context_projection"))
+                for field, value in projected.items():
+                    request_params.setdefault(field, value)
 
             # Replace path parameters in endpoint
-            endpoint = base_endpoint
-            path_params_used = []
-            
-            if endpoint and parameters:
-                for key, value in parameters.items():
-                    if f"{{{key}}}" in endpoint:
-                        # Validate parameter value - extract ID from URL if needed
-                        str_value = extract_id_from_url(str(value), key)
-                        
-                        endpoint = endpoint.replace(f"{{{key}}}", str_value)
-                        path_params_used.append(key)
-
-            # Validate that all path parameters were replaced
-            import re
-            remaining_params = re.findall(r'\{([^}]+)\}', endpoint)
+            endpoint = spec["endpoint"]
+            path_params_used = [key for key in spec["path_params"] if key in parameters]
+            remaining_params = [key for key in spec["path_params"] if key not in parameters]
             if remaining_params:
                 raise ValueError(f"Missing required path parameters: {', '.join(remaining_params)}")
 
-            # Make the HTTP request
-            if action.method.upper() == "GET":
-                # Remove path parameters from query params
-                query_params = {k: v for k, v in request_params.items() 
-                              if k not in path_params_used and k != "context"}
-                
-                response = requests.get(endpoint, params=query_params, headers=headers, timeout=30)
-                
-            elif action.method.upper() == "POST":
-                # Remove path parameters from body
-                body_params = {k: v for k, v in request_params.items() 
-                             if k not in path_params_used}
-                
-                response = requests.post(endpoint, json=body_params, headers=headers, timeout=30)
-                
-            elif action.method.upper() == "PUT":
-                # Remove path parameters from body
-                body_params = {k: v for k, v in request_params.items() 
-                             if k not in path_params_used}
-                
-                response = requests.put(endpoint, json=body_params, headers=headers, timeout=30)
-                
-            elif action.method.upper() == "DELETE":
-                # Remove path parameters from query params
-                query_params = {k: v for k, v in request_params.items() 
-                              if k not in path_params_used and k != "context"}
-                
-                response = requests.delete(endpoint, params=query_params, headers=headers, timeout=30)
-                
-            else:
+            for key in path_params_used:
+                # Validate parameter value - extract ID from URL if needed
+                endpoint = endpoint.replace(f"{{{key}}}", extract_id_from_url(str(parameters[key]), key))
+
+            if spec["method"] not in ("GET", "DELETE", "POST", "PUT"):
                 raise ValueError(f"Unsupported HTTP method: {action.method}")
 
-            # Check if the request was successful
-            response.raise_for_status()
-            
-            # Try to parse JSON response
-            try:
-                raw_result = response.json()
-                
-                # Filter response based on YAML schema if available
-                if action.yaml_spec:
-                    response_schema = ActionManager.extract_response_schema_from_yaml(action.yaml_spec)
-                    if response_schema:
-                        filtered_result = ActionManager.filter_response_by_schema(raw_result, response_schema)
-                        result = {
-                            "filtered_data": filtered_result,
-                            "raw_data": raw_result,
-                            "schema_applied": True,
-                            "schema_used": response_schema
-                        }
-                    else:
-                        result = {
-                            "data": raw_result,
-                            "schema_applied": False,
-                            "note": "No response schema found in YAML spec"
-                        }
-                else:
-                    result = {
-                        "data": raw_result,
-                        "schema_applied": False,
-                        "note": "No YAML spec available for filtering"
+            # Each parameter goes where the action declares it: query string, body or headers
+            query_params, body_params, header_params = ActionManager._route_parameters(
+                action, spec["method"], request_params, path_params_used)
+            headers.update(header_params)
+
+            # Idempotent reads may be served from the cross-run result cache
+            cache_ttl = action_cache_ttl(action) if spec["method"] == "GET" else 0
+            cache_key = None
+            if spec["method"] == "GET":
+                cache_key = action_cache_key(action, endpoint, _request_key(query_params, body_params), headers)
+            if cache_ttl > 0:
+                cached = None if cache_bypassed() else action_result_cache.get(cache_key)
+                if cached is not None:
+                    (status_code, result), age = cached
+                    return ActionManager._custom_action_response(
+                        action, status_code, result, context, endpoint, original_endpoint,
+                        request_params, headers, path_params_used,
+                        cache={"hit": True, "age_seconds": round(age, 3), "ttl_seconds": cache_ttl}
+                    )
+
+            # List actions may read every page; a listing is never kept by the HTTP cache
+            pagination = pagination_settings(action.config) if spec["method"] == "GET" else None
+
+            # Responses the API marked cacheable are served while fresh and revalidated once stale
+            http_entry = None
+            request_headers = headers
+            if cache_key is not None and not pagination and not cache_bypassed():
+                http_entry = http_cache_lookup(cache_key)
+                if http_entry is not None and http_entry["fresh"]:
+                    return ActionManager._custom_action_response(
+                        action, http_entry["status_code"], http_entry["result"], context, endpoint,
+                        original_endpoint, request_params, headers, path_params_used,
+                        cache={"hit": True, "source": "http", "revalidated": False,
+                               "age_seconds": round(http_entry["age_seconds"], 3)}
+                    )
+                if http_entry is not None:
+                    request_headers = {**headers, **conditional_headers(http_entry)}
+
+            # Make the HTTP request over the keep-alive session of the API host
+            request_started = time.perf_counter()
+            request_bytes = 0
+            request_kwargs = {}
+            if query_params or spec["method"] in ("GET", "DELETE"):
+                request_kwargs["params"] = query_params
+            if body_params or spec["method"] in ("POST", "PUT"):
+                request_bytes = len(json.dumps(body_params, default=str))
+                request_kwargs["json"] = body_params
+
+            # A slow or rate-limited API only holds up the calls that use it: the slot is kept
+            # until the body (every page of a listing) is read, every attempt takes a rate-limit token
+            bulkhead, rate_limit = outbound_limits.for_call(action.id, endpoint, action.config)
+            if bulkhead:
+                bulkhead[0].acquire(bulkhead[1])
+                held_bulkhead = bulkhead[0]
+
+            # Transient failures are retried per the action's policy; a failing host is short-circuited
+            policy = retry_policy(action.config, spec["method"])
+
+            def send(url: str, **kwargs):
+                return send_with_retries(
+                    url,
+                    lambda: http_pool.request(spec["method"], url, stream=True,
+                                              timeout=call_timeout(ACTION_TIMEOUT_SECONDS), **kwargs),
+                    policy,
+                    rate_limit=rate_limit
+                )
+
+            limits = response_limits(action.config)
+            response_schema = spec["response_schema"] if spec["has_yaml_spec"] else None
+            projecting = bool(response_schema)
+
+            if pagination:
+                # Pages are projected as they arrive; the fields pagination reads are kept too
+                paths = kept_paths(pagination)
+                plan = keep_paths(spec["projection"], paths) if projecting else None
+                projector = projector_for(f"{spec['spec_hash']}:{'|'.join(paths)}", plan) if projecting else None
+
+                def fetch_page(url: str, params: dict) -> dict:
+                    page_started = time.perf_counter()
+                    page_body = None
+                    page = send(url, headers=headers, params=params,
+                                **({"json": body_params} if body_params else {}))
+                    try:
+                        page.raise_for_status()
+                        page_body = read_response(page, plan=plan, projector=projector, max_bytes=limits["max_bytes"],
+                                                  oversize=limits["oversize"], keep_raw=False)
+                    except ResponseTooLarge:
+                        if limits["oversize"] != "truncate":
+                            raise
+                        # Cut at the cap but unreadable in part: the listing ends here
+                        page_body = {"json": False, "value": None, "projected": None,
+                                     "bytes_read": limits["max_bytes"], "truncated": True}
+                    finally:
+                        record_http_call((time.perf_counter() - page_started) * 1000, 0,
+                                         page_body["bytes_read"] if page_body else 0)
+                    # A page cut at the size cap stops the listing (stop_reason "max_bytes") whatever it holds
+                    if not page_body["json"] and not page_body["truncated"]:
+                        raise ValueError("Paginated responses must be JSON")
+                    return {
+                        "status_code": page.status_code,
+                        "headers": page.headers,
+                        "links": page.links,
+                        "data": page_body["projected"] if projecting else page_body["value"],
+                        "bytes_read": page_body["bytes_read"],
+                        "truncated": page_body["truncated"]
                     }
-                    
-            except ValueError:
+
+                listing = fetch_all_pages(fetch_page, endpoint, request_kwargs["params"], pagination)
+                status_code, response_headers = listing["status_code"], listing["headers"]
+                body = {"json": True, "value": listing["data"], "projected": listing["data"],
+                        "bytes_read": listing["bytes_read"], "truncated": listing["truncated"]}
+                limits = {**limits, "keep_raw": False}
+            else:
+                response = send(endpoint, headers=request_headers, **request_kwargs)
+                status_code, response_headers = response.status_code, response.headers
+
+                # Error bodies are read by the HTTPError handler; success bodies stream in under the size cap
+                body = None
+                try:
+                    if http_entry is not None and response.status_code == 304:
+                        # Not modified: the stored body is still current
+                        response.close()
+                        http_cache_revalidated(cache_key, http_entry, response.headers)
+                        return ActionManager._custom_action_response(
+                            action, http_entry["status_code"], http_entry["result"], context, endpoint,
+                            original_endpoint, request_params, headers, path_params_used,
+                            cache={"hit": True, "source": "http", "revalidated": True,
+                                   "age_seconds": round(http_entry["age_seconds"], 3)}
+                        )
+                    response.raise_for_status()
+                    body = read_response(
+                        response,
+                        plan=spec["projection"] if projecting else None,
+                        projector=projector_for(spec["spec_hash"], spec["projection"]) if projecting else None,
+                        max_bytes=limits["max_bytes"], oversize=limits["oversize"], keep_raw=limits["keep_raw"]
+                    )
+                finally:
+                    record_http_call((time.perf_counter() - request_started) * 1000, request_bytes,
+                                     body["bytes_read"] if body else 0)
+
+            if not body["json"]:
                 # If response is not JSON, return the text content
                 result = {
-                    "content": response.text,
-                    "content_type": response.headers.get('content-type', 'text/plain'),
+                    "content": body["text"],
+                    "content_type": response_headers.get('content-type', 'text/plain'),
                     "schema_applied": False
                 }
+            elif projecting:
+                # Filter response based on the YAML schema; the raw body is kept only on request
+                result = {
+                    "filtered_data": body["projected"],
+                    "schema_applied": True,
+                    "schema_used": response_schema
+                }
+                if limits["keep_raw"]:
+                    result["raw_data"] = body["value"]
+            elif spec["has_yaml_spec"]:
+                result = {
+                    "data": body["value"],
+                    "schema_applied": False,
+                    "note": "No response schema found in YAML spec"
+                }
+            else:
+                result = {
+                    "data": body["value"],
+                    "schema_applied": False,
+                    "note": "No YAML spec available for filtering"
+                }
+            if body["truncated"]:
+                result["truncated"] = True
+                result["bytes_read"] = body["bytes_read"]
+            if pagination:
+                result["pagination"] = listing["pagination"]
+
+            cache = None
+            if cache_key is not None:
+                result_size = len(json.dumps(result, default=str))
+                cache = {"hit": False, "bypassed": cache_bypassed()}
+                if cache_ttl > 0:
+                    cache["stored"] = action_result_cache.set(
+                        cache_key, (status_code, result), result_size, cache_ttl
+                    )
+                    cache["ttl_seconds"] = cache_ttl
+                # A cut-short body is never kept as the response
+                cache["http_stored"] = not body["truncated"] and not pagination and http_cache_store(
+                    cache_key, status_code, result, result_size, response_headers
+                )
+
+            return ActionManager._custom_action_response(
+                action, status_code, result, context, endpoint, original_endpoint,
+                request_params, headers, path_params_used, cache=cache
+            )
             
-            # Return detailed result with context for future actions
-            # Mask sensitive data for logging/display
-            safe_headers = mask_sensitive_fields(headers)
-            safe_params = mask_sensitive_fields(request_params)
-            
+        except DeadlineExceeded:
             return {
                 "type": "custom_action",
-                "success": True,
-                "status_code": response.status_code,
-                "result": result,
-                "context": context,
+                "success": False,
+                "error": "Run deadline exceeded before the API could be called",
+                "deadline_exceeded": True,
                 "action_name": action.name,
-                "endpoint_called": endpoint,
-                "original_endpoint": original_endpoint,
-                "method_used": action.method.upper(),
-                "parameters_sent": safe_params,
-                "headers_sent": safe_headers,
-                "path_params_used": path_params_used,
-                "authentication_used": bool(action.api_key),
+                "endpoint_called": original_endpoint,
                 "background": False
             }
-            
+
+        except OutboundLimitExceeded as e:
+            return {
+                "type": "custom_action",
+                "success": False,
+                "error": str(e),
+                e.reason: True,
+                "action_name": action.name,
+                "endpoint_called": original_endpoint,
+                "background": False
+            }
+
+        except CircuitOpenError as e:
+            return {
+                "type": "custom_action",
+                "success": False,
+                "error": str(e),
+                "circuit_open": True,
+                "retry_in_seconds": round(e.retry_in, 3),
+                "action_name": action.name,
+                "endpoint_called": original_endpoint,
+                "background": False
+            }
+
         except requests.exceptions.Timeout:
+            if deadline_exceeded():
+                # The timeout was the remaining run budget, not the API's own limit
+                return {
+                    "type": "custom_action",
+                    "success": False,
+                    "error": "Run deadline exceeded while waiting for the API",
+                    "deadline_exceeded": True,
+                    "action_name": action.name,
+                    "endpoint_called": original_endpoint,
+                    "background": False
+                }
             return {
                 "type": "custom_action",
                 "success": False,
@@ -551,28 +884,45 @@ Respond directly to the user's request now:"""
                 "background": False
             }
 
+        finally:
+            if held_bulkhead is not None:
+                held_bulkhead.release()
+
     @staticmethod
     def parse_yaml_spec(yaml_content: str):
         try:
-            spec = yaml.safe_load(yaml_content)
+            # The libyaml loader when PyYAML was built with it: several times faster on large specs
+            spec = yaml.load(yaml_content, Loader=YAML_SAFE_LOADER)
             return spec
         except Exception as e:
             raise ValueError(f"Error parsing YAML: {str(e)}")
 
     @staticmethod
     def generate_parameters_from_yaml(yaml_spec: str):
-        spec = ActionManager.parse_yaml_spec(yaml_spec)
+        return ActionManager._parameters_from_spec(ActionManager.parse_yaml_spec(yaml_spec))
+
+    @staticmethod
+    def _parameters_from_spec(spec: dict, resolver: RefResolver = None):
+        """Parameters of every operation of an already parsed spec, merged by name.
+
+        Parameters and their schemas may be $refs to components; `resolver` is
+        shared with the other helpers walking the same spec.
+        """
+        resolver = resolver or RefResolver(spec)
         parameters = {}
 
         # Extract parameters from OpenAPI spec
         if 'paths' in spec:
             for path, methods in spec['paths'].items():
                 for method, details in methods.items():
-                    if 'parameters' in details:
+                    if isinstance(details, dict) and 'parameters' in details:
                         for param in details['parameters']:
+                            param = resolver.resolve(param)
+                            if 'name' not in param:
+                                continue
                             param_name = param['name']
                             parameters[param_name] = {
-                                'type': param.get('schema', {}).get('type', 'string'),
+                                'type': resolver.resolve(param.get('schema') or {}).get('type', 'string'),
                                 'required': param.get('required', False),
                                 'description': param.get('description', '')
                             }
@@ -584,19 +934,34 @@ Respond directly to the user's request now:"""
         """Extract the expected response schema from OpenAPI YAML"""
         try:
             spec = ActionManager.parse_yaml_spec(yaml_spec)
+        except ValueError as e:
+            logger.warning("Error extracting response schema: %s", e)
+            return {}
+        return ActionManager._response_schema_from_spec(spec)
+
+    @staticmethod
+    def _response_schema_from_spec(spec: dict, resolver: RefResolver = None):
+        """Schema of the first 2xx response of an already parsed OpenAPI spec.
+
+        Responses and the schema itself may be $refs to components; the top-level
+        reference is resolved, nested ones are left for the projection and preview.
+        """
+        resolver = resolver or RefResolver(spec)
+        try:
             response_schema = {}
             
             if 'paths' in spec:
                 for path, methods in spec['paths'].items():
                     for method, details in methods.items():
-                        if 'responses' in details:
+                        if isinstance(details, dict) and 'responses' in details:
                             # Look for successful responses (200, 201, etc.)
                             for status_code, response_info in details['responses'].items():
-                                if status_code.startswith('2'):  # 2xx success codes
+                                if str(status_code).startswith('2'):  # 2xx success codes
+                                    response_info = resolver.resolve(response_info)
                                     if 'content' in response_info:
                                         for content_type, content_info in response_info['content'].items():
                                             if 'schema' in content_info:
-                                                response_schema = content_info['schema']
+                                                response_schema = resolver.resolve(content_info['schema'])
                                                 break
                                     break
                         if response_schema:
@@ -606,64 +971,69 @@ Respond directly to the user's request now:"""
             
             return response_schema
         except Exception as e:
-            print(f"Error extracting response schema: {e}")
+            logger.warning("Error extracting response schema: %s", e)
             return {}
 
     @staticmethod
-    def filter_response_by_schema(response_data: dict, schema: dict):
-        """Filter response data based on the expected schema"""
+    def filter_response_by_schema(response_data: dict, schema: dict, spec: dict = None):
+        """Filter response data based on the expected schema.
+
+        Follows nested objects, array items, additionalProperties and allOf/oneOf/anyOf;
+        $ref is resolved against `spec` when given. Actions use the projection compiled
+        with their spec instead of compiling the schema on every call.
+        """
         if not schema or not response_data:
             return response_data
-        
-        def extract_by_schema(data, schema_part):
-            if not isinstance(schema_part, dict) or not isinstance(data, dict):
-                return data
-            
-            if 'properties' in schema_part:
-                filtered = {}
-                for prop_name, prop_schema in schema_part['properties'].items():
-                    if prop_name in data:
-                        if 'properties' in prop_schema:
-                            # Nested object
-                            filtered[prop_name] = extract_by_schema(data[prop_name], prop_schema)
-                        else:
-                            # Simple property
-                            filtered[prop_name] = data[prop_name]
-                return filtered
-            else:
-                return data
-        
-        return extract_by_schema(response_data, schema)
+        return build_projector(compile_projection(schema, spec))(response_data)
 
     @staticmethod
-    def _generate_schema_preview(schema: dict):
-        """Generate a preview of what data will be extracted based on schema"""
+    def _generate_schema_preview(schema: dict, spec: dict = None, resolver: RefResolver = None):
+        """Generate a preview of what data will be extracted based on schema.
+
+        $refs are followed against `spec`; a reference back to a schema being
+        previewed shows as "<Name>" instead of recursing.
+        """
         if not schema or not isinstance(schema, dict):
             return None
-        
-        def build_preview(schema_part, level=0):
-            if level > 3:  # Prevent infinite recursion
-                return "..."
-            
-            if 'properties' in schema_part:
-                preview = {}
-                for prop_name, prop_schema in schema_part['properties'].items():
-                    if 'properties' in prop_schema:
-                        # Nested object
-                        preview[prop_name] = build_preview(prop_schema, level + 1)
-                    else:
-                        # Simple property
-                        prop_type = prop_schema.get('type', 'unknown')
-                        preview[prop_name] = f"<{prop_type}>"
-                return preview
-            else:
-                return f"<{schema_part.get('type', 'unknown')}>"
+        resolver = resolver or RefResolver(spec)
+
+        def properties_of(schema_part):
+            properties = dict(schema_part.get('properties') or {})
+            for member in schema_part.get('allOf') or []:
+                properties.update(resolver.resolve(member).get('properties') or {})
+            return properties
+
+        def build_preview(schema_part, level=0, refs=()):
+            ref = schema_part.get('$ref') if isinstance(schema_part, dict) else None
+            if ref:
+                if ref in refs:
+                    return f"<{ref_name(ref)}>"
+                refs = refs + (ref,)
+                schema_part = resolver.resolve(schema_part)
+            if not isinstance(schema_part, dict):
+                return "<unknown>"
+
+            properties = properties_of(schema_part)
+            if properties:
+                if level > 3:  # Prevent infinite recursion
+                    return "..."
+                return {prop_name: build_preview(prop_schema, level + 1, refs)
+                        for prop_name, prop_schema in properties.items()}
+            if schema_part.get('type') == 'array' and schema_part.get('items'):
+                if level > 3:
+                    return "..."
+                return [build_preview(schema_part['items'], level + 1, refs)]
+            return f"<{schema_part.get('type', 'unknown')}>"
         
         return build_preview(schema)
 
     @staticmethod
     def generate_headers_from_yaml(yaml_spec: str, api_key: str = None):
-        spec = ActionManager.parse_yaml_spec(yaml_spec)
+        return ActionManager._headers_from_spec(ActionManager.parse_yaml_spec(yaml_spec), api_key)
+
+    @staticmethod
+    def _headers_from_spec(spec: dict, api_key: str = None):
+        """Header templates for the apiKey security schemes of an already parsed spec"""
         headers = {}
 
         # Extract security schemes from OpenAPI spec
@@ -705,8 +1075,10 @@ Respond directly to the user's request now:"""
         for field, value in update_data.items():
             setattr(db_action, field, value)
 
+        ActionManager.store_compiled_spec(db, db_action)
         db.commit()
         db.refresh(db_action)
+        invalidate_action(db_action.id)
         return db_action
 
     @staticmethod
@@ -717,4 +1089,5 @@ Respond directly to the user's request now:"""
 
         db.delete(db_action)
         db.commit()
+        invalidate_action(action_id)
         return True
\ No newline at end of file
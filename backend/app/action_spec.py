@@ -0,0 +1,71 @@
+"""
+Compiled form of custom action specs.
+
+Everything the execution path needs from an action definition (endpoint
+template, path parameters, header template, response schema) is derived once
+when the action is saved, stored in compiled_action_specs under a hash of the
+definition and kept in a per-process cache, so executing an action parses no
+YAML and runs no URL validation.
+"""
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import threading
+
+from app import models
+
+# Bump when the compiled layout changes so stale entries are recompiled
+SPEC_COMPILER_VERSION = 2
+ACTION_SPEC_CACHE_SIZE = int(os.getenv("ACTION_SPEC_CACHE_SIZE", "512"))
+
+
+def spec_hash(action) -> str:
+    """Hash of every action field the compiled spec depends on (never the API key itself)"""
+    return hashlib.sha256(json.dumps([
+        SPEC_COMPILER_VERSION, action.name, action.endpoint, (action.method or "").upper(),
+        action.headers or {}, action.yaml_spec or ""
+    ], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class CompiledSpecCache:
+    """Thread-safe LRU of compiled specs by spec hash"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+            return compiled
+
+    def set(self, key: str, compiled: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_compiled_spec(db: Session, key: str) -> Optional[Dict[str, Any]]:
+    row = db.query(models.CompiledActionSpec).filter(models.CompiledActionSpec.spec_hash == key).first()
+    return row.compiled if row else None
+
+
+def store_compiled_spec(db: Session, key: str, compiled: Dict[str, Any]):
+    """Persist a compiled spec; identical definitions share one row"""
+    if not db.query(models.CompiledActionSpec.id).filter(models.CompiledActionSpec.spec_hash == key).first():
+        db.add(models.CompiledActionSpec(spec_hash=key, compiled=compiled))
+
+
+compiled_spec_cache = CompiledSpecCache(ACTION_SPEC_CACHE_SIZE)
@@ -2,13 +2,37 @@ from sqlalchemy.orm import Session
 from app import models, schemas
 from app.llm_manager import LLMManager
 from app.action_manager import ActionManager
+from app.checkpoint_manager import (
+    CheckpointManager, RunAlreadyExecuting, new_cursor, empty_results, new_execution_owner
+)
+from app.telemetry import track_step, time_phase, record_run, merge_step_metrics, speculation_stats
+from app.logging_config import log_context
+from app.deadline import (
+    run_deadline, remaining_seconds, deadline_exceeded, raise_if_deadline_exceeded, DeadlineExceeded
+)
+from app.action_cache import cache_bypass, cache_bypassed
+from app import conversation_memory
 from app.utils import (
     safe_json_parse, ContextBuilder, clean_action_result,
-    handle_exceptions, format_llm_prompt
+    clean_user_facing_action, handle_exceptions, format_llm_prompt, json_safe_copy
 )
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from typing import List, Dict, Any
 import json
+import logging
+import os
 import re
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Threads running speculative branch prefetches for agents with "speculative_prefetch" in their config
+SPECULATIVE_PREFETCH_WORKERS = int(os.getenv("SPECULATIVE_PREFETCH_WORKERS", "4"))
+_speculation_pool = ThreadPoolExecutor(max_workers=SPECULATIVE_PREFETCH_WORKERS,
+                                       thread_name_prefix="speculative-prefetch")
 
 class AgentManager:
     @staticmethod
@@ -20,6 +44,10 @@ class AgentManager:
             if not action or not action.parameters:
                 return {}
             
+            # Earlier turns of a multi-turn run, compacted to a fixed budget
+            conversation = conversation_memory.memory_view(context)
+            conversation_section = f"\nCONVERSATION SO FAR:\n{conversation}\n" if conversation else ""
+
             # Build a focused prompt to extract only the necessary parameters
             extraction_prompt = f"""Extract specific parameters for the {action_name} action from the user's request and context.
 
@@ -27,7 +55,7 @@ ACTION: {action_name}
 REQUIRED PARAMETERS: {json.dumps(action.parameters, indent=2)}
 
 USER REQUEST: {context.get('user_input', '')}
-
+{conversation_section}
 EXTRACTION RULES:
 1. Look for exact matches to the required parameters in the user's request
 2. For "id" parameters: Extract incident IDs, ticket numbers, case numbers, etc.
@@ -61,7 +89,8 @@ Extract parameters now (JSON only):"""
             return {}
             
         except Exception as e:
-            print(f"Error extracting parameters for {action_name}: {e}")
+            raise_if_deadline_exceeded(e)
+            logger.warning("Error extracting parameters for %s: %s", action_name, e)
             return {}
 
     @staticmethod
@@ -130,151 +159,479 @@ Extract parameters now (JSON only):"""
         return db.query(models.Agent).offset(skip).limit(limit).all()
 
     @staticmethod
-    def _execute_action_flow(db: Session, agent: models.Agent, actions: List[Dict], shared_context: Dict, llm: models.LLM, input_data: schemas.AgentRun, flow_type: str = "main"):
-        """Execute a flow of actions with support for conditional branching and Wait actions"""
-        actions_used = []
-        background_actions = []
-        user_facing_actions = []
-        
-        for i, action_config in enumerate(actions):
-            # Skip actions that don't belong to this flow
-            if action_config.get("flow_type", "main") != flow_type:
-                continue
-                
-            action_name = action_config["action_name"]
-            print(f"📋 Executing action {i+1}/{len(actions)}: {action_name} (flow: {flow_type})")
-            
-            actions_used.append(action_name)
-            
-            # Extract parameters intelligently from context for this action
+    def _resolve_flow_actions(agent: models.Agent, root_actions: List[Dict], frame: Dict[str, Any]) -> List[Dict]:
+        """Return the list of actions a cursor frame points into"""
+        if not frame.get("choice_action"):
+            return root_actions or []
+
+        conditional_flows = getattr(agent, 'conditional_flows', []) or []
+        for flow in conditional_flows:
+            if flow.get("choice_action") == frame["choice_action"]:
+                return flow.get(frame["flow_type"], []) or []
+        return []
+
+    @staticmethod
+    def _execute_step(db: Session, action_config: Dict, shared_context: Dict, llm: models.LLM, input_data: schemas.AgentRun):
+        """Extract parameters for a single action and execute it"""
+        action_name = action_config["action_name"]
+
+        # Extract parameters intelligently from context for this action
+        with time_phase("extraction"):
             extracted_params = AgentManager.extract_parameters_from_context(
                 db, action_name, shared_context, llm
             )
-            
-            print(f"🔍 Extracted parameters for {action_name}: {extracted_params}")
-            
-            # Prepare action parameters
-            action_parameters = {"input": input_data.input}
-            action_parameters.update(extracted_params)
-            
-            # Add validation criteria for Choice actions
-            if action_name == "Choice":
-                action_parameters["validation_criteria"] = action_config.get("prompt", "Validate the provided information")
-            
-            # Add wait message for Wait actions
-            if action_name == "Wait":
-                action_parameters["message"] = action_config.get("prompt", "Please provide additional information to continue.")
-                action_parameters["prompt"] = action_config.get("wait_prompt", "What additional information would you like to provide?")
-            
-            # Add custom prompt for Respond actions
-            if action_name == "Respond":
-                action_parameters["prompt"] = action_config.get("prompt", "")
-            
-            # Execute the action with enhanced context and extracted parameters
+
+        # Parameter values may carry user data, so only their names are logged
+        logger.debug("Extracted parameters for %s: %s", action_name, sorted(extracted_params), extra={"action": action_name})
+
+        # Prepare action parameters
+        # The current turn; earlier turns reach prompts through the conversation memory
+        action_parameters = {"input": shared_context.get("user_input", input_data.input)}
+        action_parameters.update(extracted_params)
+
+        # Add validation criteria for Choice actions
+        if action_name == "Choice":
+            action_parameters["validation_criteria"] = action_config.get("prompt", "Validate the provided information")
+
+        # Add wait message for Wait actions
+        if action_name == "Wait":
+            action_parameters["message"] = action_config.get("prompt", "Please provide additional information to continue.")
+            action_parameters["prompt"] = action_config.get("wait_prompt", "What additional information would you like to provide?")
+
+        # Add custom prompt for Respond actions
+        if action_name == "Respond":
+            action_parameters["prompt"] = action_config.get("prompt", "")
+
+        # Execute the action with enhanced context and extracted parameters
+        with time_phase("action"):
             action_result = ActionManager.execute_action(
                 db, action_name, action_parameters, shared_context
             )
-            
-            print(f"✅ Action {action_name} completed: {action_result.get('type', 'unknown')} - Success: {action_result.get('success', True)}")
-            
-            # Handle Wait action - pause execution and return
-            if action_result.get("pause_execution"):
-                return {
-                    "wait_required": True,
-                    "wait_message": action_result.get("content", "Please provide additional information."),
-                    "wait_prompt": action_result.get("prompt", "What would you like to add?"),
-                    "actions_used": actions_used,
-                    "background_actions": background_actions,
-                    "user_facing_actions": user_facing_actions,
-                    "shared_context": shared_context
-                }
-            
-            # Update shared context with action result
-            if action_result:
-                shared_context = AgentManager.build_enhanced_context(
-                    shared_context, action_result, action_name
+
+        return extracted_params, action_result
+
+    @staticmethod
+    def _start_speculation(db: Session, agent: models.Agent, actions: List[Dict], choice_action: str,
+                           shared_context: Dict, llm: models.LLM, input_data: schemas.AgentRun, run_id: str = None):
+        """Start the first step of each branch of a Choice while its decision is pending.
+
+        Only custom GET actions are started, since running the losing branch must have
+        no side effects. Each prefetch uses its own session and a copy of the context.
+        """
+        prefetches = {}
+        for branch in ("valid_flow", "invalid_flow"):
+            frame = {"flow_type": branch, "choice_action": choice_action, "index": 0}
+            branch_actions = AgentManager._resolve_flow_actions(agent, actions, frame)
+            index = next((i for i, config in enumerate(branch_actions)
+                          if config.get("flow_type", "main") == branch), None)
+            if index is None:
+                continue
+
+            action_config = branch_actions[index]
+            action = db.query(models.Action).filter(models.Action.name == action_config["action_name"]).first()
+            if not action or action.action_type == "native" or (action.method or "").upper() != "GET":
+                continue
+
+            future = _speculation_pool.submit(
+                AgentManager._speculate_step, db.get_bind(), agent.id, run_id, dict(action_config),
+                json_safe_copy(shared_context), llm.id, input_data, remaining_seconds(), cache_bypassed()
+            )
+            speculation_stats.record("started")
+            prefetches[branch] = {"choice_action": choice_action, "flow_type": branch, "index": index,
+                                  "action_name": action_config["action_name"], "future": future}
+        return prefetches
+
+    @staticmethod
+    def _speculate_step(bind, agent_id: int, run_id: str, action_config: Dict, shared_context: Dict,
+                        llm_id: int, input_data: schemas.AgentRun, deadline_seconds: float = None,
+                        bypass_cache: bool = False):
+        db = Session(bind=bind)
+        try:
+            llm = db.query(models.LLM).filter(models.LLM.id == llm_id).first()
+            with log_context(run_id=run_id, agent_id=agent_id), run_deadline(deadline_seconds), \
+                    cache_bypass(bypass_cache):
+                # Metrics are collected apart and only merged into the step that adopts the result
+                with track_step(None, agent_id, 0, action_config["action_name"], "speculative") as metrics:
+                    extracted_params, action_result = AgentManager._execute_step(
+                        db, action_config, shared_context, llm, input_data
+                    )
+            return extracted_params, action_result, metrics
+        finally:
+            db.close()
+
+    @staticmethod
+    def _settle_speculation(prefetches: Dict[str, Dict], chosen_flow: str = None):
+        """Keep the prefetch of the chosen branch and discard the others"""
+        for branch, prefetch in prefetches.items():
+            if branch == chosen_flow:
+                continue
+            # A prefetch that never started costs nothing; one that did is a wasted call
+            if not prefetch["future"].cancel():
+                speculation_stats.record("wasted", prefetch["action_name"])
+        return prefetches.get(chosen_flow)
+
+    @staticmethod
+    def _take_prefetched(prefetch: Dict[str, Any], frame: Dict[str, Any], index: int):
+        """Result of the prefetched step if it is the one about to run, else None"""
+        if (frame.get("choice_action") != prefetch["choice_action"]
+                or frame["flow_type"] != prefetch["flow_type"] or index != prefetch["index"]):
+            if not prefetch["future"].cancel():
+                speculation_stats.record("wasted", prefetch["action_name"])
+            return None
+        try:
+            result = prefetch["future"].result()
+        except Exception as e:
+            logger.warning("Speculative prefetch of %s failed, running it again: %s", prefetch["action_name"], e)
+            speculation_stats.record("failed")
+            return None
+        speculation_stats.record("used")
+        return result
+
+    @staticmethod
+    def _execute_action_flow(db: Session, agent: models.Agent, actions: List[Dict], shared_context: Dict, llm: models.LLM, input_data: schemas.AgentRun, flow_type: str = "main",
+                             cursor: List[Dict[str, Any]] = None, results: Dict[str, List] = None, run_id: str = None,
+                             owner: str = None):
+        """Execute a flow of actions with support for conditional branching and Wait actions.
+
+        Execution is driven by a cursor: a stack of frames, one per active flow, each holding
+        the index of the next action to run. A Choice action pushes a frame for the branch it
+        selected, so the cursor always says exactly where the run stands. When a run_id is
+        given the cursor, context and accumulated results are checkpointed after every step;
+        with an `owner` the run stops as soon as another execution has taken it over.
+        """
+        cursor = [dict(frame) for frame in cursor] if cursor else new_cursor(flow_type)
+        results = results or empty_results()
+        actions_used = list(results.get("actions_used", []))
+        background_actions = list(results.get("background_actions", []))
+        user_facing_actions = list(results.get("user_facing_actions", []))
+        speculative = bool((getattr(agent, "config", None) or {}).get("speculative_prefetch"))
+        prefetched = speculation = None
+
+        def save_checkpoint(status: str = "running"):
+            if run_id:
+                return CheckpointManager.save_checkpoint(
+                    db, run_id, cursor, shared_context,
+                    {
+                        "actions_used": actions_used,
+                        "background_actions": background_actions,
+                        "user_facing_actions": user_facing_actions
+                    },
+                    status=status,
+                    input_text=input_data.input,
+                    owner=owner
                 )
-                
-                # Handle Choice action - execute conditional flow
-                if action_result.get("conditional_flow"):
-                    decision = action_result.get("decision", "invalid")
-                    next_flow = "valid_flow" if decision == "valid" else "invalid_flow"
-                    
-                    print(f"🔀 Choice action decided: {decision} -> executing {next_flow}")
-                    
-                    # Find and execute the appropriate conditional flow
-                    conditional_flows = getattr(agent, 'conditional_flows', []) or []
-                    for flow in conditional_flows:
-                        if flow.get("choice_action") == action_name:
-                            flow_actions = flow.get(next_flow, [])
-                            if flow_actions:
-                                # Recursively execute the conditional flow
-                                agent_manager = AgentManager()
-                                conditional_result = agent_manager._execute_action_flow(
-                                    db, agent, flow_actions, shared_context, llm, input_data, next_flow
-                                )
-                                
-                                # Merge results
-                                actions_used.extend(conditional_result["actions_used"])
-                                background_actions.extend(conditional_result["background_actions"])
-                                user_facing_actions.extend(conditional_result["user_facing_actions"])
-                                shared_context = conditional_result["shared_context"]
-                                
-                                # Handle wait from conditional flow
-                                if conditional_result.get("wait_required"):
-                                    return conditional_result
-                            break
-                    
-                    # Add the choice action to background actions
-                    background_actions.append({
-                        "action": action_name,
-                        "result": action_result,
-                        "parameters_used": extracted_params,
-                        "iteration": len(background_actions) + 1,
-                        "choice_decision": decision
-                    })
-                    
-                # Handle other action types
-                elif action_result.get("background", False):
-                    # Background action (like Thinking) - enriches context
-                    background_actions.append({
-                        "action": action_name,
-                        "result": action_result,
-                        "parameters_used": extracted_params,
-                        "iteration": len(background_actions) + 1
-                    })
-                    print(f"🧠 Background action {action_name} added to context")
-                    
-                elif action_name == "Respond":
-                    # User-facing response action
-                    user_facing_actions.append({
-                        "action": action_name,
-                        "result": action_result,
-                        "parameters_used": extracted_params,
-                        "iteration": len(user_facing_actions) + 1
-                    })
-                    print(f"💬 Response action {action_name} completed")
-                    
-                else:
-                    # Custom actions (like Rootly API calls)
-                    background_actions.append({
-                        "action": action_name,
-                        "result": action_result,
-                        "parameters_used": extracted_params,
-                        "iteration": len(background_actions) + 1,
-                        "custom_action": True
-                    })
-                    print(f"🔧 Custom action {action_name} completed and added to context")
-        
+
+        def stop_at_deadline():
+            save_checkpoint("deadline_exceeded")
+            logger.info("Run deadline exceeded after %d steps", len(actions_used))
+            return {
+                "deadline_exceeded": True,
+                "actions_used": actions_used,
+                "background_actions": background_actions,
+                "user_facing_actions": user_facing_actions,
+                "shared_context": shared_context
+            }
+
+        try:
+            while cursor:
+                frame = cursor[-1]
+                frame_actions = AgentManager._resolve_flow_actions(agent, actions, frame)
+                if frame["index"] >= len(frame_actions):
+                    # Flow finished - return to the flow that branched into it
+                    cursor.pop()
+                    if frame.get("choice_entry"):
+                        # The Choice is recorded after the actions of its branch
+                        background_actions.append({**frame["choice_entry"],
+                                                   "iteration": len(background_actions) + 1})
+                    continue
+
+                # Out of time: stop before the next step so the cursor still points at it
+                if deadline_exceeded():
+                    return stop_at_deadline()
+
+                i = frame["index"]
+                action_config = frame_actions[i]
+                frame["index"] = i + 1
+
+                # Skip actions that don't belong to this flow
+                if action_config.get("flow_type", "main") != frame["flow_type"]:
+                    continue
+
+                action_name = action_config["action_name"]
+                actions_used.append(action_name)
+                step_log = {"step": len(actions_used), "action": action_name}
+                logger.debug("Executing action %d/%d in flow %s", i + 1, len(frame_actions), frame["flow_type"], extra=step_log)
+
+                if speculative and action_name == "Choice":
+                    speculation = AgentManager._start_speculation(
+                        db, agent, actions, action_name, shared_context, llm, input_data, run_id
+                    )
+
+                try:
+                    with track_step(run_id, agent.id, len(actions_used), action_name, frame["flow_type"]) as step_metrics:
+                        prefetch_result = AgentManager._take_prefetched(prefetched, frame, i) if prefetched else None
+                        prefetched = None
+                        if prefetch_result is not None:
+                            extracted_params, action_result, prefetch_metrics = prefetch_result
+                            merge_step_metrics(step_metrics, prefetch_metrics)
+                        else:
+                            extracted_params, action_result = AgentManager._execute_step(
+                                db, action_config, shared_context, llm, input_data
+                            )
+                        if action_result.get("deadline_exceeded"):
+                            raise DeadlineExceeded(action_result.get("error") or "Run deadline exceeded")
+                        if action_result.get("success") is False:
+                            step_metrics["status"] = "error"
+                            step_metrics["error"] = action_result.get("error")
+                except DeadlineExceeded:
+                    # The step was cut short, so it is not done: leave the cursor on it
+                    # and let a resume run it again
+                    frame["index"] = i
+                    actions_used.pop()
+                    return stop_at_deadline()
+
+                logger.debug("Action completed: type=%s success=%s", action_result.get("type", "unknown"),
+                             action_result.get("success", True), extra=step_log)
+
+                if speculation:
+                    chosen_flow = None
+                    if action_result.get("conditional_flow"):
+                        chosen_flow = "valid_flow" if action_result.get("decision", "invalid") == "valid" else "invalid_flow"
+                    prefetched = AgentManager._settle_speculation(speculation, chosen_flow)
+                    speculation = None
+
+                # Handle Wait action - pause execution and return
+                if action_result.get("pause_execution"):
+                    conversation_memory.add_turn(shared_context, "assistant", action_result.get("content"))
+                    with time_phase("checkpoint", step_metrics):
+                        save_checkpoint("waiting")
+                    return {
+                        "wait_required": True,
+                        "wait_message": action_result.get("content", "Please provide additional information."),
+                        "wait_prompt": action_result.get("prompt", "What would you like to add?"),
+                        "actions_used": actions_used,
+                        "background_actions": background_actions,
+                        "user_facing_actions": user_facing_actions,
+                        "shared_context": shared_context
+                    }
+
+                # Update shared context with action result
+                if action_result:
+                    with time_phase("context", step_metrics):
+                        shared_context = AgentManager.build_enhanced_context(
+                            shared_context, action_result, action_name
+                        )
+
+                    # Handle Choice action - branch into the conditional flow
+                    if action_result.get("conditional_flow"):
+                        decision = action_result.get("decision", "invalid")
+                        next_flow = "valid_flow" if decision == "valid" else "invalid_flow"
+
+                        logger.debug("Choice decided %s, executing %s", decision, next_flow, extra=step_log)
+
+                        choice_entry = {
+                            "action": action_name,
+                            "result": action_result,
+                            "parameters_used": extracted_params,
+                            "choice_decision": decision
+                        }
+                        branch_frame = {"flow_type": next_flow, "choice_action": action_name, "index": 0}
+                        if AgentManager._resolve_flow_actions(agent, actions, branch_frame):
+                            # Kept on the branch frame (and so in the checkpoint) until the branch finishes
+                            branch_frame["choice_entry"] = choice_entry
+                            cursor.append(branch_frame)
+                        else:
+                            # Add the choice action to background actions
+                            background_actions.append({**choice_entry, "iteration": len(background_actions) + 1})
+
+                    # Handle other action types
+                    elif action_result.get("background", False):
+                        # Background action (like Thinking) - enriches context
+                        background_actions.append({
+                            "action": action_name,
+                            "result": action_result,
+                            "parameters_used": extracted_params,
+                            "iteration": len(background_actions) + 1
+                        })
+
+                    elif action_name == "Respond":
+                        # User-facing response action
+                        conversation_memory.add_turn(shared_context, "assistant", action_result.get("content"))
+                        user_facing_actions.append({
+                            "action": action_name,
+                            "result": action_result,
+                            "parameters_used": extracted_params,
+                            "iteration": len(user_facing_actions) + 1
+                        })
+
+                    else:
+                        # Custom actions (like Rootly API calls)
+                        background_actions.append({
+                            "action": action_name,
+                            "result": action_result,
+                            "parameters_used": extracted_params,
+                            "iteration": len(background_actions) + 1,
+                            "custom_action": True
+                        })
+
+                with time_phase("checkpoint", step_metrics):
+                    checkpoint = save_checkpoint()
+
+                # The run was taken over (e.g. its queue lease expired): leave it to the new owner
+                if checkpoint is not None and owner and checkpoint.owner != owner:
+                    logger.warning("Run taken over by %s, stopping after %s", checkpoint.owner, action_name, extra=step_log)
+                    return {
+                        "cancelled": True,
+                        "superseded": True,
+                        "actions_used": actions_used,
+                        "background_actions": background_actions,
+                        "user_facing_actions": user_facing_actions,
+                        "shared_context": shared_context
+                    }
+
+                # Cancellation is cooperative: honour it between steps, never mid-call
+                if checkpoint is not None and checkpoint.cancel_requested:
+                    save_checkpoint("cancelled")
+                    logger.info("Run cancelled after %s", action_name, extra=step_log)
+                    return {
+                        "cancelled": True,
+                        "actions_used": actions_used,
+                        "background_actions": background_actions,
+                        "user_facing_actions": user_facing_actions,
+                        "shared_context": shared_context
+                    }
+
+            save_checkpoint("completed")
+
+            return {
+                "actions_used": actions_used,
+                "background_actions": background_actions,
+                "user_facing_actions": user_facing_actions,
+                "shared_context": shared_context
+            }
+        finally:
+            # However the run stops (Wait, deadline, cancellation or an error), no prefetch
+            # is left running or uncounted
+            if speculation:
+                AgentManager._settle_speculation(speculation)
+            if prefetched:
+                AgentManager._settle_speculation({"outstanding": prefetched})
+
+    @staticmethod
+    def _build_run_response(run_id: str, execution_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape the result of an action flow into the API response"""
+        actions_used = execution_result["actions_used"]
+        background_actions = execution_result["background_actions"]
+        user_facing_actions = execution_result["user_facing_actions"]
+        shared_context = execution_result["shared_context"]
+
+        # Handle Wait action result if present
+        if execution_result.get("wait_required"):
+            return {
+                "wait_required": True,
+                "wait_message": execution_result["wait_message"],
+                "wait_prompt": execution_result["wait_prompt"],
+                "run_id": run_id,
+                "session_context": shared_context,
+                "actions_used": actions_used,
+                "background_actions": background_actions,
+                "user_facing_actions": user_facing_actions
+            }
+
+        if execution_result.get("cancelled"):
+            return {
+                "cancelled": True,
+                "run_id": run_id,
+                "actions_used": actions_used,
+                "background_actions": [clean_action_result(action) for action in background_actions],
+                "user_facing_actions": [clean_user_facing_action(action) for action in user_facing_actions],
+                "message": ("Run taken over by another worker" if execution_result.get("superseded")
+                            else "Run cancelled before completion")
+            }
+
+        if execution_result.get("deadline_exceeded"):
+            return {
+                "status": "deadline_exceeded",
+                "deadline_exceeded": True,
+                "run_id": run_id,
+                "actions_used": actions_used,
+                "background_actions": [clean_action_result(action) for action in background_actions],
+                "user_facing_actions": [clean_user_facing_action(action) for action in user_facing_actions],
+                "message": f"Deadline exceeded after {len(actions_used)} steps; results are partial"
+            }
+
+        # Extract final response from Respond actions
+        final_user_message = None
+        if user_facing_actions:
+            for action in reversed(user_facing_actions):
+                if action["action"] == "Respond" and action["result"].get("type") == "response":
+                    final_user_message = action["result"]["content"]
+                    break
+
+        if final_user_message is None:
+            return {
+                "response": None,
+                "run_id": run_id,
+                "actions_used": actions_used,
+                "background_actions": [],
+                "user_facing_actions": [],
+                "message": "No response generated by Respond action"
+            }
+
+        # Clean up actions for response (remove circular references and sensitive data)
+        clean_background_actions = [clean_action_result(action) for action in background_actions]
+
+        clean_user_facing_actions = [clean_user_facing_action(action) for action in user_facing_actions]
+
+        logger.info("Run %s completed, response generated: %s", run_id, bool(final_user_message))
+
         return {
+            "response": final_user_message,
+            "run_id": run_id,
             "actions_used": actions_used,
-            "background_actions": background_actions,
-            "user_facing_actions": user_facing_actions,
-            "shared_context": shared_context
+            "background_actions": clean_background_actions,
+            "user_facing_actions": clean_user_facing_actions,
+            "context_summary": {
+                "entities_extracted": len(shared_context.get("extracted_entities", {})),
+                "thinking_steps": len(shared_context.get("thinking_process", [])),
+                "data_retrieved": len([k for k in shared_context.keys() if k.endswith("_data")])
+            }
         }
 
     @staticmethod
-    def run_agent(db: Session, agent_id: int, input_data: schemas.AgentRun):
+    def _record_run_segment(run_id: str, agent_id: int, input_text: str, started_at: datetime, start: float,
+                            execution_result: Dict[str, Any] = None, prior_steps: int = 0, error: str = None):
+        """Queue run telemetry for the part of the run executed by this call"""
+        if execution_result is None:
+            status, step_count = "failed", 0
+        elif execution_result.get("wait_required"):
+            status, step_count = "waiting", len(execution_result["actions_used"]) - prior_steps
+        elif execution_result.get("cancelled"):
+            status, step_count = "cancelled", len(execution_result["actions_used"]) - prior_steps
+        elif execution_result.get("deadline_exceeded"):
+            status, step_count = "deadline_exceeded", len(execution_result["actions_used"]) - prior_steps
+        else:
+            status, step_count = "completed", len(execution_result["actions_used"]) - prior_steps
+
+        record_run(run_id, agent_id, input_text, status, started_at,
+                   (time.perf_counter() - start) * 1000, step_count, error)
+        if status not in ("waiting", "deadline_exceeded"):
+            # The run will not be resumed, so a summary still being computed is of no use
+            conversation_memory.forget(run_id)
+
+    @staticmethod
+    def _mark_run_failed(db: Session, run_id: str):
+        if not run_id:
+            return
+        try:
+            db.rollback()
+            CheckpointManager.set_status(db, run_id, "failed")
+        except Exception as e:
+            logger.error("Could not mark run %s as failed: %s", run_id, e)
+
+    @staticmethod
+    def run_agent(db: Session, agent_id: int, input_data: schemas.AgentRun, run_id: str = None, owner: str = None):
+        requested_run_id, run_id = run_id, None
         try:
             agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
             if not agent:
@@ -284,20 +641,6 @@ Extract parameters now (JSON only):"""
             if not llm:
                 return {"error": f"LLM with id {agent.llm_id} not found"}
 
-            # Initialize enhanced context using ContextBuilder
-            context_builder = ContextBuilder(input_data.input, agent.name)
-            context_builder.context.update({
-                "available_actions": [action["action_name"] for action in agent.actions],
-                "extracted_entities": {},  # Store extracted IDs, names, etc.
-                "session_data": {}  # Persistent data across actions
-            })
-            shared_context = context_builder.build()
-
-            # Execute actions in sequence with intelligent parameter extraction
-            actions_used = []
-            background_actions = []
-            user_facing_actions = []
-            
             # Check if agent has required actions (in main flow or conditional flows)
             has_respond_action = any(action["action_name"] == "Respond" for action in agent.actions)
             has_wait_action = any(action["action_name"] == "Wait" for action in agent.actions)
@@ -327,83 +670,188 @@ Extract parameters now (JSON only):"""
                     "user_facing_actions": [],
                     "message": "Agent must have either a Respond action or a Wait action to interact with users"
                 }
-            
-            print(f"🤖 Agent {agent.name} starting execution with {len(agent.actions)} actions")
+
+            # Initialize enhanced context using ContextBuilder
+            run_id = requested_run_id or uuid.uuid4().hex
+            context_builder = ContextBuilder(input_data.input, agent.name)
+            context_builder.context.update({
+                "run_id": run_id,
+                "available_actions": [action["action_name"] for action in agent.actions],
+                "extracted_entities": {},  # Store extracted IDs, names, etc.
+                "session_data": {}  # Persistent data across actions
+            })
+            shared_context = context_builder.build()
+            conversation_memory.add_turn(shared_context, "user", input_data.input)
+
+            owner = owner or new_execution_owner()
+            CheckpointManager.create_checkpoint(db, agent.id, input_data.input, shared_context,
+                                                run_id=run_id, owner=owner, bypass_cache=input_data.bypass_cache)
+
+            logger.info("Agent %s starting execution with %d actions", agent.name, len(agent.actions),
+                        extra={"run_id": run_id, "agent_id": agent.id})
             
             # Execute actions with support for conditional flows and Wait actions
-            execution_result = AgentManager._execute_action_flow(
-                db, agent, agent.actions, shared_context, llm, input_data
-            )
-            
-            actions_used = execution_result["actions_used"]
-            background_actions = execution_result["background_actions"]
-            user_facing_actions = execution_result["user_facing_actions"]
-            shared_context = execution_result["shared_context"]
-            
-            # Handle Wait action result if present
-            if execution_result.get("wait_required"):
-                return {
-                    "wait_required": True,
-                    "wait_message": execution_result["wait_message"],
-                    "wait_prompt": execution_result["wait_prompt"],
-                    "session_context": shared_context,
-                    "actions_used": actions_used,
-                    "background_actions": background_actions,
-                    "user_facing_actions": user_facing_actions
-                }
+            started_at, start = datetime.utcnow(), time.perf_counter()
+            try:
+                with log_context(run_id=run_id, agent_id=agent.id), run_deadline(input_data.deadline_seconds), \
+                        cache_bypass(input_data.bypass_cache), CheckpointManager.keep_alive(db.get_bind(), run_id, owner):
+                    execution_result = AgentManager._execute_action_flow(
+                        db, agent, agent.actions, shared_context, llm, input_data, run_id=run_id, owner=owner
+                    )
+            except Exception as e:
+                AgentManager._record_run_segment(run_id, agent.id, input_data.input, started_at, start, error=str(e))
+                raise
+            AgentManager._record_run_segment(run_id, agent.id, input_data.input, started_at, start, execution_result)
 
-            # Extract final response from Respond actions
-            final_user_message = None
-            if user_facing_actions:
-                for action in reversed(user_facing_actions):
-                    if action["action"] == "Respond" and action["result"].get("type") == "response":
-                        final_user_message = action["result"]["content"]
-                        break
-            
-            if final_user_message is None:
-                return {
-                    "response": None,
-                    "actions_used": actions_used,
-                    "background_actions": [],
-                    "user_facing_actions": [],
-                    "message": "No response generated by Respond action"
-                }
+            return AgentManager._build_run_response(run_id, execution_result)
 
-            # Clean up actions for response (remove circular references and sensitive data)
-            clean_background_actions = [clean_action_result(action) for action in background_actions]
-            
-            clean_user_facing_actions = []
-            for action in user_facing_actions:
-                clean_action = {
-                    "action": action.get("action", "Unknown"),
-                    "iteration": action.get("iteration", 0),
-                    "parameters_used": action.get("parameters_used", {}),
-                    "result": {
-                        "type": action.get("result", {}).get("type", "unknown"),
-                        "content": action.get("result", {}).get("content", "No content"),
-                        "background": action.get("result", {}).get("background", False),
-                        "user_message": action.get("result", {}).get("user_message", False)
-                    }
-                }
-                clean_user_facing_actions.append(clean_action)
-            
-            print(f"🎉 Agent execution completed successfully. Response generated: {bool(final_user_message)}")
-            
+        except Exception as e:
+            logger.exception("Error running agent %s (run %s)", agent_id, run_id)
+            AgentManager._mark_run_failed(db, run_id)
+            return {"error": f"Error running agent: {str(e)}"}
+
+    @staticmethod
+    def resume_run(db: Session, run_id: str, additional_input: str = None, deadline_seconds: float = None,
+                   owner: str = None):
+        """Resume a run from its last checkpoint, optionally adding user input after a Wait.
+
+        Runs stopped by their deadline can be resumed too; they continue at the step
+        they did not have time to start. Unless the caller already claimed the run
+        and passes its `owner` token, the run is claimed here; a run that another
+        execution is still running raises RunAlreadyExecuting.
+        """
+        checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+        if not checkpoint:
+            raise ValueError(f"Run {run_id} not found")
+
+        def finished_response():
+            results = checkpoint.results or empty_results()
             return {
-                "response": final_user_message,
-                "actions_used": actions_used,
-                "background_actions": clean_background_actions,
-                "user_facing_actions": clean_user_facing_actions,
-                "context_summary": {
-                    "entities_extracted": len(shared_context.get("extracted_entities", {})),
-                    "thinking_steps": len(shared_context.get("thinking_process", [])),
-                    "data_retrieved": len([k for k in shared_context.keys() if k.endswith("_data")])
-                }
+                "response": "No more actions to execute",
+                "run_id": run_id,
+                "actions_used": results.get("actions_used", []),
+                "background_actions": [clean_action_result(action) for action in results.get("background_actions", [])],
+                "user_facing_actions": [clean_user_facing_action(action) for action in results.get("user_facing_actions", [])]
             }
 
+        if checkpoint.status in ("completed", "failed", "cancelled"):
+            return finished_response()
+
+        agent = db.query(models.Agent).filter(models.Agent.id == checkpoint.agent_id).first()
+        if not agent:
+            raise ValueError(f"Agent with id {checkpoint.agent_id} not found")
+
+        llm = db.query(models.LLM).filter(models.LLM.id == agent.llm_id).first()
+        if not llm:
+            raise ValueError(f"LLM with id {agent.llm_id} not found")
+
+        if owner is None:
+            owner = new_execution_owner()
+            claimed = CheckpointManager.claim_run(db, run_id, owner)
+            db.refresh(checkpoint)
+            if not claimed:
+                if checkpoint.status in ("completed", "failed", "cancelled"):
+                    return finished_response()
+                raise RunAlreadyExecuting(f"Run {run_id} is already being executed by {checkpoint.owner}")
+        else:
+            db.refresh(checkpoint)
+            if checkpoint.owner != owner:
+                raise RunAlreadyExecuting(f"Run {run_id} is already being executed by {checkpoint.owner}")
+
+        results = checkpoint.results or empty_results()
+        shared_context = dict(checkpoint.context or {})
+        input_text = checkpoint.input or ""
+        if additional_input:
+            # The run input keeps the whole exchange for the record; prompts get the new
+            # turn plus the compacted conversation instead of an ever-growing input
+            input_text = f"{input_text} {additional_input}".strip()
+            shared_context["user_input"] = additional_input
+            conversation_memory.add_turn(shared_context, "user", additional_input)
+        conversation_memory.compact(
+            shared_context, run_id,
+            summarizer=partial(AgentManager._summarize_conversation, db.get_bind(), llm.id)
+        )
+
+        logger.info("Resuming run of agent %s at step %s", agent.name, checkpoint.step_count,
+                    extra={"run_id": run_id, "agent_id": agent.id})
+
+        prior_steps = len(results.get("actions_used", []))
+        started_at, start = datetime.utcnow(), time.perf_counter()
+        try:
+            with log_context(run_id=run_id, agent_id=agent.id), run_deadline(deadline_seconds), \
+                    cache_bypass(bool(checkpoint.bypass_cache)), CheckpointManager.keep_alive(db.get_bind(), run_id, owner):
+                execution_result = AgentManager._execute_action_flow(
+                    db, agent, agent.actions, shared_context, llm, schemas.AgentRun(input=input_text),
+                    cursor=checkpoint.cursor, results=results, run_id=run_id, owner=owner
+                )
         except Exception as e:
-            print(f"❌ Error running agent: {str(e)}")
-            return {"error": f"Error running agent: {str(e)}"}
+            AgentManager._record_run_segment(run_id, agent.id, input_text, started_at, start, error=str(e))
+            AgentManager._mark_run_failed(db, run_id)
+            raise
+        AgentManager._record_run_segment(run_id, agent.id, input_text, started_at, start, execution_result, prior_steps)
+
+        return AgentManager._build_run_response(run_id, execution_result)
+
+    @staticmethod
+    def _summarize_conversation(bind, llm_id: int, summary: str, turns: List[Dict[str, Any]]) -> str:
+        """Fold turns into the rolling summary of a conversation (runs on the summary pool)"""
+        db = Session(bind=bind)
+        try:
+            llm = db.query(models.LLM).filter(models.LLM.id == llm_id).first()
+            if not llm:
+                raise ValueError(f"LLM with id {llm_id} not found")
+            prompt = f"""Update the summary of a conversation between a user and an assistant.
+
+CURRENT SUMMARY: {summary or "(none)"}
+
+NEW TURNS:
+{conversation_memory.format_turns(turns)}
+
+Write the updated summary in at most 150 words. Keep identifiers (IDs, names, dates), decisions and open requests; drop small talk.
+
+Updated summary:"""
+            response = LLMManager.call_llm(llm, prompt, temperature=0.2)
+            if not response or response.startswith("Error calling"):
+                raise RuntimeError(response or "Empty summary")
+            return response.strip()
+        finally:
+            db.close()
+
+    @staticmethod
+    def continue_agent(db: Session, agent_id: int, continue_data: Dict[str, Any]):
+        """Continue agent execution after a Wait action with additional user input"""
+        session_context = continue_data.get("session_context") or {}
+        additional_input = continue_data.get("additional_input", "")
+        deadline_seconds = continue_data.get("deadline_seconds")
+
+        agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
+        if not agent:
+            raise ValueError(f"Agent with id {agent_id} not found")
+
+        run_id = continue_data.get("run_id") or session_context.get("run_id")
+        checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+        if checkpoint and checkpoint.agent_id == agent_id:
+            return AgentManager.resume_run(db, checkpoint.run_id, additional_input=additional_input,
+                                           deadline_seconds=deadline_seconds)
+
+        # Sessions started before checkpoints existed carry no cursor to resume from,
+        # so the only safe option is to run the agent again with the combined input
+        combined_input = f"{session_context.get('user_input', '')} {additional_input}".strip()
+        return AgentManager.run_agent(db=db, agent_id=agent_id,
+                                      input_data=schemas.AgentRun(input=combined_input, deadline_seconds=deadline_seconds))
+
+    @staticmethod
+    def recover_in_flight_runs(db: Session) -> List[str]:
+        """Resume runs orphaned by a crashed or restarted worker from their last checkpoint"""
+        owner = new_execution_owner()
+        run_ids = CheckpointManager.claim_stale_runs(db, owner)
+        for run_id in run_ids:
+            logger.info("Recovering in-flight run from its last checkpoint", extra={"run_id": run_id})
+            try:
+                AgentManager.resume_run(db, run_id, owner=owner)
+            except Exception as e:
+                logger.error("Error recovering run: %s", e, extra={"run_id": run_id})
+        return run_ids
 
     @staticmethod
     def _parse_action_call(response: str):
@@ -0,0 +1,155 @@
+"""
+Bulk agent execution for backfills: POST /agents/{id}/run-batch.
+
+Inputs are read lazily (a JSON list or an NDJSON request stream) and executed on
+a shared thread pool with a bounded number in flight per batch, so memory stays
+flat however large the batch is. Results are streamed back as NDJSON lines in
+completion order, each tagged with the index of its input.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import ValidationError
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from typing import Any, AsyncIterator, Callable, Dict, Iterable
+import asyncio
+import json
+import os
+import time
+
+from app import schemas
+from app.agent_manager import AgentManager
+from app.run_queue import result_status
+
+RUN_BATCH_DEFAULT_CONCURRENCY = int(os.getenv("RUN_BATCH_DEFAULT_CONCURRENCY", "4"))
+# Threads shared by all batches; a single batch never has more than its concurrency in flight
+RUN_BATCH_MAX_CONCURRENCY = int(os.getenv("RUN_BATCH_MAX_CONCURRENCY", "16"))
+
+_batch_pool = ThreadPoolExecutor(max_workers=RUN_BATCH_MAX_CONCURRENCY, thread_name_prefix="run-batch")
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """Streaming response that leaves the request's receive channel to the batch.
+
+    StreamingResponse normally listens for a client disconnect while it streams,
+    which consumes request body messages that an NDJSON input stream still needs.
+    A disconnect is noticed instead when sending the next line fails.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+def parse_batch_item(item: Any, defaults: Dict[str, Any]) -> schemas.AgentRun:
+    """An item is either the input text or an AgentRun object; batch defaults fill the gaps"""
+    if isinstance(item, str):
+        item = {"input": item}
+    if not isinstance(item, dict):
+        raise ValueError("Each batch item must be a string or an object with an 'input' field")
+    return schemas.AgentRun(**{**defaults, **item})
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Decode an NDJSON byte stream one line at a time; malformed lines yield the error"""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _decode_line(line)
+    if buffer.strip():
+        yield _decode_line(buffer)
+
+
+async def iter_items(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+def _decode_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON line: {e}")
+
+
+def _run_item(session_factory: Callable, agent_id: int, index: int, input_data: schemas.AgentRun) -> Dict[str, Any]:
+    db = session_factory()
+    start = time.perf_counter()
+    try:
+        result = AgentManager.run_agent(db, agent_id, input_data)
+        status, error = result_status(result), result.get("error")
+    except Exception as e:
+        result, status, error = None, "failed", str(e)
+    finally:
+        db.close()
+
+    line = {"index": index, "status": status, "duration_ms": round((time.perf_counter() - start) * 1000, 3)}
+    if error:
+        line["error"] = error
+    line["result"] = result
+    return line
+
+
+def _ndjson(line: Dict[str, Any]) -> str:
+    return json.dumps(line, default=str) + "\n"
+
+
+async def run_batch(agent_id: int, items: AsyncIterator[Any], session_factory: Callable,
+                    concurrency: int = RUN_BATCH_DEFAULT_CONCURRENCY,
+                    defaults: Dict[str, Any] = None) -> AsyncIterator[str]:
+    """Execute every item and yield one NDJSON line per item as it completes, then a summary"""
+    concurrency = max(1, min(concurrency, RUN_BATCH_MAX_CONCURRENCY))
+    defaults = defaults or {}
+    loop = asyncio.get_running_loop()
+    pending = set()
+    counts: Dict[str, int] = {}
+    index = 0
+    started = time.perf_counter()
+
+    def finished(futures):
+        for future in futures:
+            line = future.result()
+            counts[line["status"]] = counts.get(line["status"], 0) + 1
+            yield _ndjson(line)
+
+    async for item in items:
+        try:
+            if isinstance(item, Exception):
+                raise item
+            input_data = parse_batch_item(item, defaults)
+        except (ValueError, TypeError, ValidationError) as e:
+            counts["invalid"] = counts.get("invalid", 0) + 1
+            yield _ndjson({"index": index, "status": "invalid", "error": str(e)})
+            index += 1
+            continue
+
+        pending.add(loop.run_in_executor(_batch_pool, _run_item, session_factory, agent_id, index, input_data))
+        index += 1
+
+        # Stream whatever already finished; block only while the window is full
+        done = {future for future in pending if future.done()}
+        if len(pending) - len(done) >= concurrency:
+            more, _ = await asyncio.wait(pending - done, return_when=asyncio.FIRST_COMPLETED)
+            done |= more
+        pending -= done
+        for line in finished(done):
+            yield line
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for line in finished(done):
+            yield line
+
+    yield _ndjson({"summary": {
+        "items": index,
+        "by_status": counts,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3)
+    }})
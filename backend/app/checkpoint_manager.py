@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+from sqlalchemy.orm import Session
+from app import models, conversation_memory
+from app.utils import json_safe_copy
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional
+import logging
+import os
+import socket
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a heartbeat after which a running checkpoint is considered orphaned
+STALE_AFTER_SECONDS = int(os.getenv("RUN_CHECKPOINT_STALE_SECONDS", "300"))
+# How often an executing run renews its heartbeat, including while a long step is in flight
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("RUN_HEARTBEAT_SECONDS", str(max(STALE_AFTER_SECONDS / 5, 1))))
+
+# Statuses from which a run can be picked up again by a new execution
+RESUMABLE_STATUSES = ("waiting", "deadline_exceeded")
+
+
+class RunAlreadyExecuting(RuntimeError):
+    """Raised when a run is claimed while another execution still owns it"""
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+def worker_identity() -> str:
+    """Identify this process as the owner of the runs it executes"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def new_execution_owner() -> str:
+    """Token identifying one execution of a run.
+
+    Threads of the same process share worker_identity(), so ownership is
+    recorded per execution to tell concurrent executions apart.
+    """
+    return f"{worker_identity()}:{uuid.uuid4().hex[:12]}"
+
+
+def new_cursor(flow_type: str = "main") -> List[Dict[str, Any]]:
+    """Cursor positioned at the first action of the root flow"""
+    return [{"flow_type": flow_type, "choice_action": None, "index": 0}]
+
+
+def empty_results() -> Dict[str, List]:
+    return {"actions_used": [], "background_actions": [], "user_facing_actions": []}
+
+
+class CheckpointManager:
+    """Persist the execution cursor and context of agent runs after every step"""
+
+    @staticmethod
+    def create_checkpoint(db: Session, agent_id: int, input_text: str, context: Dict[str, Any],
+                          run_id: str = None, owner: str = None, bypass_cache: bool = False) -> models.RunCheckpoint:
+        checkpoint = models.RunCheckpoint(
+            run_id=run_id or uuid.uuid4().hex,
+            agent_id=agent_id,
+            status="running",
+            input=input_text,
+            cursor=new_cursor(),
+            context=json_safe_copy(context),
+            results=empty_results(),
+            step_count=0,
+            owner=owner or new_execution_owner(),
+            bypass_cache=bypass_cache,
+            heartbeat_at=_utcnow()
+        )
+        db.add(checkpoint)
+        db.commit()
+        db.refresh(checkpoint)
+        return checkpoint
+
+    @staticmethod
+    def get_checkpoint(db: Session, run_id: str) -> Optional[models.RunCheckpoint]:
+        if not run_id:
+            return None
+        return db.query(models.RunCheckpoint).filter(models.RunCheckpoint.run_id == run_id).first()
+
+    @staticmethod
+    def save_checkpoint(db: Session, run_id: str, cursor: List[Dict[str, Any]], context: Dict[str, Any],
+                        results: Dict[str, List], status: str = "running", input_text: str = None,
+                        owner: str = None):
+        """Record the state reached after a completed step; also acts as the run heartbeat.
+
+        When `owner` is given and the run no longer belongs to it, nothing is written
+        and the checkpoint is returned as is, so the caller can see it lost the run.
+        """
+        checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+        if not checkpoint:
+            return None
+        if owner and checkpoint.owner != owner:
+            return checkpoint
+
+        checkpoint.cursor = json_safe_copy(cursor)
+        checkpoint.context = json_safe_copy(context)
+        checkpoint.results = json_safe_copy(results)
+        checkpoint.status = status
+        checkpoint.step_count = (checkpoint.step_count or 0) + 1
+        checkpoint.heartbeat_at = _utcnow()
+        if input_text is not None:
+            checkpoint.input = input_text
+
+        db.commit()
+        return checkpoint
+
+    @staticmethod
+    def set_status(db: Session, run_id: str, status: str, owner: str = None):
+        checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+        if not checkpoint:
+            return None
+
+        checkpoint.status = status
+        if owner:
+            checkpoint.owner = owner
+        checkpoint.heartbeat_at = _utcnow()
+        db.commit()
+        return checkpoint
+
+    @staticmethod
+    def claim_run(db: Session, run_id: str, owner: str, from_statuses: Iterable[str] = RESUMABLE_STATUSES) -> bool:
+        """Move a run to running under `owner` if it is still in one of `from_statuses`.
+
+        The claim is a single conditional update, so of two executions trying to
+        resume the same run only one succeeds.
+        """
+        claimed = db.query(models.RunCheckpoint).filter(
+            models.RunCheckpoint.run_id == run_id,
+            models.RunCheckpoint.status.in_(list(from_statuses))
+        ).update({"status": "running", "owner": owner, "heartbeat_at": _utcnow()}, synchronize_session=False)
+        db.commit()
+        return bool(claimed)
+
+    @staticmethod
+    def heartbeat(db: Session, run_id: str, owner: str) -> bool:
+        """Renew the heartbeat of a run; False once the run is no longer owned by `owner`"""
+        renewed = db.query(models.RunCheckpoint).filter(
+            models.RunCheckpoint.run_id == run_id,
+            models.RunCheckpoint.owner == owner,
+            models.RunCheckpoint.status == "running"
+        ).update({"heartbeat_at": _utcnow()}, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+
+    @staticmethod
+    def release(db: Session, run_id: str, owner: str) -> bool:
+        """Give up a running run owned by `owner`; its engine stops at the next checkpoint"""
+        released = db.query(models.RunCheckpoint).filter(
+            models.RunCheckpoint.run_id == run_id,
+            models.RunCheckpoint.owner == owner,
+            models.RunCheckpoint.status == "running"
+        ).update({"owner": None}, synchronize_session=False)
+        db.commit()
+        return bool(released)
+
+    @staticmethod
+    @contextmanager
+    def keep_alive(bind, run_id: str, owner: str, interval_seconds: float = None):
+        """Renew the run heartbeat from a background thread for the duration of the block.
+
+        Checkpoints only move the heartbeat between steps; a single LLM or HTTP
+        call can outlast the stale threshold, and the run must not look orphaned
+        to the recovery loop meanwhile.
+        """
+        interval = HEARTBEAT_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+        stop = threading.Event()
+
+        def renew():
+            heartbeat_db = Session(bind=bind)
+            try:
+                while not stop.wait(interval):
+                    try:
+                        if not CheckpointManager.heartbeat(heartbeat_db, run_id, owner):
+                            return
+                    except Exception as e:
+                        heartbeat_db.rollback()
+                        logger.warning("Could not renew run heartbeat: %s", e, extra={"run_id": run_id})
+            finally:
+                heartbeat_db.close()
+
+        thread = threading.Thread(target=renew, name=f"run-heartbeat-{run_id[:8]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @staticmethod
+    def request_cancel(db: Session, run_id: str) -> bool:
+        """Flag a run for cancellation; the executing worker stops after its current step"""
+        checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+        if not checkpoint or checkpoint.status in ("completed", "failed", "cancelled"):
+            return False
+
+        checkpoint.cancel_requested = True
+        if checkpoint.status == "waiting":
+            # Nobody is executing a paused run, so it can be cancelled right away
+            checkpoint.status = "cancelled"
+            conversation_memory.forget(run_id)
+        db.commit()
+        return True
+
+    @staticmethod
+    def claim_stale_runs(db: Session, owner: str = None, stale_after_seconds: int = None) -> List[str]:
+        """Take ownership of running checkpoints whose worker stopped sending heartbeats.
+
+        Each claim is a conditional update on the previous heartbeat, so two workers
+        racing for the same run cannot both win it.
+        """
+        owner = owner or new_execution_owner()
+        stale_after = STALE_AFTER_SECONDS if stale_after_seconds is None else stale_after_seconds
+        cutoff = _utcnow() - timedelta(seconds=stale_after)
+
+        candidates = db.query(models.RunCheckpoint).filter(
+            models.RunCheckpoint.status == "running",
+            models.RunCheckpoint.heartbeat_at < cutoff
+        ).all()
+
+        claimed = []
+        for checkpoint in candidates:
+            updated = db.query(models.RunCheckpoint).filter(
+                models.RunCheckpoint.id == checkpoint.id,
+                models.RunCheckpoint.status == "running",
+                models.RunCheckpoint.heartbeat_at == checkpoint.heartbeat_at
+            ).update({"owner": owner, "heartbeat_at": _utcnow()}, synchronize_session=False)
+            if updated:
+                claimed.append(checkpoint.run_id)
+        db.commit()
+        return claimed
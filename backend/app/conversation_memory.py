@@ -0,0 +1,178 @@
+"""
+Bounded conversation memory for multi-turn runs.
+
+The memory lives in the run context (and therefore in its checkpoint) under
+"conversation_memory": the last turns are kept verbatim, older turns are folded
+into a rolling summary. Summaries are produced on a background pool; until one
+is ready the turns waiting for it are shown truncated, so a turn never waits
+for the summarizer and prompts stay within the token budget however long the
+session gets.
+
+In-flight summaries are tracked per process. A run resumed by another worker
+does not see a summary started here: its turns stay queued in the checkpoint
+and the resuming worker summarizes them again. Entries are dropped when a run
+finishes or is cancelled, and after MEMORY_SUMMARY_TTL_SECONDS for runs that
+are left waiting or never resumed.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tokens of conversation (summary + turns) handed to a prompt
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+# Most recent turns always kept verbatim
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "6"))
+MEMORY_SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+# How long a summary waits for its run to be resumed before it is dropped
+MEMORY_SUMMARY_TTL_SECONDS = float(os.getenv("MEMORY_SUMMARY_TTL_SECONDS", "3600"))
+
+MEMORY_KEY = "conversation_memory"
+
+_summary_pool = ThreadPoolExecutor(max_workers=MEMORY_SUMMARY_WORKERS, thread_name_prefix="memory-summary")
+# In-flight summaries by memory key (the run id); each folds the first `count` pending turns
+_pending_summaries: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), enough to enforce a budget"""
+    return len(text or "") // 4 + 1
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    max_chars = max(tokens, 0) * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + "..."
+
+
+def get_memory(context: Dict[str, Any]) -> Dict[str, Any]:
+    memory = context.get(MEMORY_KEY)
+    if not isinstance(memory, dict):
+        memory = context[MEMORY_KEY] = {"summary": "", "pending": [], "turns": [], "summarized_turns": 0}
+    return memory
+
+
+def add_turn(context: Dict[str, Any], role: str, content: str):
+    """Record a user or assistant turn"""
+    if content:
+        get_memory(context)["turns"].append({"role": role, "content": content, "tokens": estimate_tokens(content)})
+
+
+def compact(context: Dict[str, Any], key: str = None,
+            summarizer: Callable[[str, List[Dict[str, Any]]], str] = None,
+            token_budget: int = None, recent_turns: int = None):
+    """Move turns beyond the verbatim window to the summary queue and summarize them in the background.
+
+    A summary that finished since the last call is folded in first. `summarizer`
+    receives the current summary and the turns to fold and returns the new
+    summary; without one (or a key) turns only wait in the queue.
+    """
+    memory = get_memory(context)
+    budget = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    keep = MEMORY_RECENT_TURNS if recent_turns is None else recent_turns
+
+    if key:
+        _apply_finished_summary(memory, key)
+
+    turns = memory["turns"]
+    while len(turns) > 1 and (len(turns) > keep or sum(turn["tokens"] for turn in turns) > budget // 2):
+        memory["pending"].append(turns.pop(0))
+
+    if key and summarizer and memory["pending"]:
+        with _lock:
+            _drop_expired_summaries()
+            if key in _pending_summaries:
+                return
+            turns_to_fold = [dict(turn) for turn in memory["pending"]]
+            future = _summary_pool.submit(summarizer, memory["summary"], turns_to_fold)
+            _pending_summaries[key] = {"future": future, "count": len(turns_to_fold),
+                                       "started_at": time.monotonic()}
+
+
+def _drop_expired_summaries():
+    """Forget summaries of runs not resumed within the TTL (caller holds _lock)"""
+    cutoff = time.monotonic() - MEMORY_SUMMARY_TTL_SECONDS
+    for key in [key for key, job in _pending_summaries.items() if job["started_at"] < cutoff]:
+        _pending_summaries.pop(key)["future"].cancel()
+
+
+def _apply_finished_summary(memory: Dict[str, Any], key: str):
+    with _lock:
+        job = _pending_summaries.get(key)
+        if job is None or not job["future"].done():
+            return
+        del _pending_summaries[key]
+
+    future: Future = job["future"]
+    try:
+        summary = future.result()
+    except Exception as e:
+        # The turns stay queued and are folded by the next summary
+        logger.warning("Conversation summary failed: %s", e)
+        return
+    memory["summary"] = summary
+    memory["pending"] = memory["pending"][job["count"]:]
+    memory["summarized_turns"] = memory.get("summarized_turns", 0) + job["count"]
+
+
+def format_turns(turns: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{turn['role'].capitalize()}: {turn['content']}" for turn in turns)
+
+
+def memory_view(context: Dict[str, Any], token_budget: int = None) -> str:
+    """Compacted conversation for prompts: summary, turns awaiting a summary, recent turns.
+
+    Returns an empty string for a single-turn conversation, where the user input
+    already says everything. Older material is cut first when over budget.
+    """
+    memory = context.get(MEMORY_KEY) if context else None
+    if not isinstance(memory, dict):
+        return ""
+    summary, pending, turns = memory.get("summary") or "", memory.get("pending") or [], memory.get("turns") or []
+    if not summary and not pending and len(turns) <= 1:
+        return ""
+
+    remaining = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    recent = []
+    for turn in reversed(turns):
+        if turn["tokens"] > remaining:
+            if not recent:
+                recent.append({**turn, "content": truncate_to_tokens(turn["content"], remaining)})
+            remaining = 0
+            break
+        recent.insert(0, turn)
+        remaining -= turn["tokens"]
+
+    sections = []
+    if summary and remaining > 0:
+        summary = truncate_to_tokens(summary, remaining)
+        remaining -= estimate_tokens(summary)
+        sections.append(f"Summary of earlier conversation: {summary}")
+    if pending and remaining > 0:
+        # Not summarized yet: newest first, each turn shortened to keep the view bounded
+        per_turn = max(remaining // len(pending), 16)
+        shown = []
+        for turn in reversed(pending):
+            if remaining <= 0:
+                break
+            content = truncate_to_tokens(turn["content"], per_turn)
+            shown.insert(0, {**turn, "content": content})
+            remaining -= estimate_tokens(content)
+        sections.append(format_turns(shown))
+    if recent:
+        sections.append(format_turns(recent))
+    return "\n".join(sections)
+
+
+def forget(key: str):
+    """Drop the in-flight summary of a finished run"""
+    with _lock:
+        job = _pending_summaries.pop(key, None)
+    if job:
+        job["future"].cancel()
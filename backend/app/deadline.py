@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import time
+
+# Monotonic time by which the run being executed in this thread/task must finish
+_current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+# Smallest timeout handed to a downstream call; below this the call is not worth starting
+MIN_CALL_TIMEOUT_SECONDS = 0.05
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+@contextmanager
+def run_deadline(seconds: Optional[float]):
+    """Give the code in the block `seconds` to finish; an enclosing, earlier deadline still wins"""
+    if seconds is None:
+        yield
+        return
+
+    deadline = time.monotonic() + max(float(seconds), 0.0)
+    outer = _current_deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Budget left before the current deadline, or None when the run has no deadline"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def deadline_exceeded() -> bool:
+    remaining = remaining_seconds()
+    return remaining is not None and remaining < MIN_CALL_TIMEOUT_SECONDS
+
+
+def raise_if_deadline_exceeded(error: BaseException):
+    """Re-raise a failed downstream call as DeadlineExceeded when the run ran out of time.
+
+    Call timeouts are capped by the remaining budget, so a call that fails once the
+    budget is gone was cut short by the deadline rather than by the service.
+    """
+    if isinstance(error, DeadlineExceeded):
+        raise error
+    if deadline_exceeded():
+        raise DeadlineExceeded("Run deadline exceeded") from error
+
+
+def call_timeout(default_seconds: Optional[float]) -> Optional[float]:
+    """Timeout for a downstream call: its own default capped by the remaining run budget"""
+    remaining = remaining_seconds()
+    if remaining is None:
+        return default_seconds
+    if remaining < MIN_CALL_TIMEOUT_SECONDS:
+        raise DeadlineExceeded("Run deadline exceeded")
+    return remaining if default_seconds is None else min(default_seconds, remaining)
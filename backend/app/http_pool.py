@@ -0,0 +1,118 @@
+"""
+Keep-alive HTTP sessions shared by custom action calls.
+
+Each API host gets its own requests.Session with a bounded urllib3 connection
+pool, so consecutive calls to the same host reuse an open TCP/TLS connection
+instead of paying a new handshake every time.
+"""
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from typing import Any, Dict
+from urllib.parse import urlsplit
+import os
+import threading
+import requests
+
+# Connections kept open per API host; calls beyond it wait for a free connection
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "10"))
+# Hosts with a session; the least recently used one is closed past this
+HTTP_POOL_MAX_HOSTS = int(os.getenv("HTTP_POOL_MAX_HOSTS", "50"))
+
+
+def accept_encoding() -> str:
+    """Encodings urllib3 can decode here; brotli only when a brotli package is installed"""
+    encodings = ["gzip", "deflate"]
+    try:
+        import brotli  # noqa: F401
+        encodings.append("br")
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+            encodings.append("br")
+        except ImportError:
+            pass
+    return ", ".join(encodings)
+
+
+class HTTPSessionPool:
+    """Thread-safe map of API host to a keep-alive session"""
+
+    def __init__(self, max_connections: int = None, max_hosts: int = None):
+        self.max_connections = max_connections or HTTP_POOL_MAX_CONNECTIONS
+        self.max_hosts = max_hosts or HTTP_POOL_MAX_HOSTS
+        self.accept_encoding = accept_encoding()
+        self._sessions: "OrderedDict[str, requests.Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session_for(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}".lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                self._sessions.move_to_end(host)
+                return session
+
+            session = self._new_session()
+            self._sessions[host] = session
+            while len(self._sessions) > self.max_hosts:
+                _, oldest = self._sessions.popitem(last=False)
+                oldest.close()
+            return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), OrderedDict()
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Open, idle and reused connections per host"""
+        with self._lock:
+            sessions = list(self._sessions.items())
+
+        hosts = {}
+        for host, session in sessions:
+            adapter = session.get_adapter(host)
+            host_stats = {"open": 0, "idle": 0, "connections_created": 0, "requests": 0, "reused": 0}
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None or pool.pool is None:
+                    continue
+                queued = list(pool.pool.queue)
+                idle = sum(1 for conn in queued if conn is not None)
+                in_use = pool.pool.maxsize - len(queued)
+                host_stats["open"] += idle + in_use
+                host_stats["idle"] += idle
+                host_stats["connections_created"] += pool.num_connections
+                host_stats["requests"] += pool.num_requests
+            host_stats["reused"] = max(host_stats["requests"] - host_stats["connections_created"], 0)
+            hosts[host] = host_stats
+
+        return {
+            "hosts": hosts,
+            "max_connections_per_host": self.max_connections,
+            "max_hosts": self.max_hosts,
+            "accept_encoding": self.accept_encoding,
+            "open": sum(stats["open"] for stats in hosts.values()),
+            "idle": sum(stats["idle"] for stats in hosts.values()),
+            "reused": sum(stats["reused"] for stats in hosts.values())
+        }
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        # Retries are left to the caller; a connection pool per host is all this adds
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Accept-Encoding"] = self.accept_encoding
+        # Sessions are shared by every agent calling the host: never carry cookies across calls
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+
+http_pool = HTTPSessionPool()
@@ -1,10 +1,17 @@
 from sqlalchemy.orm import Session
 from app import models, schemas
+from app.telemetry import record_llm_call, record_llm_usage
+from app.deadline import call_timeout, remaining_seconds, raise_if_deadline_exceeded
 from openai import OpenAI
 import requests
 import json
+import os
+import time
 from typing import Dict, Any
 
+# Upper bound for a single LLM call; a run deadline can shorten it further
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
 class LLMManager:
     @staticmethod
     def create_llm(db: Session, llm: schemas.LLMCreate):
@@ -34,16 +41,26 @@ class LLMManager:
 
     @staticmethod
     def call_llm(llm: models.LLM, prompt: str, conversation_history=None, **kwargs):
-        if llm.provider == "openai":
-            return LLMManager._call_openai(llm, prompt, conversation_history, **kwargs)
-        elif llm.provider == "lmstudio":
-            return LLMManager._call_lmstudio(llm, prompt, conversation_history, **kwargs)
-        elif llm.provider == "ollama":
-            return LLMManager._call_ollama(llm, prompt, conversation_history, **kwargs)
-        elif llm.provider == "custom":
-            return LLMManager._call_custom_api(llm, prompt, conversation_history, **kwargs)
-        else:
-            raise ValueError(f"Unsupported LLM provider: {llm.provider}")
+        start = time.perf_counter()
+        try:
+            if llm.provider == "openai":
+                return LLMManager._call_openai(llm, prompt, conversation_history, **kwargs)
+            elif llm.provider == "lmstudio":
+                return LLMManager._call_lmstudio(llm, prompt, conversation_history, **kwargs)
+            elif llm.provider == "ollama":
+                return LLMManager._call_ollama(llm, prompt, conversation_history, **kwargs)
+            elif llm.provider == "custom":
+                return LLMManager._call_custom_api(llm, prompt, conversation_history, **kwargs)
+            else:
+                raise ValueError(f"Unsupported LLM provider: {llm.provider}")
+        finally:
+            record_llm_call((time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    def _record_openai_usage(response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record_llm_usage(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
 
     @staticmethod
     def _call_openai(llm: models.LLM, prompt: str, conversation_history=None, **kwargs):
@@ -55,6 +72,10 @@ class LLMManager:
         if llm.base_url:
             client_params["base_url"] = llm.base_url
 
+        if remaining_seconds() is not None:
+            # The client retries timed-out calls by default, which would outlive the run deadline
+            client_params["max_retries"] = 0
+
         client = OpenAI(**client_params)
 
         # Prepare messages
@@ -76,10 +97,13 @@ class LLMManager:
                 messages=messages,
                 max_tokens=kwargs.get('max_tokens', llm.max_tokens or 1000),
                 temperature=kwargs.get('temperature', llm.temperature or 0.1),
-                **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'temperature']}
+                timeout=call_timeout(LLM_TIMEOUT_SECONDS),
+                **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'temperature', 'timeout']}
             )
+            LLMManager._record_openai_usage(response)
             return response.choices[0].message.content
         except Exception as e:
+            raise_if_deadline_exceeded(e)
             return f"Error calling OpenAI API: {str(e)}"
 
     @staticmethod
@@ -90,6 +114,10 @@ class LLMManager:
             "base_url": llm.base_url or "http://localhost:1234/v1"  # Default LM Studio URL
         }
 
+        if remaining_seconds() is not None:
+            # The client retries timed-out calls by default, which would outlive the run deadline
+            client_params["max_retries"] = 0
+
         client = OpenAI(**client_params)
 
         # Prepare messages
@@ -111,10 +139,13 @@ class LLMManager:
                 messages=messages,
                 max_tokens=kwargs.get('max_tokens', llm.max_tokens or 1000),
                 temperature=kwargs.get('temperature', llm.temperature or 0.1),
-                **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'temperature']}
+                timeout=call_timeout(LLM_TIMEOUT_SECONDS),
+                **{k: v for k, v in kwargs.items() if k not in ['max_tokens', 'temperature', 'timeout']}
             )
+            LLMManager._record_openai_usage(response)
             return response.choices[0].message.content
         except Exception as e:
+            raise_if_deadline_exceeded(e)
             return f"Error calling LM Studio API: {str(e)}"
 
     @staticmethod
@@ -146,11 +177,13 @@ class LLMManager:
         }
 
         try:
-            response = requests.post(endpoint, json=payload)
+            response = requests.post(endpoint, json=payload, timeout=call_timeout(LLM_TIMEOUT_SECONDS))
             response.raise_for_status()
             result = response.json()
+            record_llm_usage(result.get("prompt_eval_count", 0), result.get("eval_count", 0))
             return result.get("response", "No response from Ollama")
         except Exception as e:
+            raise_if_deadline_exceeded(e)
             return f"Error calling Ollama API: {str(e)}"
 
     @staticmethod
@@ -184,11 +217,13 @@ class LLMManager:
         }
 
         try:
-            response = requests.post(llm.base_url, headers=headers, json=payload)
+            response = requests.post(llm.base_url, headers=headers, json=payload, timeout=call_timeout(LLM_TIMEOUT_SECONDS))
             response.raise_for_status()
 
             # Try to extract response from different API formats
             result = response.json()
+            usage = result.get("usage") if isinstance(result.get("usage"), dict) else {}
+            record_llm_usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
             if "text" in result:
                 return result["text"]
             elif "response" in result:
@@ -201,6 +236,7 @@ class LLMManager:
             else:
                 return str(result)
         except Exception as e:
+            raise_if_deadline_exceeded(e)
             return f"Error calling custom API: {str(e)}"
 
     @staticmethod
@@ -0,0 +1,197 @@
+"""
+Logging setup for the agent engine.
+
+Records are handed to a bounded queue and written by a background listener, so
+logging never blocks a request on stdout. Levels are set per logger from the
+environment, DEBUG output is sampled and rate limited, and every record carries
+the run/step it belongs to:
+
+    LOG_LEVEL=INFO
+    LOG_LEVELS=app.agent_manager=DEBUG,app.run_queue=WARNING
+    LOG_FORMAT=json                      # or text
+    LOG_DEBUG_SAMPLE_RATE=0.1            # keep 10% of DEBUG records
+    LOG_DEBUG_RATE_LIMIT=20              # per message template and second
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+LOG_DEBUG_RATE_LIMIT = int(os.getenv("LOG_DEBUG_RATE_LIMIT", "50"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Fields attached to every record logged while a run is executing in this thread/task
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("run_id", "agent_id", "step", "action")
+
+_listener: Optional[QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach run/step identifiers to every record logged inside the block"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current log context onto the record; explicit `extra` values win"""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        for key in CONTEXT_FIELDS:
+            if not hasattr(record, key):
+                setattr(record, key, None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Sample DEBUG records and cap how often each message template is emitted.
+
+    INFO and above always pass. Templates are rate limited rather than rendered
+    messages, so per-step debug lines with varying arguments share one budget.
+    """
+
+    def __init__(self, sample_rate: float = LOG_DEBUG_SAMPLE_RATE, rate_limit: int = LOG_DEBUG_RATE_LIMIT):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._windows: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.dropped += 1
+            return False
+
+        if self.rate_limit > 0:
+            key = (record.name, record.msg)
+            second = int(time.monotonic())
+            with self._lock:
+                window = self._windows.get(key)
+                if window is None or window[0] != second:
+                    window = self._windows[key] = [second, 0]
+                window[1] += 1
+                if window[1] > self.rate_limit:
+                    self.dropped += 1
+                    return False
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context)s %(message)s")
+
+    def format(self, record):
+        fields = [f"{key}={getattr(record, key)}" for key in CONTEXT_FIELDS if getattr(record, key, None) is not None]
+        record.context = f" [{' '.join(fields)}]" if fields else ""
+        return super().format(record)
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse `logger=LEVEL,other=LEVEL` into logging levels, ignoring malformed entries"""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        level = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+
+def configure_logging(force: bool = False):
+    """Install the queue handler on the `app` logger; safe to call more than once"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None and not force:
+            return
+        if _listener is not None:
+            _listener.stop()
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(SamplingFilter())
+
+        app_logger = logging.getLogger("app")
+        for handler in list(app_logger.handlers):
+            if isinstance(handler, DroppingQueueHandler):
+                app_logger.removeHandler(handler)
+        app_logger.addHandler(queue_handler)
+        app_logger.setLevel(parse_levels(f"app={LOG_LEVEL}").get("app", logging.INFO))
+        app_logger.propagate = False
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records; registered at exit"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
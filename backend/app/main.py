@@ -1,13 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Response, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, sessionmaker
+from typing import List, Optional
+import json
 import logging
+import os
+import threading
+import time
 
 from app import models, schemas, database
+from app.database import get_db
 from app.llm_manager import LLMManager
 from app.agent_manager import AgentManager
+from app.checkpoint_manager import RunAlreadyExecuting
 from app.action_manager import ActionManager
+from app.run_queue import run_pool, RunQueueFullError, RUN_QUEUE_BACKEND
+from app.batch_runner import (
+    run_batch, iter_ndjson, iter_items, NDJSONStreamingResponse, RUN_BATCH_DEFAULT_CONCURRENCY
+)
+from app.telemetry import TelemetryManager, telemetry_writer, collect_run_timings, speculation_stats
+from app.logging_config import configure_logging
+from app.http_pool import http_pool
+from app.openapi_import import parse_openapi, import_operations
+from app.spec_analysis import analyze_spec
+from app.action_batch import run_action_test_batch, ACTION_TEST_BATCH_DEFAULT_CONCURRENCY, ACTION_TEST_BATCH_MAX_ITEMS
+from app.resilience import circuit_breakers, outbound_limits
+from app.action_cache import action_result_cache, http_response_cache, action_call_flight
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Agent Platform API",
@@ -74,7 +95,31 @@ logging.getLogger("uvicorn.access").addFilter(WebpackLogFilter())
 def startup_event():
     models.Base.metadata.create_all(bind=database.engine)
     create_native_actions()
-    print("Database tables created successfully")
+    logger.info("Database tables created successfully")
+    # With the SQLite queue, recovery belongs to the worker processes
+    if RUN_RECOVERY_INTERVAL_SECONDS > 0 and RUN_QUEUE_BACKEND == "memory":
+        threading.Thread(target=recover_in_flight_runs_loop, daemon=True).start()
+    run_pool.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    run_pool.shutdown(wait=False)
+    http_pool.close()
+    telemetry_writer.flush()
+
+# How often to look for runs orphaned by a crashed or restarted worker (0 disables recovery)
+RUN_RECOVERY_INTERVAL_SECONDS = int(os.getenv("RUN_RECOVERY_INTERVAL_SECONDS", "60"))
+
+def recover_in_flight_runs_loop():
+    while True:
+        db = database.SessionLocal()
+        try:
+            AgentManager.recover_in_flight_runs(db)
+        except Exception as e:
+            logger.error("Error recovering in-flight runs: %s", e)
+        finally:
+            db.close()
+        time.sleep(RUN_RECOVERY_INTERVAL_SECONDS)
 
 def create_native_actions():
     db = database.SessionLocal()
@@ -124,19 +169,11 @@ def create_native_actions():
 
         db.commit()
     except Exception as e:
-        print(f"Error creating native actions: {e}")
+        logger.error("Error creating native actions: %s", e)
         db.rollback()
     finally:
         db.close()
 
-# Dependency
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @app.get("/")
 async def root():
     return {"message": "Agent Platform API"}
@@ -160,115 +197,173 @@ def read_agents(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return AgentManager.get_agents(db=db, skip=skip, limit=limit)
 
 @app.post("/agents/{agent_id}/run")
-def run_agent(agent_id: int, input_data: schemas.AgentRun, db: Session = Depends(get_db)):
+def run_agent(agent_id: int, input_data: schemas.AgentRun, response: Response, timings: bool = False,
+              x_run_deadline: Optional[float] = Header(None), db: Session = Depends(get_db)):
+    """Execute an agent; `?timings=true` adds the per-step timing breakdown to the response.
+
+    The `X-Run-Deadline` header (seconds) bounds the run like `deadline_seconds`; the
+    shorter of the two applies.
+    """
+    input_data.deadline_seconds = _shortest_deadline(input_data.deadline_seconds, x_run_deadline)
     try:
-        return AgentManager.run_agent(db=db, agent_id=agent_id, input_data=input_data)
+        with collect_run_timings() as run_timings:
+            result = AgentManager.run_agent(db=db, agent_id=agent_id, input_data=input_data)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    return _with_timings(result, run_timings, response, timings)
 
 @app.post("/agents/{agent_id}/continue")
-def continue_agent(agent_id: int, continue_data: dict, db: Session = Depends(get_db)):
+def continue_agent(agent_id: int, continue_data: dict, response: Response, timings: bool = False,
+                   x_run_deadline: Optional[float] = Header(None), db: Session = Depends(get_db)):
     """Continue agent execution after a Wait action with additional user input"""
+    continue_data["deadline_seconds"] = _shortest_deadline(continue_data.get("deadline_seconds"), x_run_deadline)
     try:
-        # Extract session context and new input
-        session_context = continue_data.get("session_context", {})
-        additional_input = continue_data.get("additional_input", "")
-        
-        # Ensure session_context has required fields
-        if "action_results" not in session_context:
-            session_context["action_results"] = {}
-        if "thinking_process" not in session_context:
-            session_context["thinking_process"] = []
-        if "conversation_history" not in session_context:
-            session_context["conversation_history"] = []
-        if "extracted_entities" not in session_context:
-            session_context["extracted_entities"] = {}
-        if "session_data" not in session_context:
-            session_context["session_data"] = {}
-        
-        # Update the context with new input
-        original_input = session_context.get("user_input", "")
-        combined_input = f"{original_input} {additional_input}".strip()
-        session_context["user_input"] = combined_input
-        session_context["additional_inputs"] = session_context.get("additional_inputs", [])
-        session_context["additional_inputs"].append(additional_input)
-        
-        # Get the agent
-        agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
-        if not agent:
-            raise HTTPException(status_code=404, detail="Agent not found")
-            
-        # Get the LLM
-        llm = db.query(models.LLM).filter(models.LLM.id == agent.llm_id).first()
-        if not llm:
-            raise HTTPException(status_code=404, detail="LLM not found")
-        
-        # Continue execution from where it left off
-        # Find the next action after the last executed action
-        actions_used = session_context.get("actions_used", [])
-        if not actions_used:
-            # If no actions were used, start from the beginning
-            return AgentManager.run_agent(db=db, agent_id=agent_id, input_data=schemas.AgentRun(input=combined_input))
-        
-        # Find the next action to execute
-        last_action_index = len(actions_used) - 1
-        if last_action_index + 1 < len(agent.actions):
-            # Continue with remaining actions
-            remaining_actions = agent.actions[last_action_index + 1:]
-            
-            # Execute remaining actions
-            agent_manager = AgentManager()
-            execution_result = agent_manager._execute_action_flow(
-                db, agent, remaining_actions, session_context, llm, schemas.AgentRun(input=combined_input)
-            )
-            
-            # Merge with previous results
-            all_actions_used = actions_used + execution_result["actions_used"]
-            all_background_actions = session_context.get("background_actions", []) + execution_result["background_actions"]
-            all_user_facing_actions = session_context.get("user_facing_actions", []) + execution_result["user_facing_actions"]
-            
-            # Handle Wait action result if present
-            if execution_result.get("wait_required"):
-                return {
-                    "wait_required": True,
-                    "wait_message": execution_result["wait_message"],
-                    "wait_prompt": execution_result["wait_prompt"],
-                    "session_context": execution_result["shared_context"],
-                    "actions_used": all_actions_used,
-                    "background_actions": all_background_actions,
-                    "user_facing_actions": all_user_facing_actions
-                }
-            
-            # Extract final response
-            final_user_message = None
-            if execution_result["user_facing_actions"]:
-                for action in reversed(execution_result["user_facing_actions"]):
-                    if action["action"] == "Respond" and action["result"].get("type") == "response":
-                        final_user_message = action["result"]["content"]
-                        break
-            
-            return {
-                "response": final_user_message,
-                "actions_used": all_actions_used,
-                "background_actions": all_background_actions,
-                "user_facing_actions": all_user_facing_actions,
-                "context_summary": {
-                    "entities_extracted": len(execution_result["shared_context"].get("extracted_entities", {})),
-                    "thinking_steps": len(execution_result["shared_context"].get("thinking_process", [])),
-                    "data_retrieved": len([k for k in execution_result["shared_context"].keys() if k.endswith("_data")])
-                }
-            }
-        else:
-            # No more actions to execute
-            return {
-                "response": "No more actions to execute",
-                "actions_used": actions_used,
-                "background_actions": session_context.get("background_actions", []),
-                "user_facing_actions": session_context.get("user_facing_actions", [])
-            }
-        
+        with collect_run_timings() as run_timings:
+            result = AgentManager.continue_agent(db=db, agent_id=agent_id, continue_data=continue_data)
+    except RunAlreadyExecuting as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error continuing agent execution: {str(e)}")
+    return _with_timings(result, run_timings, response, timings)
+
+@app.post("/agents/{agent_id}/run-batch")
+async def run_agent_batch(agent_id: int, request: Request, concurrency: int = RUN_BATCH_DEFAULT_CONCURRENCY,
+                          deadline_seconds: Optional[float] = None, bypass_cache: bool = False,
+                          db: Session = Depends(get_db)):
+    """Run an agent over many inputs, streaming one NDJSON result line per input as it completes.
+
+    The body is either JSON (`{"inputs": [...]}` or a list) or, with an
+    `application/x-ndjson` content type, one input per line sent as a stream. Items are
+    input strings or AgentRun objects; `deadline_seconds` and `bypass_cache` apply to
+    items that do not set them.
+    """
+    agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = iter_ndjson(request.stream())
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be JSON or NDJSON")
+        inputs = body.get("inputs") if isinstance(body, dict) else body
+        if not isinstance(inputs, list):
+            raise HTTPException(status_code=400, detail="Expected a list of inputs or {\"inputs\": [...]}")
+        items = iter_items(inputs)
+
+    defaults = {"bypass_cache": bypass_cache}
+    if deadline_seconds is not None:
+        defaults["deadline_seconds"] = deadline_seconds
+    # Items run on their own sessions, bound to the same database as the request's; the
+    # request session is released now rather than held open while the batch streams
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+    db.close()
+    return NDJSONStreamingResponse(
+        run_batch(agent_id, items, session_factory, concurrency=concurrency, defaults=defaults)
+    )
+
+def _shortest_deadline(*deadlines: Optional[float]) -> Optional[float]:
+    given = [float(deadline) for deadline in deadlines if deadline is not None]
+    return min(given) if given else None
+
+def _with_timings(result, run_timings, response: Response, include_timings: bool):
+    """Expose the run's timing breakdown as a Server-Timing header and, if asked, in the body"""
+    response.headers["Server-Timing"] = run_timings.server_timing_header()
+    if include_timings and isinstance(result, dict):
+        result["timings"] = run_timings.summary()
+    return result
+
+# Asynchronous run endpoints
+@app.post("/agents/{agent_id}/runs", status_code=202)
+def enqueue_agent_run(agent_id: int, run_data: schemas.RunJobCreate,
+                      x_run_deadline: Optional[float] = Header(None), db: Session = Depends(get_db)):
+    """Enqueue an agent run and return its id immediately; poll GET /runs/{run_id} for progress.
+
+    The deadline (`deadline_seconds` or `X-Run-Deadline`) bounds the execution of the run
+    once a worker starts it, not the time it spends queued.
+    """
+    agent = db.query(models.Agent).filter(models.Agent.id == agent_id).first()
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    try:
+        return run_pool.submit(
+            agent_id,
+            schemas.AgentRun(input=run_data.input, parameters=run_data.parameters,
+                             bypass_cache=run_data.bypass_cache,
+                             deadline_seconds=_shortest_deadline(run_data.deadline_seconds, x_run_deadline)),
+            priority=run_data.priority
+        )
+    except RunQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/runs/stats")
+def get_run_queue_stats():
+    """Queue depth and worker utilisation of the run pool"""
+    return run_pool.stats()
+
+@app.get("/runs/{run_id}")
+def get_run(run_id: str, db: Session = Depends(get_db)):
+    """Get the status, partial results and (when finished) final result of a run"""
+    status = run_pool.get_run_status(db, run_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return status
+
+@app.post("/runs/{run_id}/cancel")
+def cancel_run(run_id: str, db: Session = Depends(get_db)):
+    """Cancel a queued run, or stop a running one after its current step"""
+    if not run_pool.cancel(db, run_id):
+        raise HTTPException(status_code=409, detail="Run not found or already finished")
+    return {"run_id": run_id, "cancel_requested": True}
+
+# Run telemetry endpoints
+@app.get("/telemetry/steps/slowest")
+def get_slowest_steps(since_minutes: int = 60, limit: int = 20, agent_id: int = None, db: Session = Depends(get_db)):
+    """Slowest steps in the time window, with their LLM/HTTP latency, tokens and payload sizes"""
+    return TelemetryManager.slowest_steps(db, since_minutes=since_minutes, limit=limit, agent_id=agent_id)
+
+@app.get("/telemetry/agents/latency")
+def get_agent_latency(since_minutes: int = 60, db: Session = Depends(get_db)):
+    """p50/p95 run duration per agent in the time window"""
+    return TelemetryManager.latency_by_agent(db, since_minutes=since_minutes)
+
+@app.get("/telemetry/errors")
+def get_error_rates(since_minutes: int = 60, db: Session = Depends(get_db)):
+    """Run error rate per agent and step error rate per action in the time window"""
+    return TelemetryManager.error_rates(db, since_minutes=since_minutes)
+
+@app.get("/telemetry/speculation")
+def get_speculation_stats():
+    """Speculative branch prefetches started, used and wasted since this process started"""
+    return speculation_stats.snapshot()
+
+@app.get("/telemetry/http-pool")
+def get_http_pool_stats():
+    """Open, idle and reused keep-alive connections to API hosts in this process"""
+    return http_pool.stats()
+
+@app.get("/telemetry/circuit-breakers")
+def get_circuit_breakers():
+    """Circuit breaker state per API host: closed, open (short-circuiting calls) or half-open"""
+    return circuit_breakers.snapshot()
+
+@app.get("/telemetry/outbound-limits")
+def get_outbound_limits():
+    """Slots in use and queued per bulkhead, and tokens left per rate limit, for action calls"""
+    return outbound_limits.snapshot()
+
+@app.get("/telemetry/action-cache")
+def get_action_cache_stats():
+    """Size, hits and evictions of the action caches, and GETs coalesced onto in-flight calls"""
+    return {"results": action_result_cache.stats(), "http": http_response_cache.stats(),
+            "coalescing": action_call_flight.stats()}
 
 # Action endpoints
 @app.post("/actions/", response_model=schemas.Action)
@@ -367,45 +462,59 @@ def delete_action(action_id: int, db: Session = Depends(get_db)):
 
 @app.post("/actions/parse-yaml/")
 async def parse_yaml(yaml_data: dict, db: Session = Depends(get_db)):
+    yaml_spec = yaml_data.get("yaml_spec", "")
+    if not yaml_spec:
+        raise HTTPException(status_code=400, detail="YAML specification is required")
     try:
-        yaml_spec = yaml_data.get("yaml_spec", "")
-        if not yaml_spec:
-            raise HTTPException(status_code=400, detail="YAML specification is required")
-        
-        api_key = yaml_data.get("api_key", "")
-        
-        parameters = ActionManager.generate_parameters_from_yaml(yaml_spec)
-        headers = ActionManager.generate_headers_from_yaml(yaml_spec, api_key)
-
-        # Extract endpoint from YAML
-        spec = ActionManager.parse_yaml_spec(yaml_spec)
-        endpoint = ""
-        if 'paths' in spec:
-            # Get the server URL if available
-            server_url = ""
-            if 'servers' in spec and len(spec['servers']) > 0:
-                server_url = spec['servers'][0].get('url', '')
-            
-            # Get the first path
-            for path in spec['paths']:
-                endpoint = server_url + path
-                break
-
-        # Extract response schema for preview
-        response_schema = ActionManager.extract_response_schema_from_yaml(yaml_spec)
-        
-        return {
-            "parameters": parameters,
-            "headers": headers,
-            "endpoint": endpoint,
-            "response_schema": response_schema,
-            "schema_preview": ActionManager._generate_schema_preview(response_schema) if response_schema else None
-        }
+        # Parsed once per distinct spec text; repeated previews reuse the analysis
+        return analyze_spec(yaml_spec).describe(yaml_data.get("api_key", ""))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Error parsing YAML: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/actions/import-openapi/")
+def import_openapi(import_data: dict, db: Session = Depends(get_db)):
+    """Create one action per operation of an OpenAPI spec.
+
+    Body: `yaml_spec`, optional `api_key` and `name_prefix`. With `"stream": true` the
+    response is NDJSON progress events ending with the summary line; otherwise only the
+    summary (created and skipped actions, timings) is returned.
+    """
+    yaml_spec = import_data.get("yaml_spec", "")
+    if not yaml_spec:
+        raise HTTPException(status_code=400, detail="YAML specification is required")
+    try:
+        started = time.perf_counter()
+        spec = parse_openapi(yaml_spec, import_data.get("api_key"))
+        parse_ms = round((time.perf_counter() - started) * 1000, 3)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Error parsing YAML: {str(e)}")
+
+    args = (spec, import_data.get("api_key"), import_data.get("name_prefix") or "")
+    if not import_data.get("stream"):
+        try:
+            for event in import_operations(db, *args, parse_ms=parse_ms):
+                if "summary" in event:
+                    return event["summary"]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    # The import streams on its own session; the request's one is closed with the request
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+
+    def stream():
+        import_db = session_factory()
+        try:
+            for event in import_operations(import_db, *args, parse_ms=parse_ms):
+                yield json.dumps(event, default=str) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            import_db.close()
+
+    return NDJSONStreamingResponse(stream())
+
 @app.post("/actions/{action_id}/test")
 def test_action(action_id: int, test_data: dict, db: Session = Depends(get_db)):
     """Test a custom action with provided parameters"""
@@ -437,6 +546,35 @@ def test_action(action_id: int, test_data: dict, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/actions/{action_id}/test-batch")
+def test_action_batch(action_id: int, test_data: dict, concurrency: int = ACTION_TEST_BATCH_DEFAULT_CONCURRENCY,
+                      bypass_cache: bool = False, include_results: bool = False,
+                      db: Session = Depends(get_db)):
+    """Test an action with many parameter sets at once, with bounded concurrency.
+
+    The body is `{"parameters": [{...}, ...], "context": {...}}`. Each item reports its
+    status, latency and result size (the result itself with `include_results`); the
+    summary adds latency percentiles. `bypass_cache` makes every item call the API.
+    """
+    action = db.query(models.Action).filter(models.Action.id == action_id).first()
+    if not action:
+        raise HTTPException(status_code=404, detail="Action not found")
+
+    parameter_sets = test_data.get("parameters")
+    if not isinstance(parameter_sets, list) or not all(isinstance(item, dict) for item in parameter_sets):
+        raise HTTPException(status_code=400, detail="Expected {\"parameters\": [...]} with one object per test")
+    if not parameter_sets:
+        raise HTTPException(status_code=400, detail="At least one parameter set is required")
+    if len(parameter_sets) > ACTION_TEST_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {ACTION_TEST_BATCH_MAX_ITEMS} parameter sets per batch")
+
+    # Items run on their own sessions, bound to the same database as the request's
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+    return run_action_test_batch(session_factory, action.name, parameter_sets, context=test_data.get("context") or {},
+                                 concurrency=concurrency, bypass_cache=bypass_cache,
+                                 include_results=include_results)
+
 @app.post("/actions/test-by-name/{action_name}")
 def test_action_by_name(action_name: str, test_data: dict, db: Session = Depends(get_db)):
     """Test a custom action by name with provided parameters"""
@@ -483,6 +621,7 @@ def fix_action_endpoint(action_id: int, db: Session = Depends(get_db)):
         if fixed_endpoint != original_endpoint:
             # Update the action with the fixed endpoint
             action.endpoint = fixed_endpoint
+            ActionManager.store_compiled_spec(db, action)
             db.commit()
             db.refresh(action)
             
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, JSON, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, JSON, Float, DateTime, Index
+from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -32,6 +33,15 @@ class Action(Base):
     yaml_spec = Column(Text, nullable=True)
     api_key = Column(String, nullable=True) 
     is_active = Column(Boolean, default=True)
+    spec_hash = Column(String, nullable=True, index=True)  # key of the compiled spec in compiled_action_specs
+
+class CompiledActionSpec(Base):
+    __tablename__ = "compiled_action_specs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    spec_hash = Column(String, unique=True, index=True)
+    compiled = Column(JSON)  # endpoint template, path params, header template, response schema
+    created_at = Column(DateTime, server_default=func.now())
 
 class Agent(Base):
     __tablename__ = "agents"
@@ -48,3 +58,84 @@ class Agent(Base):
 
     llm = relationship("LLM")
 
+class RunCheckpoint(Base):
+    __tablename__ = "run_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, unique=True, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"), index=True)
+    status = Column(String, default="running", index=True)  # running, waiting, completed, failed, cancelled, deadline_exceeded
+    input = Column(Text)
+    cursor = Column(JSON)   # stack of flow frames: [{"flow_type", "choice_action", "index"}]
+    context = Column(JSON)  # shared context snapshot taken after the last completed step
+    results = Column(JSON)  # accumulated actions_used, background_actions and user_facing_actions
+    step_count = Column(Integer, default=0)
+    owner = Column(String, nullable=True)  # worker currently executing the run
+    cancel_requested = Column(Boolean, default=False)
+    bypass_cache = Column(Boolean, default=False)  # re-fetch cached action results, also after a resume
+    heartbeat_at = Column(DateTime, server_default=func.now(), index=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class RunJob(Base):
+    __tablename__ = "run_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, unique=True, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"))
+    input = Column(Text)
+    parameters = Column(JSON, nullable=True)
+    bypass_cache = Column(Boolean, default=False)
+    deadline_seconds = Column(Float, nullable=True)  # time budget of each execution attempt
+    priority = Column(Integer, default=0)  # lower value is claimed first
+    status = Column(String, default="queued", index=True)  # queued, running, waiting, completed, failed, cancelled, deadline_exceeded
+    lease_owner = Column(String, nullable=True)  # worker process holding the job
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, default=0)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class Run(Base):
+    __tablename__ = "runs"
+    __table_args__ = (Index("ix_runs_agent_started", "agent_id", "started_at"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, unique=True, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"))
+    input_hash = Column(String, index=True)  # sha256 of the user input, never the input itself
+    status = Column(String, index=True)
+    started_at = Column(DateTime, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Float, default=0.0)  # execution time summed over every segment of the run
+    step_count = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+
+class RunStep(Base):
+    __tablename__ = "run_steps"
+    __table_args__ = (
+        Index("ix_run_steps_started_duration", "started_at", "duration_ms"),
+        Index("ix_run_steps_action_started", "action_name", "started_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"))
+    step_index = Column(Integer)
+    action_name = Column(String)
+    flow_type = Column(String)
+    status = Column(String)  # success or error
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    duration_ms = Column(Float)
+    llm_ms = Column(Float, default=0.0)
+    llm_calls = Column(Integer, default=0)
+    http_ms = Column(Float, default=0.0)
+    http_calls = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    request_bytes = Column(Integer, default=0)
+    response_bytes = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
@@ -0,0 +1,220 @@
+"""
+Import of a whole OpenAPI spec as custom actions: POST /actions/import-openapi/.
+
+The spec is parsed once; every operation (GET/POST/PUT/DELETE) becomes an
+Action named after its operationId, with its own method, endpoint template,
+parameters and a trimmed yaml_spec holding only that operation and the
+components it references, so the action's response schema and $refs work as
+for a hand-written spec. All actions and their compiled specs are inserted in a
+single transaction; progress events are yielded along the way.
+"""
+from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterator, List, Optional
+import logging
+import os
+import re
+import time
+
+import yaml
+
+from app import models
+from app.action_manager import ActionManager
+from app.spec_refs import RefResolver
+from app.utils import sanitize_yaml_content
+
+logger = logging.getLogger(__name__)
+
+# Methods custom actions can call
+IMPORT_METHODS = ("get", "post", "put", "delete")
+# A progress event is yielded every this many operations
+OPENAPI_IMPORT_PROGRESS_EVERY = int(os.getenv("OPENAPI_IMPORT_PROGRESS_EVERY", "50"))
+# Existing names are looked up in chunks, below SQLite's bound-parameter limit
+NAME_LOOKUP_CHUNK = 500
+
+YAML_SAFE_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def parse_openapi(yaml_spec: str, api_key: str = None) -> Dict[str, Any]:
+    """Parse a spec for import, with any copy of the API key replaced by a template first"""
+    spec = ActionManager.parse_yaml_spec(sanitize_yaml_content(yaml_spec, api_key))
+    if not isinstance(spec, dict) or not isinstance(spec.get("paths"), dict):
+        raise ValueError("Specification has no 'paths' to import")
+    return spec
+
+
+def operation_name(path: str, method: str, operation: Dict[str, Any]) -> str:
+    """operationId, or a name derived from method and path when the spec has none"""
+    if operation.get("operationId"):
+        return str(operation["operationId"])
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")
+    return f"{method.upper()}_{slug}" if slug else method.upper()
+
+
+def referenced_components(resolver: RefResolver, node: Any) -> Dict[str, Dict[str, Any]]:
+    """Components reachable from `node` through local $refs, by kind and name"""
+    components: Dict[str, Dict[str, Any]] = {}
+    seen = set()
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, list):
+            stack.extend(current)
+        elif isinstance(current, dict):
+            ref = current.get("$ref")
+            if isinstance(ref, str) and ref.startswith("#/components/") and ref not in seen:
+                seen.add(ref)
+                parts = ref[len("#/components/"):].split("/", 1)
+                target = resolver.lookup(ref)
+                if len(parts) == 2 and target is not None:
+                    components.setdefault(parts[0], {})[parts[1]] = target
+                    stack.append(target)
+            stack.extend(value for key, value in current.items() if key != "$ref")
+    return components
+
+
+def operation_parameters(resolver: RefResolver, path_item: Dict[str, Any],
+                         operation: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Path, query and header parameters (operation-level override path-level) plus JSON body properties"""
+    by_location = {}
+    for raw in list(path_item.get("parameters") or []) + list(operation.get("parameters") or []):
+        param = resolver.resolve(raw)
+        if isinstance(param, dict) and param.get("name"):
+            by_location[(param["name"], param.get("in"))] = param
+
+    parameters = {}
+    for (name, location), param in by_location.items():
+        schema = resolver.resolve(param.get("schema") or {})
+        parameters[name] = {
+            "type": schema.get("type", "string"),
+            "required": bool(param.get("required", location == "path")),
+            "description": param.get("description", ""),
+            "in": location
+        }
+
+    body = resolver.resolve(operation.get("requestBody") or {})
+    schema = resolver.resolve(((body.get("content") or {}).get("application/json") or {}).get("schema") or {})
+    required = set(schema.get("required") or [])
+    for name, prop in (schema.get("properties") or {}).items():
+        prop = resolver.resolve(prop)
+        parameters.setdefault(name, {
+            "type": prop.get("type", "object"),
+            "required": name in required,
+            "description": prop.get("description", ""),
+            "in": "body"
+        })
+    return parameters
+
+
+def operation_document(spec: Dict[str, Any], resolver: RefResolver, path: str, method: str,
+                       operation: Dict[str, Any]) -> Dict[str, Any]:
+    """Self-contained spec holding one operation and the components it references"""
+    document = {"openapi": spec.get("openapi", "3.0.0"), "info": spec.get("info") or {"title": "", "version": ""}}
+    if spec.get("servers"):
+        document["servers"] = spec["servers"][:1]
+    path_item = spec["paths"][path]
+    entry = {method: operation}
+    if path_item.get("parameters"):
+        entry["parameters"] = path_item["parameters"]
+    document["paths"] = {path: entry}
+
+    components = referenced_components(resolver, entry)
+    security_schemes = (spec.get("components") or {}).get("securitySchemes")
+    if security_schemes:
+        components["securitySchemes"] = security_schemes
+    if components:
+        document["components"] = components
+    return document
+
+
+def import_operations(db: Session, spec: Dict[str, Any], api_key: str = None, name_prefix: str = "",
+                      parse_ms: float = 0.0) -> Iterator[Dict[str, Any]]:
+    """Create one action per operation, yielding progress events and finally {"summary": ...}"""
+    started = time.perf_counter()
+    server_url = ""
+    if spec.get("servers"):
+        server_url = (spec["servers"][0] or {}).get("url", "").rstrip("/")
+    headers = ActionManager._headers_from_spec(spec, api_key)
+    # One resolver for the whole import: each component is looked up once however many operations use it
+    resolver = RefResolver(spec)
+
+    operations = []
+    skipped: List[Dict[str, Any]] = []
+    for path, path_item in spec["paths"].items():
+        if not isinstance(path_item, dict):
+            continue
+        for method, operation in path_item.items():
+            if method.lower() not in IMPORT_METHODS:
+                if method not in ("parameters", "summary", "description", "servers", "$ref"):
+                    skipped.append({"name": f"{method.upper()} {path}", "reason": "unsupported method"})
+                continue
+            if isinstance(operation, dict):
+                operations.append((path, method.lower(), operation))
+    total = len(operations)
+    yield {"phase": "parsed", "operations": total, "parse_ms": parse_ms}
+
+    names = [name_prefix + operation_name(path, method, operation) for path, method, operation in operations]
+    existing = set()
+    for start in range(0, len(names), NAME_LOOKUP_CHUNK):
+        chunk = names[start:start + NAME_LOOKUP_CHUNK]
+        existing.update(name for (name,) in db.query(models.Action.name).filter(models.Action.name.in_(chunk)))
+
+    actions = []
+    seen = set()
+    for done, ((path, method, operation), name) in enumerate(zip(operations, names), start=1):
+        if name in existing or name in seen:
+            skipped.append({"name": name, "reason": "an action with this name already exists"})
+        else:
+            seen.add(name)
+            document = operation_document(spec, resolver, path, method, operation)
+            action = models.Action(
+                name=name,
+                description=operation.get("summary") or operation.get("description") or f"{method.upper()} {path}",
+                endpoint=server_url + path,
+                method=method.upper(),
+                parameters=operation_parameters(resolver, spec["paths"][path], operation),
+                headers=headers,
+                action_type="custom",
+                yaml_spec=yaml.dump(document, Dumper=YAML_SAFE_DUMPER, sort_keys=False, allow_unicode=True),
+                api_key=api_key or None
+            )
+            ActionManager.store_compiled_spec(db, action, parsed_spec=document)
+            actions.append(action)
+        if done % OPENAPI_IMPORT_PROGRESS_EVERY == 0 and done < total:
+            yield {"phase": "building", "done": done, "total": total}
+    build_ms = _elapsed_ms(started)
+
+    insert_started = time.perf_counter()
+    try:
+        db.add_all(actions)
+        db.flush()
+        # Read before the commit expires the objects, which would reload them one by one
+        created = [{"id": action.id, "name": action.name, "method": action.method, "endpoint": action.endpoint}
+                   for action in actions]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    insert_ms = _elapsed_ms(insert_started)
+    yield {"phase": "inserted", "created": len(actions), "insert_ms": insert_ms}
+
+    summary = {
+        "operations": total,
+        "created": created,
+        "skipped": skipped,
+        "timings_ms": {"parse": parse_ms, "build": build_ms, "insert": insert_ms,
+                       "total": round(parse_ms + _elapsed_ms(started), 3)}
+    }
+    logger.info("Imported %s of %s operations in %.1fms", len(actions), total, summary["timings_ms"]["total"])
+    yield {"summary": summary}
+
+
+def import_openapi_spec(db: Session, yaml_spec: str, api_key: str = None,
+                        name_prefix: str = "") -> Iterator[Dict[str, Any]]:
+    """Parse and import a spec in one go; ValueError when it cannot be parsed"""
+    started = time.perf_counter()
+    spec = parse_openapi(yaml_spec, api_key)
+    return import_operations(db, spec, api_key, name_prefix, parse_ms=_elapsed_ms(started))
@@ -0,0 +1,270 @@
+"""
+Automatic pagination of list actions, configured in Action.config["pagination"].
+
+    {"style": "page",   "page_param": "page[number]", "page_size_param": "page[size]", "page_size": 50,
+                        "total_pages_path": "meta.total_pages", "items_path": "data"}
+    {"style": "cursor", "cursor_param": "cursor", "next_cursor_path": "meta.next_cursor"}
+    {"style": "link"}   -- next page from the Link header (or "next_url_path" in the body)
+
+Every page is projected as soon as it is read, so only the declared fields of
+its items are kept while the listing grows. When the number of pages is known
+up front, the remaining pages are fetched concurrently in a window of
+"concurrency" pages, consumed in page order. Fetching stops at "max_items",
+"max_pages" or "max_bytes" (bytes read over the wire), whichever comes first;
+a page cut at the action's response size cap also ends the listing as
+"max_bytes", keeping the items of that page that were read in full.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+import contextvars
+import math
+import os
+
+from app.response_stream import ACTION_MAX_RESPONSE_BYTES
+
+PAGINATION_STYLES = ("page", "cursor", "link")
+PAGINATION_MAX_ITEMS = int(os.getenv("PAGINATION_MAX_ITEMS", "1000"))
+PAGINATION_MAX_PAGES = int(os.getenv("PAGINATION_MAX_PAGES", "50"))
+PAGINATION_MAX_BYTES = int(os.getenv("PAGINATION_MAX_BYTES", str(ACTION_MAX_RESPONSE_BYTES)))
+PAGINATION_DEFAULT_CONCURRENCY = int(os.getenv("PAGINATION_DEFAULT_CONCURRENCY", "4"))
+# Threads shared by all listings; a single listing never has more than its concurrency in flight
+PAGINATION_MAX_CONCURRENCY = int(os.getenv("PAGINATION_MAX_CONCURRENCY", "16"))
+
+_page_pool = ThreadPoolExecutor(max_workers=PAGINATION_MAX_CONCURRENCY, thread_name_prefix="action-pages")
+
+# fetch(url, params) -> {"status_code", "headers", "links", "data", "bytes_read", "truncated"}
+PageFetcher = Callable[[str, Optional[Dict[str, Any]]], Dict[str, Any]]
+
+
+def pagination_settings(config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Pagination of an action with defaults filled in, or None when the action is not paginated"""
+    pagination = (config or {}).get("pagination")
+    if not pagination:
+        return None
+    if isinstance(pagination, str):
+        pagination = {"style": pagination}
+    style = pagination.get("style")
+    if style not in PAGINATION_STYLES:
+        raise ValueError(f"Unsupported pagination style '{style}'; use one of: {', '.join(PAGINATION_STYLES)}")
+
+    return {
+        "style": style,
+        "items_path": pagination.get("items_path", "data"),
+        "page_param": pagination.get("page_param", "page"),
+        "start_page": int(pagination.get("start_page", 1)),
+        "page_size_param": pagination.get("page_size_param"),
+        "page_size": int(pagination["page_size"]) if pagination.get("page_size") else None,
+        "total_pages_path": pagination.get("total_pages_path", "meta.total_pages"),
+        "total_items_path": pagination.get("total_items_path"),
+        "cursor_param": pagination.get("cursor_param", "cursor"),
+        "next_cursor_path": pagination.get("next_cursor_path", "meta.next_cursor"),
+        "next_url_path": pagination.get("next_url_path"),
+        "max_items": int(pagination.get("max_items", PAGINATION_MAX_ITEMS)),
+        "max_pages": max(int(pagination.get("max_pages", PAGINATION_MAX_PAGES)), 1),
+        "max_bytes": int(pagination.get("max_bytes", PAGINATION_MAX_BYTES)),
+        "concurrency": max(1, min(int(pagination.get("concurrency", PAGINATION_DEFAULT_CONCURRENCY)),
+                                  PAGINATION_MAX_CONCURRENCY))
+    }
+
+
+def kept_paths(settings: Dict[str, Any]) -> List[str]:
+    """Body paths pagination reads, which the response projection must keep"""
+    if settings["style"] == "page":
+        paths = [settings["total_pages_path"], settings["total_items_path"]]
+    elif settings["style"] == "cursor":
+        paths = [settings["next_cursor_path"]]
+    else:
+        paths = [settings["next_url_path"]]
+    return [path for path in [settings["items_path"]] + paths if path]
+
+
+def get_path(data: Any, path: str) -> Any:
+    """Value at a dotted path ("meta.next_cursor"); the data itself for an empty path"""
+    for part in path.split(".") if path else []:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def set_path(data: Any, path: str, value: Any) -> Any:
+    """`data` with the value at a dotted path replaced; `value` itself for an empty path"""
+    if not path:
+        return value
+    head, _, rest = path.partition(".")
+    data = data if isinstance(data, dict) else {}
+    return {**data, head: set_path(data.get(head), rest, value)}
+
+
+class Listing:
+    """Items gathered so far and the reason fetching stopped, if it stopped early"""
+
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.first: Optional[Dict[str, Any]] = None
+        self.items: List[Any] = []
+        self.pages = 0
+        self.bytes_read = 0
+        self.stop_reason: Optional[str] = None
+
+    def add(self, page: Dict[str, Any]) -> int:
+        """Take in one page; returns how many items it had"""
+        if self.first is None:
+            self.first = page
+        self.pages += 1
+        self.bytes_read += page["bytes_read"]
+        items = get_path(page["data"], self.settings["items_path"])
+        if page["truncated"]:
+            # Cut at the size cap: the items read in full are kept, the last one may be incomplete
+            complete = items[:-1] if isinstance(items, list) else []
+            self.items.extend(complete[:self.settings["max_items"] - len(self.items)])
+            self.stop_reason = "max_bytes"
+            return 0
+
+        if not isinstance(items, list):
+            raise ValueError(f"Paginated response has no list at '{self.settings['items_path'] or '<body>'}'")
+        room = self.settings["max_items"] - len(self.items)
+        self.items.extend(items[:room])
+        if len(self.items) >= self.settings["max_items"]:
+            self.stop_reason = "max_items"
+        elif self.bytes_read >= self.settings["max_bytes"]:
+            self.stop_reason = "max_bytes"
+        return len(items)
+
+    @property
+    def open(self) -> bool:
+        return self.stop_reason is None
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "status_code": self.first["status_code"],
+            "headers": self.first["headers"],
+            "data": set_path(self.first["data"], self.settings["items_path"], self.items),
+            "bytes_read": self.bytes_read,
+            "truncated": self.stop_reason == "max_bytes",
+            "pagination": {
+                "style": self.settings["style"],
+                "pages": self.pages,
+                "items": len(self.items),
+                "complete": self.stop_reason is None,
+                "stop_reason": self.stop_reason
+            }
+        }
+
+
+def fetch_all_pages(fetch: PageFetcher, url: str, params: Dict[str, Any],
+                    settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Fetch the pages of a listing and merge their items into the body of the first page"""
+    listing = Listing(settings)
+    if settings["style"] == "page":
+        _fetch_numbered_pages(listing, fetch, url, params, settings)
+    elif settings["style"] == "cursor":
+        _fetch_cursor_pages(listing, fetch, url, params, settings)
+    else:
+        _fetch_linked_pages(listing, fetch, url, params, settings)
+    return listing.result()
+
+
+def _page_params(params: Dict[str, Any], settings: Dict[str, Any], number: int) -> Dict[str, Any]:
+    page_params = {**params, settings["page_param"]: number}
+    if settings["page_size_param"] and settings["page_size"]:
+        page_params[settings["page_size_param"]] = settings["page_size"]
+    return page_params
+
+
+def _total_pages(data: Any, settings: Dict[str, Any], first_count: int) -> Optional[int]:
+    total_pages = get_path(data, settings["total_pages_path"]) if settings["total_pages_path"] else None
+    if isinstance(total_pages, int):
+        return total_pages
+    total_items = get_path(data, settings["total_items_path"]) if settings["total_items_path"] else None
+    page_size = settings["page_size"] or first_count
+    if isinstance(total_items, int) and page_size:
+        return math.ceil(total_items / page_size)
+    return None
+
+
+def _fetch_numbered_pages(listing: Listing, fetch: PageFetcher, url: str, params: Dict[str, Any],
+                          settings: Dict[str, Any]):
+    number = settings["start_page"]
+    count = listing.add(fetch(url, _page_params(params, settings, number)))
+    total = _total_pages(listing.first["data"], settings, count)
+
+    if total is not None:
+        # Page numbers are known: keep `concurrency` pages in flight, consumed in order
+        last = settings["start_page"] + total - 1
+        numbers = iter(range(number + 1, min(last, number + settings["max_pages"] - 1) + 1))
+        window = deque()
+
+        def submit(page_number: int):
+            # Workers see the caller's deadline and cache settings
+            return _page_pool.submit(contextvars.copy_context().run, fetch, url,
+                                     _page_params(params, settings, page_number))
+
+        try:
+            window.extend(submit(n) for n in islice(numbers, settings["concurrency"]))
+            while window and listing.open:
+                listing.add(window.popleft().result())
+                window.extend(submit(n) for n in islice(numbers, 1))
+        finally:
+            for future in window:
+                future.cancel()
+        if listing.open and listing.pages < total:
+            listing.stop_reason = "max_pages"
+        return
+
+    # Unknown page count: one page after the other until a short or empty page
+    page_size = settings["page_size"] or count
+    while listing.open and count and count >= page_size:
+        if listing.pages >= settings["max_pages"]:
+            listing.stop_reason = "max_pages"
+            return
+        number += 1
+        count = listing.add(fetch(url, _page_params(params, settings, number)))
+
+
+def _fetch_cursor_pages(listing: Listing, fetch: PageFetcher, url: str, params: Dict[str, Any],
+                        settings: Dict[str, Any]):
+    seen = set()
+    page = fetch(url, params)
+    while True:
+        listing.add(page)
+        cursor = get_path(page["data"], settings["next_cursor_path"])
+        if not listing.open or cursor in (None, "") or cursor in seen:
+            return
+        if listing.pages >= settings["max_pages"]:
+            listing.stop_reason = "max_pages"
+            return
+        seen.add(cursor)
+        page = fetch(url, {**params, settings["cursor_param"]: cursor})
+
+
+def _fetch_linked_pages(listing: Listing, fetch: PageFetcher, url: str, params: Dict[str, Any],
+                        settings: Dict[str, Any]):
+    seen = {url}
+    host = urlsplit(url).netloc
+    page = fetch(url, params)
+    while True:
+        listing.add(page)
+        if settings["next_url_path"]:
+            next_url = get_path(page["data"], settings["next_url_path"])
+        else:
+            next_url = (page["links"].get("next") or {}).get("url")
+        if not listing.open or not next_url:
+            return
+        next_url = urljoin(url, next_url)
+        if next_url in seen:
+            return
+        if urlsplit(next_url).netloc != host:
+            # Credentials are never sent to a host the action was not configured for
+            listing.stop_reason = "foreign_link"
+            return
+        if listing.pages >= settings["max_pages"]:
+            listing.stop_reason = "max_pages"
+            return
+        seen.add(next_url)
+        url = next_url
+        # The next link carries its own query string
+        page = fetch(url, None)
@@ -0,0 +1,389 @@
+"""
+Retries and circuit breakers for custom action calls.
+
+Retry policies come from Action.config["retry"] (defaults from the environment):
+idempotent methods are retried on timeouts, connection errors and retryable
+statuses, with exponential backoff and full jitter, honouring Retry-After on
+429/503: a response asking for a longer wait than the policy allows (or than
+the run has left) is returned as it is rather than retried early. Every API host has a circuit breaker: after consecutive failures the
+host is short-circuited for a cool-down, then a single probe call decides
+whether it closes again.
+
+Outbound limits isolate slow or rate-limited APIs: a bulkhead caps the calls in
+flight (Action.config["concurrency"]) and a token bucket caps the request rate
+(Action.config["rate_limit"]), per host by default or per action with
+"scope": "action". Calls over a limit wait in a bounded queue, or fail fast
+with "wait_seconds": 0.
+"""
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+from app.deadline import remaining_seconds
+
+logger = logging.getLogger(__name__)
+
+ACTION_RETRY_MAX_ATTEMPTS = int(os.getenv("ACTION_RETRY_MAX_ATTEMPTS", "3"))
+ACTION_RETRY_BACKOFF_SECONDS = float(os.getenv("ACTION_RETRY_BACKOFF_SECONDS", "0.2"))
+# Longest single wait between attempts; a response asking for a longer Retry-After is not retried
+ACTION_RETRY_MAX_WAIT_SECONDS = float(os.getenv("ACTION_RETRY_MAX_WAIT_SECONDS", "10"))
+# Consecutive failures that open a host's circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Longest wait for a bulkhead slot or a rate-limit token
+ACTION_LIMIT_WAIT_SECONDS = float(os.getenv("ACTION_LIMIT_WAIT_SECONDS", "5"))
+# Callers allowed to queue for a bulkhead slot
+ACTION_BULKHEAD_QUEUE = int(os.getenv("ACTION_BULKHEAD_QUEUE", "16"))
+# Limits applied to every action calling a host, overridden by Action.config; JSON keyed by host,
+# e.g. '{"api.rootly.com": {"rate_limit": {"per_second": 5, "burst": 10}}}' (see the README)
+ACTION_HOST_LIMITS = json.loads(os.getenv("ACTION_HOST_LIMITS", "{}"))
+
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE", "HEAD", "OPTIONS")
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class OutboundLimitExceeded(RuntimeError):
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit open for {host}: too many recent failures, retry in {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def retry_policy(config: Optional[Dict[str, Any]], method: str) -> Dict[str, Any]:
+    """Effective retry policy of an action for a method; non-idempotent methods get one attempt unless opted in"""
+    retry = dict((config or {}).get("retry") or {})
+    idempotent = method.upper() in IDEMPOTENT_METHODS or bool(retry.get("retry_non_idempotent"))
+    return {
+        "max_attempts": max(int(retry.get("max_attempts", ACTION_RETRY_MAX_ATTEMPTS)), 1) if idempotent else 1,
+        "backoff_seconds": float(retry.get("backoff_seconds", ACTION_RETRY_BACKOFF_SECONDS)),
+        "max_wait_seconds": float(retry.get("max_wait_seconds", ACTION_RETRY_MAX_WAIT_SECONDS)),
+        "statuses": tuple(retry.get("statuses", RETRY_STATUSES))
+    }
+
+
+def backoff_seconds(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the wait after `attempt` (1-based)"""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Seconds requested by a Retry-After header (delta-seconds or HTTP date), if any"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    def __init__(self, host: str, failure_threshold: int = None, reset_seconds: float = None):
+        self.host = host
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or CIRCUIT_RESET_SECONDS
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.failures = 0
+        self.successes = 0
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go out now"""
+        with self._lock:
+            if self.state == "open":
+                retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+                if retry_in > 0:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self.host, retry_in)
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self.probe_in_flight:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(self.host, 0.0)
+                self.probe_in_flight = True
+
+    def release_probe(self):
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            if self.state != "closed":
+                logger.info("Circuit for %s closed", self.host)
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Circuit for %s opened after %s consecutive failures",
+                                   self.host, self.consecutive_failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = round(max(self.opened_at + self.reset_seconds - time.monotonic(), 0.0), 3)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failures": self.failures,
+                "successes": self.successes,
+                "short_circuited": self.short_circuited,
+                "retry_in_seconds": retry_in
+            }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}".lower()
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(host)
+            return breaker
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.host: breaker.snapshot() for breaker in breakers}
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+def _limit_wait(config: Dict[str, Any]) -> float:
+    """Seconds a call may wait for a limit: the configured wait capped by the run deadline"""
+    wait = float(config.get("wait_seconds", ACTION_LIMIT_WAIT_SECONDS))
+    remaining = remaining_seconds()
+    return wait if remaining is None else min(wait, remaining)
+
+
+class Bulkhead:
+    """Caps concurrent calls; callers beyond the cap queue up to `max_queue`"""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self, timeout: float):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise OutboundLimitExceeded(f"Too many calls queued for {self.name}", "bulkhead_full")
+                self.waiting += 1
+            try:
+                acquired = timeout > 0 and self._slots.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise OutboundLimitExceeded(
+                    f"No free slot for {self.name} within {timeout:.2f}s ({self.limit} calls in flight)", "bulkhead_full")
+        with self._lock:
+            self.in_use += 1
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"limit": self.limit, "in_use": self.in_use, "waiting": self.waiting,
+                    "max_queue": self.max_queue, "rejected": self.rejected}
+
+
+class TokenBucket:
+    """Allows `per_second` calls on average with bursts of up to `burst`"""
+
+    def __init__(self, name: str, per_second: float, burst: float):
+        self.name = name
+        self.per_second = per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.per_second
+                if waited + wait > timeout:
+                    self.rejected += 1
+                    raise OutboundLimitExceeded(
+                        f"Rate limit of {self.per_second}/s for {self.name} reached", "rate_limited")
+            time.sleep(wait)
+            waited += wait
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.per_second)
+            return {"per_second": self.per_second, "burst": self.burst,
+                    "tokens": round(tokens, 3), "rejected": self.rejected}
+
+
+class OutboundLimits:
+    """Bulkheads and token buckets by scope ("host:<scheme://netloc>" or "action:<id>") and settings.
+
+    Actions configuring the same limit for a host share it; an action with
+    different settings for the host gets its own limiter rather than resetting
+    the shared one.
+    """
+
+    def __init__(self):
+        self._bulkheads: Dict[Tuple, Bulkhead] = {}
+        self._buckets: Dict[Tuple, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(kind_config: Dict[str, Any], action_id: int, host: str) -> str:
+        return f"action:{action_id}" if kind_config.get("scope") == "action" else f"host:{host}"
+
+    def for_call(self, action_id: int, url: str, config: Optional[Dict[str, Any]]
+                 ) -> Tuple[Optional[Tuple[Bulkhead, float]], Optional[Tuple[TokenBucket, float]]]:
+        """Bulkhead and token bucket governing a call, each with how long the call may wait for it"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}".lower()
+        defaults = ACTION_HOST_LIMITS.get(parts.hostname or "", {})
+        config = config or {}
+        concurrency = config.get("concurrency") or defaults.get("concurrency")
+        rate_limit = config.get("rate_limit") or defaults.get("rate_limit")
+
+        bulkhead = bucket = None
+        with self._lock:
+            if concurrency and concurrency.get("limit"):
+                scope = self._scope(concurrency, action_id, host)
+                limit = int(concurrency["limit"])
+                max_queue = int(concurrency.get("queue", ACTION_BULKHEAD_QUEUE))
+                key = (scope, limit, max_queue)
+                bulkhead = self._bulkheads.get(key)
+                if bulkhead is None:
+                    bulkhead = self._bulkheads[key] = Bulkhead(scope, limit, max_queue)
+            if rate_limit and rate_limit.get("per_second"):
+                scope = self._scope(rate_limit, action_id, host)
+                per_second = float(rate_limit["per_second"])
+                burst = float(rate_limit.get("burst", max(per_second, 1)))
+                key = (scope, per_second, burst)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = TokenBucket(scope, per_second, burst)
+
+        return ((bulkhead, _limit_wait(concurrency)) if bulkhead else None,
+                (bucket, _limit_wait(rate_limit)) if bucket else None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            bulkheads, buckets = list(self._bulkheads.values()), list(self._buckets.values())
+        return {"bulkheads": [{"scope": bulkhead.name, **bulkhead.snapshot()} for bulkhead in bulkheads],
+                "rate_limits": [{"scope": bucket.name, **bucket.snapshot()} for bucket in buckets]}
+
+
+def _wait_fits_deadline(wait: float) -> bool:
+    remaining = remaining_seconds()
+    return remaining is None or wait < remaining
+
+
+def send_with_retries(url: str, send: Callable[[], requests.Response], policy: Dict[str, Any],
+                      rate_limit: Optional[Tuple[TokenBucket, float]] = None) -> requests.Response:
+    """Call `send` under the host's circuit breaker, retrying per `policy`.
+
+    Every attempt takes a token from `rate_limit` (bucket, max wait) when given.
+    Returns the last response (which may still be an error status) or raises the
+    last transport error; CircuitOpenError when the host is short-circuited and
+    OutboundLimitExceeded when no token comes in time.
+    """
+    breaker = circuit_breakers.for_url(url)
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limit:
+            rate_limit[0].acquire(rate_limit[1])
+        breaker.before_call()
+        try:
+            response = send()
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            breaker.record_failure()
+            wait = backoff_seconds(attempt, policy["backoff_seconds"], policy["max_wait_seconds"])
+            if attempt >= policy["max_attempts"] or not _wait_fits_deadline(wait):
+                raise
+        except BaseException:
+            # Not an upstream failure (e.g. the run deadline): let another call probe the host
+            breaker.release_probe()
+            raise
+        else:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if response.status_code not in policy["statuses"] or attempt >= policy["max_attempts"]:
+                return response
+            requested = retry_after_seconds(response) if response.status_code in (429, 503) else None
+            if requested is not None and requested > policy["max_wait_seconds"]:
+                # Retrying sooner than the API asked only spends its rate limit on another refusal
+                return response
+            wait = requested if requested is not None else \
+                backoff_seconds(attempt, policy["backoff_seconds"], policy["max_wait_seconds"])
+            if not _wait_fits_deadline(wait):
+                return response
+            response.close()
+
+        logger.info("Retrying %s in %.2fs (attempt %s of %s)", url, wait, attempt + 1, policy["max_attempts"])
+        time.sleep(wait)
+
+
+circuit_breakers = CircuitBreakerRegistry()
+outbound_limits = OutboundLimits()
@@ -0,0 +1,283 @@
+"""
+Response projection compiled from an OpenAPI response schema.
+
+`compile_projection` turns the schema into a JSON-serializable plan once (refs
+resolved against the spec, allOf/oneOf/anyOf merged into the fields any branch
+declares), stored with the compiled action spec. `projector_for` builds a
+function from the plan once per spec and keeps it, so filtering a response is
+a single pass over the decoded data that keeps only the declared fields,
+including those of every element of an array.
+
+Plan nodes are dicts with optional keys:
+    properties  -- {name: node}; undeclared keys are dropped
+    additional  -- True (keep extra keys as-is) or a node for extra keys
+    items       -- node applied to every element of an array
+    ref         -- name of a shared node in the plan's "defs"
+An empty node keeps the value as-is.
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+from app.action_spec import CompiledSpecCache, ACTION_SPEC_CACHE_SIZE
+from app.spec_refs import RefResolver
+
+COMPOSITION_KEYWORDS = ("allOf", "oneOf", "anyOf")
+
+_projectors = CompiledSpecCache(ACTION_SPEC_CACHE_SIZE)
+
+
+def _identity(data: Any) -> Any:
+    return data
+
+
+def compile_projection(schema: Dict[str, Any], spec: Dict[str, Any] = None,
+                       resolver: RefResolver = None) -> Dict[str, Any]:
+    """Compile a response schema into a projection plan; refs resolve against `spec`"""
+    resolver = resolver or RefResolver(spec)
+    defs: Dict[str, Dict[str, Any]] = {}
+    in_progress = set()
+
+    def compile_ref(ref: str) -> Dict[str, Any]:
+        if ref not in defs and ref not in in_progress:
+            target = resolver.lookup(ref)
+            if target is None:
+                return {}
+            # A schema referring back to itself points at the def being compiled
+            in_progress.add(ref)
+            defs[ref] = compile_node(target)
+            in_progress.discard(ref)
+        return {"ref": ref}
+
+    def compile_node(schema_part: Any) -> Dict[str, Any]:
+        if not isinstance(schema_part, dict):
+            return {}
+        if "$ref" in schema_part:
+            return compile_ref(schema_part["$ref"])
+
+        node: Dict[str, Any] = {}
+        if isinstance(schema_part.get("properties"), dict):
+            node["properties"] = {name: compile_node(prop) for name, prop in schema_part["properties"].items()}
+        additional = schema_part.get("additionalProperties")
+        if additional is True or additional == {}:
+            node["additional"] = True
+        elif isinstance(additional, dict):
+            node["additional"] = compile_node(additional)
+        if "items" in schema_part:
+            node["items"] = compile_node(schema_part["items"])
+
+        members = [compile_node(member) for keyword in COMPOSITION_KEYWORDS
+                   for member in (schema_part.get(keyword) or [])]
+        if members:
+            node = merge_nodes([node] + members, defs)
+        return node
+
+    return {"root": compile_node(schema), "defs": defs}
+
+
+def merge_nodes(nodes: List[Dict[str, Any]], defs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Union of the fields declared by every node (composition keeps what any branch declares)"""
+    resolved = []
+    for node in nodes:
+        if "ref" in node:
+            if node["ref"] not in defs:
+                # Still being compiled (a cycle); its fields are reached through the ref elsewhere
+                continue
+            node = defs[node["ref"]]
+        if node:
+            resolved.append(node)
+    if len(resolved) == 1:
+        return resolved[0]
+
+    merged: Dict[str, Any] = {}
+    for node in resolved:
+        if "properties" in node:
+            properties = merged.setdefault("properties", {})
+            for name, prop in node["properties"].items():
+                properties[name] = merge_nodes([properties[name], prop], defs) if name in properties else prop
+        if "additional" in node:
+            current, additional = merged.get("additional"), node["additional"]
+            if current is True or additional is True:
+                merged["additional"] = True
+            else:
+                merged["additional"] = merge_nodes([current, additional], defs) if current else additional
+        if "items" in node:
+            merged["items"] = merge_nodes([merged["items"], node["items"]], defs) if "items" in merged else node["items"]
+    return merged
+
+
+def build_projector(plan: Dict[str, Any]) -> Callable[[Any], Any]:
+    """Turn a plan into a function projecting decoded JSON in one pass"""
+    functions: Dict[str, Callable[[Any], Any]] = {}
+
+    def build(node: Dict[str, Any]) -> Callable[[Any], Any]:
+        if "ref" in node:
+            name = node["ref"]
+            return lambda data: functions[name](data)
+
+        properties = ({name: build(prop) for name, prop in node["properties"].items()}
+                      if "properties" in node else None)
+        additional = node.get("additional")
+        extra = _identity if additional is True else (build(additional) if isinstance(additional, dict) else None)
+        items = build(node["items"]) if "items" in node else None
+        if properties is None and extra is None and items is None:
+            return _identity
+
+        def project(data: Any) -> Any:
+            if isinstance(data, dict) and (properties is not None or extra is not None):
+                if extra is None:
+                    return {name: project_prop(data[name]) for name, project_prop in properties.items() if name in data}
+                projected = {}
+                for key, value in data.items():
+                    project_prop = properties.get(key) if properties else None
+                    projected[key] = project_prop(value) if project_prop is not None else extra(value)
+                return projected
+            if isinstance(data, list) and items is not None:
+                return [items(element) for element in data]
+            return data
+
+        return project
+
+    for name, node in (plan.get("defs") or {}).items():
+        functions[name] = build(node)
+    return build(plan.get("root") or {})
+
+
+def keep_paths(plan: Dict[str, Any], paths: List[str]) -> Dict[str, Any]:
+    """Copy of a plan that also keeps the values at dotted `paths` (e.g. pagination cursors).
+
+    Declared fields keep their node; undeclared objects on the way keep only the
+    path and its last field is kept as-is. Shared nodes on the way are inlined,
+    so other uses of them are unaffected.
+    """
+    defs = plan.get("defs") or {}
+    root = dict(plan.get("root") or {})
+    for path in paths:
+        node = root
+        parts = path.split(".")
+        for depth, part in enumerate(parts):
+            if "ref" in node:
+                node.update(defs.get(node.pop("ref")) or {})
+            if "properties" not in node:
+                # Nothing is filtered at this level
+                break
+            node["properties"] = dict(node["properties"])
+            declared = node["properties"].get(part)
+            if declared is not None:
+                child = dict(declared)
+            else:
+                child = {"properties": {}} if depth < len(parts) - 1 else {}
+            node["properties"][part] = child
+            node = child
+    return {"root": root, "defs": defs}
+
+
+def projector_for(key: str, plan: Dict[str, Any]) -> Callable[[Any], Any]:
+    """Projector of a compiled action spec, built once per spec hash"""
+    projector = _projectors.get(key)
+    if projector is None:
+        projector = build_projector(plan)
+        _projectors.set(key, projector)
+    return projector
+
+
+class _Frame:
+    __slots__ = ("container", "node", "key", "child")
+
+    def __init__(self, container, node):
+        self.container, self.node, self.key, self.child = container, node, None, None
+
+
+class ProjectionBuilder:
+    """Builds the projected value from JSON parser events (ijson's event names).
+
+    Subtrees the plan drops are skipped as their events arrive, so they are
+    never materialized; `partial()` returns what was built when the input ends
+    early.
+    """
+
+    _SKIP = object()
+
+    def __init__(self, plan: Dict[str, Any]):
+        self.defs = plan.get("defs") or {}
+        self.root = plan.get("root") or {}
+        self.stack: List[_Frame] = []
+        self.skip_depth = 0
+        self.value = None
+        self.complete = False
+
+    def _resolve(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        while "ref" in node:
+            node = self.defs.get(node["ref"], {})
+        return node
+
+    def _key_node(self, node: Dict[str, Any], key: str):
+        if "properties" not in node and "additional" not in node:
+            return {}
+        if key in node.get("properties", {}):
+            return node["properties"][key]
+        additional = node.get("additional")
+        if additional is True:
+            return {}
+        return additional if isinstance(additional, dict) else self._SKIP
+
+    def _attach(self, value: Any):
+        if not self.stack:
+            self.value, self.complete = value, True
+            return
+        parent = self.stack[-1]
+        if isinstance(parent.container, list):
+            parent.container.append(value)
+        else:
+            parent.container[parent.key] = value
+
+    def event(self, event: str, value: Any):
+        if self.skip_depth:
+            if event in ("start_map", "start_array"):
+                self.skip_depth += 1
+            elif event in ("end_map", "end_array"):
+                self.skip_depth -= 1
+            return
+
+        if event == "map_key":
+            frame = self.stack[-1]
+            frame.key = value
+            frame.child = self._key_node(frame.node, value)
+            return
+        if event in ("end_map", "end_array"):
+            self._attach(self.stack.pop().container)
+            return
+
+        # A value starts: find the plan node for its position
+        if not self.stack:
+            node = self.root
+        else:
+            parent = self.stack[-1]
+            if isinstance(parent.container, list):
+                node = parent.node.get("items", {})
+            else:
+                node = parent.child
+                if node is self._SKIP:
+                    if event in ("start_map", "start_array"):
+                        self.skip_depth = 1
+                    return
+        node = self._resolve(node)
+
+        if event == "start_map":
+            self.stack.append(_Frame({}, node))
+        elif event == "start_array":
+            self.stack.append(_Frame([], node))
+        else:
+            self._attach(value)
+
+    def partial(self) -> Any:
+        """Close every open container and return the value built so far"""
+        while self.stack:
+            self._attach(self.stack.pop().container)
+        return self.value
+
+
+def project_events(events, plan: Dict[str, Any]) -> Any:
+    """Projected value of a complete stream of (event, value) pairs"""
+    builder = ProjectionBuilder(plan)
+    for event, value in events:
+        builder.event(event, value)
+    return builder.value
@@ -0,0 +1,128 @@
+"""
+Bounded reading of custom action responses.
+
+Bodies are streamed in chunks under a size cap: past it the call is aborted
+or the body is cut at the cap, per ACTION_OVERSIZE_POLICY or the action's
+config["oversize"]. When the action has a response projection, JSON is parsed
+incrementally with ijson and fields the projection drops are skipped as they
+stream by; a body cut at the cap still yields the projection of what arrived.
+Otherwise the capped body is decoded in one go and projected afterwards, and a
+cut JSON body fails the call rather than being passed on as raw text.
+"""
+from typing import Any, Callable, Dict, Optional
+import json
+import os
+
+from app.response_projection import ProjectionBuilder
+
+try:
+    import ijson
+except ImportError:  # listed in requirements.txt; without it bodies are decoded once fully read
+    ijson = None
+
+ACTION_MAX_RESPONSE_BYTES = int(os.getenv("ACTION_MAX_RESPONSE_BYTES", str(10 * 1024 * 1024)))
+# "abort" fails the call past the cap, "truncate" keeps what arrived up to it
+ACTION_OVERSIZE_POLICY = os.getenv("ACTION_OVERSIZE_POLICY", "abort")
+RESPONSE_CHUNK_BYTES = 64 * 1024
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+def response_limits(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Size cap, oversize policy and raw-data retention of an action (config overrides the defaults)"""
+    config = config or {}
+    return {
+        "max_bytes": int(config.get("max_response_bytes") or ACTION_MAX_RESPONSE_BYTES),
+        "oversize": config.get("oversize") or ACTION_OVERSIZE_POLICY,
+        "keep_raw": bool(config.get("keep_raw_data", False))
+    }
+
+
+class CappedBody:
+    """File-like view of a streamed response that never yields more than `max_bytes`"""
+
+    def __init__(self, response, max_bytes: int, truncate: bool):
+        self._chunks = response.iter_content(RESPONSE_CHUNK_BYTES)
+        self._buffer = bytearray()
+        self._exhausted = False
+        self.max_bytes = max_bytes
+        self.truncate = truncate
+        self.bytes_read = 0
+        self.truncated = False
+
+    def read(self, size: int = -1) -> bytes:
+        while (size is None or size < 0 or len(self._buffer) < size) and not self._exhausted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+                break
+            allowed = self.max_bytes - self.bytes_read
+            if len(chunk) > allowed:
+                if not self.truncate:
+                    raise ResponseTooLarge(f"Response exceeds the maximum size of {self.max_bytes} bytes")
+                chunk, self.truncated, self._exhausted = chunk[:allowed], True, True
+            self.bytes_read += len(chunk)
+            # bytearray appends and front deletes are amortized O(1), so multi-MB bodies stay linear
+            self._buffer.extend(chunk)
+
+        if size is None or size < 0:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+
+def read_response(response, plan: Dict[str, Any] = None, projector: Callable[[Any], Any] = None,
+                  max_bytes: int = None, oversize: str = None, keep_raw: bool = False) -> Dict[str, Any]:
+    """Read a streamed response under the size cap.
+
+    Returns "json" (whether the body decoded as JSON), "value" (the decoded body,
+    only when it was materialized), "projected" (the projection when a plan or
+    projector is given), "text" for non-JSON bodies, "bytes_read" and "truncated".
+    """
+    max_bytes = max_bytes or ACTION_MAX_RESPONSE_BYTES
+    truncate = (oversize or ACTION_OVERSIZE_POLICY) == "truncate"
+    try:
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes and not truncate:
+            raise ResponseTooLarge(f"Response of {declared} bytes exceeds the maximum size of {max_bytes} bytes")
+
+        body = CappedBody(response, max_bytes, truncate)
+        content_type = response.headers.get("Content-Type", "")
+        # Without a projection the incremental parser is still used when a cut body must be read in part
+        if ijson is not None and (plan is not None or truncate) and not keep_raw and "json" in content_type:
+            builder = ProjectionBuilder(plan if plan is not None else {"root": {}})
+            try:
+                for _, event, value in ijson.parse(body, use_float=True):
+                    builder.event(event, value)
+            except ijson.JSONError as e:
+                if not body.truncated:
+                    raise ValueError(f"Invalid JSON response: {e}")
+            projected = builder.value if builder.complete else builder.partial()
+            return {"json": True, "value": None if plan is not None else projected,
+                    "projected": projected if plan is not None else None,
+                    "bytes_read": body.bytes_read, "truncated": body.truncated}
+
+        data = body.read()
+        result = {"json": False, "value": None, "projected": None,
+                  "bytes_read": body.bytes_read, "truncated": body.truncated}
+        try:
+            result["value"] = json.loads(data)
+            result["json"] = True
+        except ValueError:
+            if body.truncated and (plan is not None or projector is not None or "json" in content_type):
+                # Cut JSON cannot be decoded here; never hand the unprojected fragment on
+                raise ResponseTooLarge(f"Response exceeds the maximum size of {max_bytes} bytes "
+                                       f"and its JSON cannot be read in part")
+            result["text"] = data.decode(response.encoding or "utf-8", errors="replace")
+            return result
+        if projector is not None:
+            result["projected"] = projector(result["value"])
+        return result
+    finally:
+        # Releases a fully read connection to the pool; closes it when the body was cut short
+        response.close()
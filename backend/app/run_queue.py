@@ -0,0 +1,470 @@
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import Session
+from app import database, models, schemas
+from app.agent_manager import AgentManager
+from app.checkpoint_manager import CheckpointManager, empty_results, new_execution_owner
+from app.utils import clean_action_result, clean_user_facing_action, json_safe_copy
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+import itertools
+import logging
+import os
+import queue
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Lower value is dequeued first
+RUN_PRIORITIES = {"interactive": 0, "batch": 10}
+
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", "4"))
+RUN_QUEUE_MAX_DEPTH = int(os.getenv("RUN_QUEUE_MAX_DEPTH", "100"))
+# Finished jobs kept in memory for status polling; older ones are still served from their checkpoint
+RUN_JOB_RETENTION = int(os.getenv("RUN_JOB_RETENTION", "1000"))
+
+
+RUN_QUEUE_BACKEND = os.getenv("RUN_QUEUE_BACKEND", "memory")  # memory or sqlite
+# Seconds a worker may hold a job without renewing its lease before another worker takes it over
+RUN_LEASE_SECONDS = int(os.getenv("RUN_LEASE_SECONDS", "60"))
+# Claims of a job before it is failed; a job that keeps killing its worker is not retried forever
+RUN_MAX_ATTEMPTS = int(os.getenv("RUN_MAX_ATTEMPTS", "3"))
+
+
+class RunQueueFullError(RuntimeError):
+    """Raised when a run cannot be enqueued because the queue is at its depth limit"""
+
+
+def result_status(result: Optional[Dict[str, Any]]) -> str:
+    """Map the response of a run to the status of its job"""
+    if not result or result.get("error"):
+        return "failed"
+    if result.get("cancelled"):
+        return "cancelled"
+    if result.get("deadline_exceeded"):
+        return "deadline_exceeded"
+    if result.get("wait_required"):
+        return "waiting"
+    return "completed"
+
+
+def describe_run(db: Session, run_id: str, job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Combine the job state with the partial results recorded in the run checkpoint"""
+    checkpoint = CheckpointManager.get_checkpoint(db, run_id)
+    if not job and not checkpoint:
+        return None
+
+    status = {"run_id": run_id}
+    if job:
+        status.update(job)
+    else:
+        status.update({"agent_id": checkpoint.agent_id, "status": checkpoint.status})
+
+    if checkpoint:
+        # Once the engine has checkpointed the run its status is authoritative,
+        # e.g. a run that waited for input and was later continued
+        status["status"] = checkpoint.status
+        results = checkpoint.results or empty_results()
+        status["steps_completed"] = checkpoint.step_count
+        status["partial_results"] = {
+            "actions_used": results.get("actions_used", []),
+            "background_actions": [clean_action_result(action) for action in results.get("background_actions", [])],
+            "user_facing_actions": [clean_user_facing_action(action) for action in results.get("user_facing_actions", [])]
+        }
+    return status
+
+
+class RunWorkerPool:
+    """Execute agent runs asynchronously on a bounded pool of worker threads"""
+
+    def __init__(self, workers: int = None, max_queue_depth: int = None, session_factory=None):
+        self.workers = workers or RUN_WORKERS
+        self.max_queue_depth = max_queue_depth or RUN_QUEUE_MAX_DEPTH
+        self._session_factory = session_factory or database.SessionLocal
+        self._queue = queue.PriorityQueue()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished = []
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"run-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            # Sentinels sort after every real job so queued work drains first
+            self._queue.put((float("inf"), next(self._sequence), None))
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def submit(self, agent_id: int, input_data: schemas.AgentRun, priority: str = "interactive") -> Dict[str, Any]:
+        if priority not in RUN_PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'. Use one of: {', '.join(RUN_PRIORITIES)}")
+
+        self.start()
+        job = {
+            "run_id": uuid.uuid4().hex,
+            "agent_id": agent_id,
+            "priority": priority,
+            "status": "queued",
+            "input_data": input_data,
+            "submitted_at": datetime.utcnow().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+
+        with self._lock:
+            if self._queued >= self.max_queue_depth:
+                raise RunQueueFullError(f"Run queue is full ({self.max_queue_depth} queued runs)")
+            self._queued += 1
+            self._jobs[job["run_id"]] = job
+            position = self._queued
+
+        self._queue.put((RUN_PRIORITIES[priority], next(self._sequence), job["run_id"]))
+        return {**self._public_job(job), "queue_position": position}
+
+    def get_job(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(run_id)
+            return self._public_job(job) if job else None
+
+    def cancel(self, db: Session, run_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(run_id)
+            if job and job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished_at"] = datetime.utcnow().isoformat()
+                self._queued -= 1
+                self._finished.append(run_id)
+                return True
+
+        # Running (or externally started) runs are stopped by the engine between steps
+        return CheckpointManager.request_cancel(db, run_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = len([job for job in self._jobs.values() if job["status"] == "running"])
+            return {
+                "workers": self.workers,
+                "queued": self._queued,
+                "running": running,
+                "max_queue_depth": self.max_queue_depth
+            }
+
+    def get_run_status(self, db: Session, run_id: str) -> Optional[Dict[str, Any]]:
+        return describe_run(db, run_id, self.get_job(run_id))
+
+    def _worker_loop(self):
+        while True:
+            _, _, run_id = self._queue.get()
+            if run_id is None:
+                return
+            try:
+                self._run_job(run_id)
+            except Exception as e:
+                logger.exception("Run worker error: %s", e, extra={"run_id": run_id})
+
+    def _run_job(self, run_id: str):
+        with self._lock:
+            job = self._jobs.get(run_id)
+            if not job or job["status"] != "queued":
+                return  # cancelled while queued
+            self._queued -= 1
+            job["status"] = "running"
+            job["started_at"] = datetime.utcnow().isoformat()
+
+        db = self._session_factory()
+        try:
+            result = AgentManager.run_agent(db, job["agent_id"], job["input_data"], run_id=run_id)
+            status, error = result_status(result), result.get("error")
+        except Exception as e:
+            result, status, error = None, "failed", str(e)
+        finally:
+            db.close()
+
+        with self._lock:
+            job.update({
+                "status": status,
+                "result": result,
+                "error": error,
+                "finished_at": datetime.utcnow().isoformat()
+            })
+            self._finished.append(run_id)
+            while len(self._finished) > RUN_JOB_RETENTION:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    @staticmethod
+    def _public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in job.items() if key != "input_data"}
+
+
+class SQLiteRunQueue:
+    """Durable run queue stored in the run_jobs table.
+
+    The API process only enqueues and reads jobs; separate worker processes
+    (see app.worker) claim them under a lease that they keep renewing while the
+    run executes. A job whose lease expires - its worker crashed or was killed -
+    is claimed again and resumed from its last checkpoint, up to `max_attempts`
+    claims; after that it is failed with its last error.
+    """
+
+    def __init__(self, max_queue_depth: int = None, session_factory=None, lease_seconds: int = None,
+                 max_attempts: int = None):
+        self.max_queue_depth = max_queue_depth or RUN_QUEUE_MAX_DEPTH
+        self.lease_seconds = lease_seconds or RUN_LEASE_SECONDS
+        self.max_attempts = max_attempts or RUN_MAX_ATTEMPTS
+        self._session_factory = session_factory or database.SessionLocal
+
+    def start(self):
+        pass  # jobs are executed by app.worker processes
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+    def submit(self, agent_id: int, input_data: schemas.AgentRun, priority: str = "interactive") -> Dict[str, Any]:
+        if priority not in RUN_PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'. Use one of: {', '.join(RUN_PRIORITIES)}")
+
+        db = self._session_factory()
+        try:
+            queued = db.query(models.RunJob).filter(models.RunJob.status == "queued").count()
+            if queued >= self.max_queue_depth:
+                raise RunQueueFullError(f"Run queue is full ({self.max_queue_depth} queued runs)")
+
+            job = models.RunJob(
+                run_id=uuid.uuid4().hex,
+                agent_id=agent_id,
+                input=input_data.input,
+                parameters=input_data.parameters,
+                bypass_cache=input_data.bypass_cache,
+                deadline_seconds=input_data.deadline_seconds,
+                priority=RUN_PRIORITIES[priority],
+                status="queued"
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            return {**self._public_job(job), "queue_position": queued + 1}
+        finally:
+            db.close()
+
+    def get_job(self, run_id: str) -> Optional[Dict[str, Any]]:
+        db = self._session_factory()
+        try:
+            job = db.query(models.RunJob).filter(models.RunJob.run_id == run_id).first()
+            return self._public_job(job) if job else None
+        finally:
+            db.close()
+
+    def cancel(self, db: Session, run_id: str) -> bool:
+        cancelled = db.query(models.RunJob).filter(
+            models.RunJob.run_id == run_id,
+            models.RunJob.status == "queued"
+        ).update({"status": "cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        if cancelled:
+            return True
+
+        # Claimed runs are stopped by the engine between steps
+        return CheckpointManager.request_cancel(db, run_id)
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._session_factory()
+        try:
+            counts = dict(
+                db.query(models.RunJob.status, func.count(models.RunJob.id))
+                .group_by(models.RunJob.status).all()
+            )
+            return {
+                "backend": "sqlite",
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "max_queue_depth": self.max_queue_depth,
+                "by_status": counts
+            }
+        finally:
+            db.close()
+
+    def get_run_status(self, db: Session, run_id: str) -> Optional[Dict[str, Any]]:
+        return describe_run(db, run_id, self.get_job(run_id))
+
+    def claim_next(self, db: Session, owner: str) -> Optional[models.RunJob]:
+        """Claim the highest-priority queued job, or one whose lease has expired"""
+        now = datetime.utcnow()
+        self._fail_exhausted(db, now)
+        claimable = or_(
+            models.RunJob.status == "queued",
+            and_(models.RunJob.status == "running", models.RunJob.lease_expires_at < now,
+                 models.RunJob.attempts < self.max_attempts)
+        )
+
+        for _ in range(5):
+            candidate = db.query(models.RunJob.id).filter(claimable).order_by(
+                models.RunJob.priority, models.RunJob.id
+            ).first()
+            if not candidate:
+                return None
+
+            # Conditional update: only one process can move the row out of its claimable state
+            claimed = db.query(models.RunJob).filter(models.RunJob.id == candidate.id, claimable).update({
+                "status": "running",
+                "lease_owner": owner,
+                "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                "attempts": models.RunJob.attempts + 1,
+                "started_at": now
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:
+                return db.query(models.RunJob).filter(models.RunJob.id == candidate.id).first()
+        return None
+
+    def _fail_exhausted(self, db: Session, now: datetime):
+        """Fail the jobs whose lease expired on their last allowed attempt"""
+        expired = and_(models.RunJob.status == "running", models.RunJob.lease_expires_at < now,
+                       models.RunJob.attempts >= self.max_attempts)
+        for job in db.query(models.RunJob).filter(expired).all():
+            error = job.error or f"Gave up after {job.attempts} attempts: the lease of the last one expired"
+            # Conditional update, like a claim: only one process records the failure
+            failed = db.query(models.RunJob).filter(models.RunJob.id == job.id, expired).update({
+                "status": "failed",
+                "error": error,
+                "lease_expires_at": None,
+                "finished_at": now
+            }, synchronize_session=False)
+            if failed:
+                # The checkpoint status is what run status polling reports
+                db.query(models.RunCheckpoint).filter(
+                    models.RunCheckpoint.run_id == job.run_id,
+                    models.RunCheckpoint.status == "running"
+                ).update({"status": "failed", "owner": None}, synchronize_session=False)
+                logger.warning("Job failed after %d attempts", job.attempts, extra={"run_id": job.run_id})
+            db.commit()
+
+    def renew_lease(self, db: Session, job_id: int, owner: str) -> bool:
+        renewed = db.query(models.RunJob).filter(
+            models.RunJob.id == job_id,
+            models.RunJob.lease_owner == owner,
+            models.RunJob.status == "running"
+        ).update({"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+
+    def execute_job(self, job_id: int, owner: str) -> str:
+        """Run a claimed job to completion while a background thread keeps its lease alive.
+
+        If the lease is lost anyway (e.g. the worker stalled and the job was claimed
+        again elsewhere) the run checkpoint is released, which stops the engine at
+        its next step instead of letting two workers execute the same run.
+        """
+        db = self._session_factory()
+        job = db.query(models.RunJob).filter(models.RunJob.id == job_id).first()
+        execution_owner = new_execution_owner()
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            heartbeat_db = self._session_factory()
+            try:
+                while not stop_heartbeat.wait(self.lease_seconds / 3):
+                    if not self.renew_lease(heartbeat_db, job_id, owner):
+                        logger.warning("Lost the lease of the job, stopping its run", extra={"run_id": job.run_id})
+                        CheckpointManager.release(heartbeat_db, job.run_id, execution_owner)
+                        return
+            finally:
+                heartbeat_db.close()
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            try:
+                result, status = self._run_or_resume(db, job, execution_owner)
+                error = result.get("error") if result else None
+            except Exception as e:
+                db.rollback()
+                result, status, error = None, "failed", str(e)
+
+            db.query(models.RunJob).filter(
+                models.RunJob.id == job_id,
+                models.RunJob.lease_owner == owner
+            ).update({
+                "status": status,
+                "result": json_safe_copy(result),
+                "error": error,
+                "lease_expires_at": None,
+                "finished_at": datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+            return status
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+            db.close()
+
+    @staticmethod
+    def _run_or_resume(db: Session, job: models.RunJob, execution_owner: str):
+        """Start or continue the run of a job; returns its result and job status"""
+        checkpoint = CheckpointManager.get_checkpoint(db, job.run_id)
+        if checkpoint is None:
+            input_data = schemas.AgentRun(input=job.input, parameters=job.parameters,
+                                          bypass_cache=bool(job.bypass_cache),
+                                          deadline_seconds=job.deadline_seconds)
+            result = AgentManager.run_agent(db, job.agent_id, input_data, run_id=job.run_id, owner=execution_owner)
+            return result, result_status(result)
+
+        if checkpoint.status == "running":
+            # A previous worker died mid-run: take the checkpoint over and continue
+            # from its cursor so completed steps are not executed again
+            logger.info("Resuming run (attempt %d) from its last checkpoint", job.attempts, extra={"run_id": job.run_id})
+            # The job lease makes this worker the only one allowed to take it over
+            CheckpointManager.claim_run(db, job.run_id, execution_owner, from_statuses=("running",))
+            result = AgentManager.resume_run(db, job.run_id, owner=execution_owner,
+                                             deadline_seconds=job.deadline_seconds)
+            return result, result_status(result)
+
+        # The run finished but the worker died before recording it on the job:
+        # the checkpoint already says how it ended
+        results = checkpoint.results or empty_results()
+        result = {
+            "run_id": job.run_id,
+            "status": checkpoint.status,
+            "actions_used": results.get("actions_used", []),
+            "error": "Run failed" if checkpoint.status == "failed" else None
+        }
+        return result, checkpoint.status
+
+    @staticmethod
+    def _public_job(job: models.RunJob) -> Dict[str, Any]:
+        priority_names = {value: name for name, value in RUN_PRIORITIES.items()}
+        return {
+            "run_id": job.run_id,
+            "agent_id": job.agent_id,
+            "priority": priority_names.get(job.priority, job.priority),
+            "status": job.status,
+            "attempts": job.attempts,
+            "submitted_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+            "result": job.result,
+            "error": job.error
+        }
+
+
+def create_run_pool():
+    if RUN_QUEUE_BACKEND == "sqlite":
+        return SQLiteRunQueue()
+    return RunWorkerPool()
+
+
+run_pool = create_run_pool()
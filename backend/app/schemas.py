@@ -131,4 +131,9 @@ class AgentRun(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
 
     input: str
-    parameters: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    parameters: Optional[Dict[str, Any]] = None
+    bypass_cache: bool = False  # re-fetch cached custom action results during this run
+    deadline_seconds: Optional[float] = None  # time budget for the run; partial results when exceeded
+
+class RunJobCreate(AgentRun):
+    priority: str = "interactive"  # interactive or batch
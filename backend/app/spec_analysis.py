@@ -0,0 +1,87 @@
+"""
+Single-parse analysis of an OpenAPI spec for the action editor (/actions/parse-yaml/).
+
+The YAML text is parsed once and parameters, endpoint, response schema and its
+preview are derived from the same tree. Analyses are memoized by a hash of the
+text, so the editor's repeated previews of the same spec skip parsing
+altogether. Headers depend on the API key and are derived per request from
+the cached tree.
+"""
+from typing import Any, Dict, Optional
+import hashlib
+import os
+import threading
+
+from app.action_manager import ActionManager
+from app.action_spec import CompiledSpecCache
+from app.spec_refs import RefResolver
+
+SPEC_ANALYSIS_CACHE_SIZE = int(os.getenv("SPEC_ANALYSIS_CACHE_SIZE", "32"))
+
+_analyses = CompiledSpecCache(SPEC_ANALYSIS_CACHE_SIZE)
+
+
+class SpecAnalysis:
+    """Everything the editor shows for a spec, derived from one parse"""
+
+    def __init__(self, yaml_spec: str):
+        self.spec = ActionManager.parse_yaml_spec(yaml_spec)
+        if not isinstance(self.spec, dict):
+            raise ValueError("Specification must be a YAML mapping")
+        self.resolver = RefResolver(self.spec)
+        self._derived: Dict[str, Any] = {}
+        # Re-entrant: a derived value may be computed from another one
+        self._lock = threading.RLock()
+
+    def _derive(self, name: str, compute):
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = compute()
+            return self._derived[name]
+
+    @property
+    def parameters(self) -> Dict[str, Any]:
+        return self._derive("parameters", lambda: ActionManager._parameters_from_spec(self.spec, self.resolver))
+
+    @property
+    def endpoint(self) -> str:
+        def first_endpoint():
+            paths = self.spec.get("paths") or {}
+            if not paths:
+                return ""
+            # Get the server URL if available
+            servers = self.spec.get("servers") or []
+            server_url = servers[0].get("url", "") if servers and isinstance(servers[0], dict) else ""
+            return server_url + next(iter(paths))
+        return self._derive("endpoint", first_endpoint)
+
+    @property
+    def response_schema(self) -> Dict[str, Any]:
+        return self._derive("response_schema", lambda: ActionManager._response_schema_from_spec(self.spec, self.resolver))
+
+    @property
+    def schema_preview(self) -> Optional[Any]:
+        return self._derive("schema_preview", lambda: ActionManager._generate_schema_preview(
+            self.response_schema, resolver=self.resolver) if self.response_schema else None)
+
+    def headers(self, api_key: str = None) -> Dict[str, str]:
+        return ActionManager._headers_from_spec(self.spec, api_key)
+
+    def describe(self, api_key: str = None) -> Dict[str, Any]:
+        return {
+            "parameters": self.parameters,
+            "headers": self.headers(api_key),
+            "endpoint": self.endpoint,
+            "response_schema": self.response_schema,
+            "schema_preview": self.schema_preview
+        }
+
+
+def analyze_spec(yaml_spec: str) -> SpecAnalysis:
+    """Analysis of a spec text, reused while the same text is analyzed again"""
+    key = hashlib.sha256(yaml_spec.encode("utf-8")).hexdigest()
+    analysis = _analyses.get(key)
+    if analysis is None:
+        analysis = SpecAnalysis(yaml_spec)
+        _analyses.set(key, analysis)
+    return analysis
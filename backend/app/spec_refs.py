@@ -0,0 +1,52 @@
+"""
+Memoized $ref resolution for OpenAPI specs.
+
+A RefResolver is created once per parsed spec and shared by everything that
+walks it (parameter generation, response schema extraction, schema preview,
+projection compilation, import). Each local reference is looked up once;
+chains of references are followed with cycle detection, so resolving every
+$ref in a large spec is linear in its size.
+"""
+from typing import Any, Dict, Optional
+
+
+class RefResolver:
+    def __init__(self, spec: Any):
+        self.spec = spec
+        self._targets: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def lookup(self, ref: str) -> Optional[Dict[str, Any]]:
+        """Target of a local JSON pointer ("#/components/schemas/Incident"), or None"""
+        if ref in self._targets:
+            return self._targets[ref]
+        target = None
+        if isinstance(ref, str) and ref.startswith("#/"):
+            target = self.spec
+            for part in ref[2:].split("/"):
+                part = part.replace("~1", "/").replace("~0", "~")
+                if not isinstance(target, dict) or part not in target:
+                    target = None
+                    break
+                target = target[part]
+            if not isinstance(target, dict):
+                target = None
+        self._targets[ref] = target
+        return target
+
+    def resolve(self, node: Any) -> Any:
+        """Follow $ref (and refs to refs) to the node they point at; unresolvable or circular chains give {}"""
+        seen = set()
+        while isinstance(node, dict) and "$ref" in node:
+            ref = node["$ref"]
+            if ref in seen:
+                return {}
+            seen.add(ref)
+            node = self.lookup(ref)
+            if node is None:
+                return {}
+        return node
+
+
+def ref_name(ref: str) -> str:
+    """Last segment of a reference: "#/components/schemas/Incident" -> "Incident\""""
+    return str(ref).rsplit("/", 1)[-1]
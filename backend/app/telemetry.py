@@ -0,0 +1,460 @@
+from sqlalchemy import insert, func, case, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app import database, models
+from app.utils import percentile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import atexit
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_ENABLED = os.getenv("RUN_TELEMETRY_ENABLED", "true").lower() == "true"
+TELEMETRY_BATCH_SIZE = int(os.getenv("RUN_TELEMETRY_BATCH_SIZE", "200"))
+TELEMETRY_FLUSH_SECONDS = float(os.getenv("RUN_TELEMETRY_FLUSH_SECONDS", "1.0"))
+TELEMETRY_MAX_PENDING = int(os.getenv("RUN_TELEMETRY_MAX_PENDING", "10000"))
+
+# Metrics of the step currently executing in this thread/task; LLM and HTTP
+# calls add to it without the engine having to thread it through every call
+_current_step: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_step", default=None)
+
+
+# Timing collector of the run being served by the current request, if one was asked for
+_current_run_timings: ContextVar[Optional["RunTimings"]] = ContextVar("current_run_timings", default=None)
+
+# Phases reported per step and in the Server-Timing header, with their descriptions
+TIMING_PHASES = {
+    "extraction": "Parameter extraction",
+    "action": "Action execution",
+    "context": "Context build",
+    "checkpoint": "Checkpoint save",
+    "db": "Database (overlaps other phases)",
+    "llm": "LLM calls",
+    "http": "Action HTTP calls"
+}
+
+
+def hash_input(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def record_llm_call(duration_ms: float):
+    step = _current_step.get()
+    if step is not None:
+        step["llm_ms"] += duration_ms
+        step["llm_calls"] += 1
+
+
+def record_llm_usage(prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Token usage reported by a provider; timing is recorded separately by call_llm"""
+    step = _current_step.get()
+    if step is not None:
+        step["prompt_tokens"] += prompt_tokens or 0
+        step["completion_tokens"] += completion_tokens or 0
+
+
+def record_http_call(duration_ms: float, request_bytes: int = 0, response_bytes: int = 0):
+    step = _current_step.get()
+    if step is not None:
+        step["http_ms"] += duration_ms
+        step["http_calls"] += 1
+        step["request_bytes"] += request_bytes or 0
+        step["response_bytes"] += response_bytes or 0
+
+
+@contextmanager
+def time_phase(name: str, step: Dict[str, Any] = None):
+    """Add the time spent in the block to `<name>_ms` of the given (or current) step"""
+    step = step if step is not None else _current_step.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if step is not None:
+            step[f"{name}_ms"] = step.get(f"{name}_ms", 0.0) + (time.perf_counter() - start) * 1000
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_start_time")
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+
+    step = _current_step.get()
+    if step is not None:
+        step["db_ms"] = step.get("db_ms", 0.0) + elapsed_ms
+    run_timings = _current_run_timings.get()
+    if run_timings is not None:
+        run_timings.db_ms += elapsed_ms
+
+
+class RunTimings:
+    """Per-step timing breakdown of one request to the agent engine"""
+
+    def __init__(self):
+        self.steps: List[Dict[str, Any]] = []
+        self.db_ms = 0.0
+        self._start = time.perf_counter()
+        self.total_ms = None
+
+    def add_step(self, step: Dict[str, Any]):
+        # Kept by reference: context build and checkpoint time are added after the step closes
+        self.steps.append(step)
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+
+    def totals(self) -> Dict[str, float]:
+        totals = {phase: sum(step.get(f"{phase}_ms", 0.0) for step in self.steps) for phase in TIMING_PHASES}
+        # Queries outside steps (agent lookup, checkpoint creation) count towards db too
+        totals["db"] = self.db_ms
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.total_ms or 0.0, 3),
+            "phases_ms": {phase: round(value, 3) for phase, value in self.totals().items()},
+            "steps": [
+                {
+                    "step_index": step["step_index"],
+                    "action": step["action_name"],
+                    "flow_type": step["flow_type"],
+                    "duration_ms": round(step.get("duration_ms", 0.0), 3),
+                    **{f"{phase}_ms": round(step.get(f"{phase}_ms", 0.0), 3) for phase in TIMING_PHASES}
+                }
+                for step in self.steps
+            ]
+        }
+
+    def server_timing_header(self) -> str:
+        metrics = [
+            f'{phase};dur={value:.1f};desc="{TIMING_PHASES[phase]}"'
+            for phase, value in self.totals().items()
+        ]
+        metrics.append(f'total;dur={(self.total_ms or 0.0):.1f};desc="Agent engine"')
+        return ", ".join(metrics)
+
+
+@contextmanager
+def collect_run_timings():
+    """Collect the timing breakdown of every step executed inside the block"""
+    run_timings = RunTimings()
+    token = _current_run_timings.set(run_timings)
+    try:
+        yield run_timings
+    finally:
+        _current_run_timings.reset(token)
+        run_timings.finish()
+
+
+@contextmanager
+def track_step(run_id: str, agent_id: int, step_index: int, action_name: str, flow_type: str):
+    """Collect the metrics of one engine step and queue them for the telemetry writer"""
+    step = {
+        "run_id": run_id,
+        "agent_id": agent_id,
+        "step_index": step_index,
+        "action_name": action_name,
+        "flow_type": flow_type,
+        "status": "success",
+        "started_at": datetime.utcnow(),
+        "llm_ms": 0.0,
+        "llm_calls": 0,
+        "http_ms": 0.0,
+        "http_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "request_bytes": 0,
+        "response_bytes": 0,
+        "error": None
+    }
+    token = _current_step.set(step)
+    start = time.perf_counter()
+    try:
+        yield step
+    except Exception as e:
+        step["status"] = "error"
+        step["error"] = str(e)
+        raise
+    finally:
+        _current_step.reset(token)
+        step["duration_ms"] = (time.perf_counter() - start) * 1000
+        step["finished_at"] = datetime.utcnow()
+        run_timings = _current_run_timings.get()
+        if run_timings is not None:
+            run_timings.add_step(step)
+        if run_id:
+            telemetry_writer.submit("step", {key: value for key, value in step.items() if key in STEP_COLUMNS})
+
+
+# Step metrics that add up when work done elsewhere (a speculative prefetch) is adopted by a step
+ADDITIVE_STEP_METRICS = (
+    "llm_ms", "llm_calls", "http_ms", "http_calls", "prompt_tokens", "completion_tokens",
+    "request_bytes", "response_bytes", "extraction_ms", "action_ms", "db_ms"
+)
+
+
+def merge_step_metrics(target: Dict[str, Any], source: Dict[str, Any]):
+    for key in ADDITIVE_STEP_METRICS:
+        if key in source:
+            target[key] = target.get(key, 0) + source[key]
+
+
+class SpeculationStats:
+    """Process-wide counters of speculative branch prefetches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"started": 0, "used": 0, "wasted": 0, "failed": 0}
+        self._wasted_by_action: Dict[str, int] = {}
+
+    def record(self, outcome: str, action_name: str = None):
+        with self._lock:
+            self._counts[outcome] += 1
+            if outcome == "wasted" and action_name:
+                self._wasted_by_action[action_name] = self._wasted_by_action.get(action_name, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "wasted_by_action": dict(self._wasted_by_action)}
+
+
+speculation_stats = SpeculationStats()
+
+
+def record_run(run_id: str, agent_id: int, input_text: str, status: str, started_at: datetime,
+               duration_ms: float, step_count: int, error: str = None):
+    """Queue the outcome of a run segment (a run resumed after Wait has several)"""
+    telemetry_writer.submit("run", {
+        "run_id": run_id,
+        "agent_id": agent_id,
+        "input_hash": hash_input(input_text),
+        "status": status,
+        "started_at": started_at,
+        "finished_at": datetime.utcnow(),
+        "duration_ms": duration_ms,
+        "step_count": step_count,
+        "error": error
+    })
+
+
+STEP_COLUMNS = {column.name for column in models.RunStep.__table__.columns} - {"id"}
+
+
+class TelemetryWriter:
+    """Write run telemetry off the request path in batched bulk inserts"""
+
+    def __init__(self, session_factory=None, batch_size: int = None, flush_interval: float = None,
+                 max_pending: int = None, enabled: bool = None):
+        self._session_factory = session_factory or database.SessionLocal
+        self.batch_size = batch_size or TELEMETRY_BATCH_SIZE
+        self.flush_interval = flush_interval or TELEMETRY_FLUSH_SECONDS
+        self.enabled = TELEMETRY_ENABLED if enabled is None else enabled
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending or TELEMETRY_MAX_PENDING)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def submit(self, kind: str, record: Dict[str, Any]):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, record))
+        except queue.Full:
+            # Telemetry must never slow a run down; shed load instead
+            self.dropped += 1
+
+    def flush(self):
+        """Write everything queued so far (used on shutdown and in tests)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="telemetry-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self._write(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch: List):
+        if not batch:
+            return
+        steps = [record for kind, record in batch if kind == "step"]
+        runs = [record for kind, record in batch if kind == "run"]
+
+        with self._write_lock:
+            db = self._session_factory()
+            try:
+                if steps:
+                    db.execute(insert(models.RunStep), steps)
+                if runs:
+                    self._merge_runs(db, runs)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error("Error writing run telemetry: %s", e)
+            finally:
+                db.close()
+
+    @staticmethod
+    def _merge_runs(db: Session, runs: List[Dict[str, Any]]):
+        # Fold segments of the same run within the batch, then against stored rows
+        merged: Dict[str, Dict[str, Any]] = {}
+        for record in runs:
+            current = merged.get(record["run_id"])
+            if current is None:
+                merged[record["run_id"]] = dict(record)
+            else:
+                current.update({
+                    "status": record["status"],
+                    "finished_at": record["finished_at"],
+                    "duration_ms": current["duration_ms"] + record["duration_ms"],
+                    "step_count": current["step_count"] + record["step_count"],
+                    "error": record["error"]
+                })
+
+        existing = {
+            run.run_id: run for run in
+            db.query(models.Run).filter(models.Run.run_id.in_(list(merged))).all()
+        }
+        new_rows = []
+        for run_id, record in merged.items():
+            run = existing.get(run_id)
+            if run is None:
+                new_rows.append(record)
+                continue
+            run.status = record["status"]
+            run.finished_at = record["finished_at"]
+            run.duration_ms = (run.duration_ms or 0.0) + record["duration_ms"]
+            run.step_count = (run.step_count or 0) + record["step_count"]
+            run.error = record["error"]
+        if new_rows:
+            db.execute(insert(models.Run), new_rows)
+
+
+telemetry_writer = TelemetryWriter()
+atexit.register(telemetry_writer.flush)
+
+
+class TelemetryManager:
+    """Queries over run history for finding slow and failing agents"""
+
+    @staticmethod
+    def _window_start(since_minutes: int) -> datetime:
+        return datetime.utcnow() - timedelta(minutes=since_minutes)
+
+    @staticmethod
+    def slowest_steps(db: Session, since_minutes: int = 60, limit: int = 20, agent_id: int = None):
+        query = db.query(models.RunStep).filter(
+            models.RunStep.started_at >= TelemetryManager._window_start(since_minutes)
+        )
+        if agent_id is not None:
+            query = query.filter(models.RunStep.agent_id == agent_id)
+
+        return [
+            {
+                "run_id": step.run_id,
+                "agent_id": step.agent_id,
+                "step_index": step.step_index,
+                "action_name": step.action_name,
+                "flow_type": step.flow_type,
+                "status": step.status,
+                "started_at": step.started_at.isoformat(),
+                "duration_ms": step.duration_ms,
+                "llm_ms": step.llm_ms,
+                "http_ms": step.http_ms,
+                "prompt_tokens": step.prompt_tokens,
+                "completion_tokens": step.completion_tokens,
+                "request_bytes": step.request_bytes,
+                "response_bytes": step.response_bytes,
+                "error": step.error
+            }
+            for step in query.order_by(models.RunStep.duration_ms.desc()).limit(limit).all()
+        ]
+
+    @staticmethod
+    def latency_by_agent(db: Session, since_minutes: int = 60):
+        rows = db.query(models.Run.agent_id, models.Run.duration_ms).filter(
+            models.Run.started_at >= TelemetryManager._window_start(since_minutes)
+        ).order_by(models.Run.agent_id).all()
+
+        durations: Dict[int, List[float]] = {}
+        for agent_id, duration_ms in rows:
+            durations.setdefault(agent_id, []).append(duration_ms or 0.0)
+
+        return [
+            {
+                "agent_id": agent_id,
+                "runs": len(values),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "max_ms": max(values)
+            }
+            for agent_id, values in durations.items()
+        ]
+
+    @staticmethod
+    def error_rates(db: Session, since_minutes: int = 60):
+        window_start = TelemetryManager._window_start(since_minutes)
+
+        run_rows = db.query(
+            models.Run.agent_id,
+            func.count(models.Run.id),
+            func.sum(case((models.Run.status == "failed", 1), else_=0))
+        ).filter(models.Run.started_at >= window_start).group_by(models.Run.agent_id).all()
+
+        step_rows = db.query(
+            models.RunStep.action_name,
+            func.count(models.RunStep.id),
+            func.sum(case((models.RunStep.status == "error", 1), else_=0))
+        ).filter(models.RunStep.started_at >= window_start).group_by(models.RunStep.action_name).all()
+
+        return {
+            "since_minutes": since_minutes,
+            "agents": [
+                {"agent_id": agent_id, "runs": total, "failed": failed or 0, "error_rate": (failed or 0) / total}
+                for agent_id, total, failed in run_rows
+            ],
+            "actions": [
+                {"action_name": action_name, "steps": total, "failed": failed or 0, "error_rate": (failed or 0) / total}
+                for action_name, total, failed in step_rows
+            ]
+        }
@@ -165,6 +165,101 @@ def clean_action_result(action_result: Dict[str, Any]) -> Dict[str, Any]:
     return cleaned
 
 
+def clean_user_facing_action(action: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep only the user-visible parts of a user-facing action result
+    """
+    result = action.get("result", {})
+    return {
+        "action": action.get("action", "Unknown"),
+        "iteration": action.get("iteration", 0),
+        "parameters_used": action.get("parameters_used", {}),
+        "result": {
+            "type": result.get("type", "unknown"),
+            "content": result.get("content", "No content"),
+            "background": result.get("background", False),
+            "user_message": result.get("user_message", False)
+        }
+    }
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Percentile with linear interpolation between closest ranks
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def json_safe_copy(data: Any, _path: Optional[set] = None) -> Any:
+    """
+    Deep copy data into JSON-serializable structures, breaking circular references
+    """
+    if _path is None:
+        _path = set()
+
+    if isinstance(data, (dict, list, tuple)):
+        if id(data) in _path:
+            return "<circular>"
+        _path.add(id(data))
+        if isinstance(data, dict):
+            copied = {str(key): json_safe_copy(value, _path) for key, value in data.items()}
+        else:
+            copied = [json_safe_copy(item, _path) for item in data]
+        _path.discard(id(data))
+        return copied
+
+    if data is None or isinstance(data, (str, int, float, bool)):
+        return data
+
+    return str(data)
+
+
+_MISSING = object()
+
+
+def resolve_path(data: Any, path: str, default: Any = None) -> Any:
+    """
+    Resolve um caminho pontuado ("GetIncident_data.attributes.title", "thinking_process.-1.content")
+    """
+    current = data
+    for segment in path.split("."):
+        if isinstance(current, dict):
+            current = current.get(segment, _MISSING)
+        elif isinstance(current, list):
+            try:
+                current = current[int(segment)]
+            except (ValueError, IndexError):
+                current = _MISSING
+        else:
+            current = _MISSING
+        if current is _MISSING:
+            return default
+    return current
+
+
+def project_context(context: Optional[Dict[str, Any]], projection: Optional[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Projeta caminhos selecionados do contexto em campos do corpo ({"campo": "caminho.no.contexto"});
+    caminhos ausentes no contexto são omitidos
+    """
+    if not context or not isinstance(projection, dict):
+        return {}
+    projected = {}
+    for field, path in projection.items():
+        if not isinstance(path, str):
+            continue
+        value = resolve_path(context, path, _MISSING)
+        if value is not _MISSING:
+            projected[field] = json_safe_copy(value)
+    return projected
+
+
 def validate_required_fields(data: Dict[str, Any], required_fields: List[str]) -> List[str]:
     """
     Valida campos obrigatórios e retorna lista de campos faltantes
@@ -189,6 +284,10 @@ def sanitize_yaml_content(yaml_content: str, api_key: str = None) -> str:
     return sanitized
 
 
+# Action entries kept in conversation_history; older turns live in the conversation memory
+CONVERSATION_HISTORY_LIMIT = 20
+
+
 class ContextBuilder:
     """
     Classe para construir contexto de forma mais limpa
@@ -238,6 +337,7 @@ class ContextBuilder:
             "content": content,
             "background": background
         })
+        del self.context["conversation_history"][:-CONVERSATION_HISTORY_LIMIT]
         return self
     
     def build(self) -> Dict[str, Any]:
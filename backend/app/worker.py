@@ -0,0 +1,97 @@
+"""
+Run worker entry point: executes queued agent runs from the SQLite run queue.
+
+    python -m app.worker --processes 4
+
+Each process claims jobs from the run_jobs table under a renewable lease, so the
+API process only enqueues runs and serves their results while agent execution
+(prompt building, JSON filtering, validation) is spread across CPU cores.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from app import database, models
+from app.agent_manager import AgentManager
+from app.checkpoint_manager import worker_identity
+from app.logging_config import configure_logging
+from app.run_queue import SQLiteRunQueue
+
+POLL_INTERVAL_SECONDS = float(os.getenv("RUN_WORKER_POLL_SECONDS", "0.5"))
+# How often idle workers look for orphaned checkpoints of runs started outside the queue
+RECOVERY_INTERVAL_SECONDS = int(os.getenv("RUN_RECOVERY_INTERVAL_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(poll_interval: float = POLL_INTERVAL_SECONDS, lease_seconds: int = None):
+    """Claim and execute jobs until the process is terminated"""
+    configure_logging()
+    owner = worker_identity()
+    run_queue = SQLiteRunQueue(lease_seconds=lease_seconds)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    logger.info("Run worker %s started", owner)
+    last_recovery = 0.0
+    while not stopping:
+        db = database.SessionLocal()
+        try:
+            job = run_queue.claim_next(db, owner)
+            if job is None:
+                if RECOVERY_INTERVAL_SECONDS > 0 and time.monotonic() - last_recovery > RECOVERY_INTERVAL_SECONDS:
+                    AgentManager.recover_in_flight_runs(db)
+                    last_recovery = time.monotonic()
+                db.close()
+                time.sleep(poll_interval)
+                continue
+            job_id, run_id = job.id, job.run_id
+        except Exception as e:
+            logger.error("Run worker %s could not claim a job: %s", owner, e)
+            db.close()
+            time.sleep(poll_interval)
+            continue
+        db.close()
+
+        logger.info("Worker %s executing run", owner, extra={"run_id": run_id})
+        status = run_queue.execute_job(job_id, owner)
+        logger.info("Worker %s finished run: %s", owner, status, extra={"run_id": run_id})
+
+    logger.info("Run worker %s stopped", owner)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute queued agent runs")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("RUN_WORKER_PROCESSES", "2")),
+                        help="number of worker processes to start")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SECONDS,
+                        help="seconds to sleep when the queue is empty")
+    parser.add_argument("--lease-seconds", type=int, default=None,
+                        help="lease duration before an unresponsive worker's job is reclaimed")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(args.poll_interval, args.lease_seconds), name=f"run-worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
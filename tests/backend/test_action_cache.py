@@ -0,0 +1,50 @@
+"""
+Testes para o cache de resultados de ações customizadas
+"""
+from unittest.mock import patch
+from app.action_cache import ByteLRUCache
+
+
+class TestByteLRUCache:
+    """Testes para o cache LRU limitado por bytes"""
+
+    def test_evicts_least_recently_used_when_full(self):
+        """Teste: Deve remover as entradas menos usadas quando o limite de bytes é atingido"""
+        # Arrange
+        cache = ByteLRUCache(max_bytes=100)
+        cache.set("a", {"v": 1}, 40, ttl_seconds=60)
+        cache.set("b", {"v": 2}, 40, ttl_seconds=60)
+        cache.get("a")  # "a" becomes most recently used
+
+        # Act
+        cache.set("c", {"v": 3}, 40, ttl_seconds=60)
+        stored_too_big = cache.set("d", {"v": 4}, 101, ttl_seconds=60)
+
+        # Assert
+        assert cache.get("b") is None
+        assert cache.get("a")[0] == {"v": 1}
+        assert cache.get("c")[0] == {"v": 3}
+        assert stored_too_big is False
+        assert cache.stats()["bytes"] == 80
+        assert cache.stats()["evictions"] == 1
+
+    def test_entries_expire_after_ttl(self):
+        """Teste: Deve descartar entradas expiradas e devolver cópias independentes"""
+        # Arrange
+        cache = ByteLRUCache(max_bytes=100)
+        with patch('app.action_cache.time.monotonic', return_value=1000.0):
+            cache.set("a", {"v": [1]}, 10, ttl_seconds=5)
+
+        # Act
+        with patch('app.action_cache.time.monotonic', return_value=1004.0):
+            value, age = cache.get("a")
+            value["v"].append(2)
+            still_cached = cache.get("a")[0]
+        with patch('app.action_cache.time.monotonic', return_value=1006.0):
+            expired = cache.get("a")
+
+        # Assert
+        assert age == 4.0
+        assert still_cached == {"v": [1]}
+        assert expired is None
+        assert cache.stats()["bytes"] == 0
@@ -4,10 +4,23 @@ Testes para ActionManager seguindo TDD
 import pytest
 from unittest.mock import Mock, patch
 import json
+import threading
+import requests
 from app.action_manager import ActionManager
+from app.action_cache import cache_bypass, action_call_flight
 from app import models, schemas
 
 
+def _json_response(status_code, payload):
+    """Resposta HTTP real com corpo JSON, lida em streaming como as do pool"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(payload).encode("utf-8")
+    response._content_consumed = True
+    return response
+
+
 class TestActionManager:
     """Testes para o gerenciador de Actions"""
     
@@ -144,14 +157,11 @@ class TestActionManager:
         assert result["content"] == "Please provide more info"
         assert result["prompt"] == "What else do you need?"
     
-    @patch('app.action_manager.requests.get')
+    @patch('app.action_manager.http_pool.request')
     def test_execute_custom_action_success(self, mock_get, db_session):
         """Teste: Deve executar ação customizada com sucesso"""
         # Arrange
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {"data": "test response"}
-        mock_response.raise_for_status.return_value = None
+        mock_response = _json_response(200, {"data": "test response"})
         mock_get.return_value = mock_response
         
         action = models.Action(
@@ -178,7 +188,361 @@ class TestActionManager:
         assert result["status_code"] == 200
         assert "data" in result["result"]
     
-    @patch('app.action_manager.requests.get')
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_reuses_cached_get(self, mock_get, db_session):
+        """Teste: Deve reutilizar o resultado de GET em cache e refazer a chamada com bypass"""
+        # Arrange
+        mock_response = _json_response(200, {"data": "incident"})
+        mock_get.return_value = mock_response
+
+        action = models.Action(
+            name="Cached Incident",
+            description="Cached lookup",
+            endpoint="https://api.example.com/incidents/{id}",
+            method="GET",
+            action_type="custom",
+            config={"cache_ttl_seconds": 60},
+            parameters={"id": {"type": "string", "required": True}}
+        )
+        db_session.add(action)
+        db_session.commit()
+
+        # Act
+        first = ActionManager.execute_action(db_session, "Cached Incident", {"id": "42"}, {})
+        second = ActionManager.execute_action(db_session, "Cached Incident", {"id": "42"}, {})
+        other = ActionManager.execute_action(db_session, "Cached Incident", {"id": "43"}, {})
+        with cache_bypass():
+            bypassed = ActionManager.execute_action(db_session, "Cached Incident", {"id": "42"}, {})
+
+        # Assert
+        assert first["cache"]["hit"] is False and first["cache"]["stored"] is True
+        assert second["cache"]["hit"] is True
+        assert second["result"] == first["result"]
+        assert other["cache"]["hit"] is False
+        assert bypassed["cache"]["hit"] is False and bypassed["cache"]["bypassed"] is True
+        assert mock_get.call_count == 3
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_honours_http_caching_headers(self, mock_get, db_session):
+        """Teste: Deve servir respostas frescas do cache HTTP e revalidar as expiradas com ETag"""
+        # Arrange
+        fresh = _json_response(200, {"status": "open"})
+        fresh.headers.update({"Cache-Control": "max-age=60", "ETag": '"v1"'})
+        stale = _json_response(200, {"status": "open"})
+        stale.headers.update({"Cache-Control": "no-cache", "ETag": '"v1"'})
+        not_modified = requests.Response()
+        not_modified.status_code = 304
+        not_modified._content, not_modified._content_consumed = b"", True
+        mock_get.side_effect = [fresh, stale, not_modified]
+        for name in ("Fresh Incident", "Polled Incident"):
+            db_session.add(models.Action(name=name, description=name, method="GET", action_type="custom",
+                                         endpoint=f"https://api.example.com/{name.split()[0].lower()}/{{id}}"))
+        db_session.commit()
+
+        # Act
+        first = ActionManager.execute_action(db_session, "Fresh Incident", {"id": "7"}, {})
+        from_cache = ActionManager.execute_action(db_session, "Fresh Incident", {"id": "7"}, {})
+        polled = ActionManager.execute_action(db_session, "Polled Incident", {"id": "7"}, {})
+        revalidated = ActionManager.execute_action(db_session, "Polled Incident", {"id": "7"}, {})
+
+        # Assert
+        assert first["cache"]["http_stored"] is True
+        assert from_cache["cache"] == {"hit": True, "source": "http", "revalidated": False,
+                                       "age_seconds": from_cache["cache"]["age_seconds"]}
+        assert from_cache["result"] == first["result"]
+        assert polled["cache"]["http_stored"] is True
+        assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+        assert revalidated["cache"]["revalidated"] is True
+        assert revalidated["result"] == polled["result"]
+        assert mock_get.call_count == 3
+
+    @patch('app.action_manager.http_pool.request')
+    def test_concurrent_identical_gets_share_one_request(self, mock_get, test_db):
+        """Teste: Deve unir GETs idênticos simultâneos em uma única chamada, cada um com sua cópia"""
+        # Arrange
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_response(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return _json_response(200, {"id": "9", "status": "open"})
+
+        mock_get.side_effect = slow_response
+        setup = test_db()
+        setup.add(models.Action(name="Shared Incident", description="Shared", method="GET", action_type="custom",
+                                endpoint="https://api.example.com/shared/{id}"))
+        setup.commit()
+        setup.close()
+        results = {}
+        coalesced_before = action_call_flight.stats()["coalesced"]
+
+        def run(name):
+            db = test_db()
+            try:
+                results[name] = ActionManager.execute_action(db, "Shared Incident", {"id": "9"}, {"user": name})
+            finally:
+                db.close()
+
+        # Act
+        leader = threading.Thread(target=run, args=("leader",))
+        leader.start()
+        assert started.wait(5)
+        waiters = [threading.Thread(target=run, args=(f"waiter-{i}",)) for i in range(3)]
+        for thread in waiters:
+            thread.start()
+        for _ in range(500):
+            if action_call_flight.stats()["coalesced"] >= coalesced_before + 3:
+                break
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join(5)
+
+        # Assert
+        assert mock_get.call_count == 1
+        assert results["leader"]["result"] == results["waiter-0"]["result"]
+        assert results["waiter-0"]["coalesced"] is True and "coalesced" not in results["leader"]
+        assert results["waiter-1"]["context"] == {"user": "waiter-1"}
+        assert results["waiter-1"]["result"] is not results["waiter-2"]["result"]
+
+    @patch('app.action_manager.http_pool.request')
+    def test_coalesced_get_never_shares_deadline_or_bypass_results(self, mock_get, db_session):
+        """Teste: Não deve repassar a quem espera um resultado de prazo esgotado do líder, nem unir chamadas com bypass"""
+        # Arrange
+        mock_get.side_effect = lambda *args, **kwargs: _json_response(200, {"id": "5"})
+        db_session.add(models.Action(name="Deadline Incident", description="d", method="GET", action_type="custom",
+                                     endpoint="https://api.example.com/deadline/{id}"))
+        db_session.commit()
+        leader_result = {"type": "custom_action", "success": False, "deadline_exceeded": True,
+                         "error": "Run deadline exceeded while waiting for the API"}
+
+        # Act
+        with patch.object(action_call_flight, 'do', return_value=(leader_result, True)):
+            waiter = ActionManager.execute_action(db_session, "Deadline Incident", {"id": "5"}, {"user": "w"})
+        with patch.object(action_call_flight, 'do') as flight, cache_bypass():
+            bypassed = ActionManager.execute_action(db_session, "Deadline Incident", {"id": "5"}, {})
+
+        # Assert
+        assert waiter["success"] is True
+        assert waiter["context"] == {"user": "w"}
+        assert "coalesced" not in waiter
+        assert flight.call_count == 0
+        assert bypassed["success"] is True
+        assert mock_get.call_count == 2
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_posts_only_projected_context(self, mock_request, db_session):
+        """Teste: Deve enviar no corpo apenas os caminhos do contexto declarados na ação"""
+        # Arrange
+        mock_response = _json_response(201, {"ok": True})
+        mock_request.return_value = mock_response
+
+        for name, config in (("Add Note", {"context_projection": {
+                "incident_title": "GetIncident_data.attributes.title",
+                "analysis": "thinking_process.-1.content",
+                "missing": "Unknown_data.id"}}),
+                             ("Add Plain Note", None)):
+            db_session.add(models.Action(name=name, description=name, endpoint="https://api.example.com/notes",
+                                         method="POST", action_type="custom", config=config))
+        db_session.commit()
+        context = {
+            "user_input": "add a note",
+            "GetIncident_data": {"attributes": {"title": "DB down", "raw": "x" * 1000}},
+            "thinking_process": [{"content": "first"}, {"content": "latest"}]
+        }
+
+        # Act
+        ActionManager.execute_action(db_session, "Add Note", {"text": "hi"}, context)
+        projected_body = mock_request.call_args.kwargs["json"]
+        ActionManager.execute_action(db_session, "Add Plain Note", {"text": "hi"}, context)
+        plain_body = mock_request.call_args.kwargs["json"]
+
+        # Assert
+        assert projected_body == {"text": "hi", "incident_title": "DB down", "analysis": "latest"}
+        assert plain_body == {"text": "hi"}
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_uses_spec_compiled_on_save(self, mock_request, db_session):
+        """Teste: Deve executar a ação com a spec compilada ao salvar, sem reprocessar o YAML"""
+        # Arrange
+        mock_response = _json_response(200, {"id": "42", "title": "DB down", "internal": "x"})
+        mock_request.return_value = mock_response
+        yaml_spec = """
+openapi: 3.0.0
+paths:
+  /incidents/{id}:
+    get:
+      responses:
+        '200':
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  id: {type: string}
+                  title: {type: string}
+"""
+        action = ActionManager.create_action(db_session, schemas.ActionCreate(
+            name="Compiled Incident", description="Get incident", endpoint="https://api.example.com/incidents/{id}",
+            method="GET", action_type="custom", yaml_spec=yaml_spec, api_key="secret-key"))
+
+        # Act
+        with patch('app.action_manager.yaml.load', side_effect=AssertionError("YAML parsed at execution")):
+            result = ActionManager.execute_action(db_session, "Compiled Incident", {"id": "42"}, {})
+
+        # Assert
+        stored = db_session.query(models.CompiledActionSpec).filter_by(spec_hash=action.spec_hash).one()
+        assert stored.compiled["path_params"] == ["id"]
+        assert "secret-key" not in json.dumps(stored.compiled)
+        assert result["success"] is True
+        assert result["result"]["filtered_data"] == {"id": "42", "title": "DB down"}
+        assert "raw_data" not in result["result"]
+        assert mock_request.call_args.args[1] == "https://api.example.com/incidents/42"
+        assert mock_request.call_args.kwargs["headers"]["Authorization"] == "Bearer secret-key"
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_caps_response_size(self, mock_request, db_session):
+        """Teste: Deve abortar ou truncar (projetando o que chegou) respostas acima do limite, sem repassar JSON cortado como texto"""
+        # Arrange
+        mock_request.side_effect = lambda *args, **kwargs: _json_response(200, {"items": ["x" * 40] * 10})
+        for name, config in (("Big Abort", {"max_response_bytes": 100}),
+                             ("Big Truncate", {"max_response_bytes": 100, "oversize": "truncate"}),
+                             ("Big Raw", {"keep_raw_data": True})):
+            db_session.add(models.Action(name=name, description=name, endpoint="https://api.example.com/items",
+                                         method="GET", action_type="custom", config=config,
+                                         yaml_spec="paths: {/items: {get: {responses: {'200': {content: "
+                                                   "{application/json: {schema: {type: object, properties: "
+                                                   "{items: {type: array}}}}}}}}}}"))
+        db_session.commit()
+
+        # Act
+        aborted = ActionManager.execute_action(db_session, "Big Abort", {}, {})
+        truncated = ActionManager.execute_action(db_session, "Big Truncate", {}, {})
+        with patch('app.response_stream.ijson', None):
+            truncated_without_ijson = ActionManager.execute_action(db_session, "Big Truncate", {}, {})
+        with_raw = ActionManager.execute_action(db_session, "Big Raw", {}, {})
+
+        # Assert
+        assert aborted["success"] is False
+        assert "maximum size" in aborted["error"]
+        assert truncated["success"] is True
+        assert truncated["result"]["truncated"] is True
+        assert truncated["result"]["bytes_read"] == 100
+        assert truncated["result"]["filtered_data"] == {"items": ["x" * 40] * 2}
+        assert "content" not in truncated["result"]
+        assert truncated_without_ijson["success"] is False
+        assert "cannot be read in part" in truncated_without_ijson["error"]
+        assert with_raw["result"]["filtered_data"] == {"items": ["x" * 40] * 10}
+        assert with_raw["result"]["raw_data"] == {"items": ["x" * 40] * 10}
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_fetches_every_page(self, mock_request, db_session):
+        """Teste: Deve buscar todas as páginas em paralelo, projetar os itens e parar no limite de itens"""
+        # Arrange
+        def page(method, url, params=None, **kwargs):
+            number = params["page[number]"]
+            return _json_response(200, {"data": [{"id": f"{number}-{i}", "raw": "x" * 50} for i in range(3)],
+                                        "meta": {"total_pages": 5, "current_page": number}})
+        mock_request.side_effect = page
+        yaml_spec = ("paths: {/incidents: {get: {responses: {'200': {content: {application/json: {schema: "
+                     "{type: object, properties: {data: {type: array, items: {type: object, properties: "
+                     "{id: {type: string}}}}}}}}}}}}}")
+        pagination = {"style": "page", "page_param": "page[number]", "page_size_param": "page[size]",
+                      "page_size": 3, "concurrency": 3}
+        db_session.add(models.Action(name="All Incidents", description="d", endpoint="https://api.example.com/incidents",
+                                     method="GET", action_type="custom", yaml_spec=yaml_spec,
+                                     config={"pagination": pagination}))
+        db_session.add(models.Action(name="Some Incidents", description="d", endpoint="https://api.example.com/incidents",
+                                     method="GET", action_type="custom", yaml_spec=yaml_spec,
+                                     config={"pagination": {**pagination, "max_items": 7}}))
+        db_session.commit()
+
+        # Act
+        everything = ActionManager.execute_action(db_session, "All Incidents", {"status": "open"}, {})
+        some = ActionManager.execute_action(db_session, "Some Incidents", {"status": "open"}, {})
+
+        # Assert
+        data = everything["result"]["filtered_data"]
+        assert [item["id"] for item in data["data"]] == [f"{n}-{i}" for n in range(1, 6) for i in range(3)]
+        assert data["data"][0] == {"id": "1-0"}
+        assert data["meta"] == {"total_pages": 5}
+        assert everything["result"]["pagination"] == {"style": "page", "pages": 5, "items": 15,
+                                                      "complete": True, "stop_reason": None}
+        assert all(call.kwargs["params"]["status"] == "open" and call.kwargs["params"]["page[size]"] == 3
+                   for call in mock_request.call_args_list)
+        assert len(some["result"]["filtered_data"]["data"]) == 7
+        assert some["result"]["pagination"]["stop_reason"] == "max_items"
+        assert some["result"]["pagination"]["complete"] is False
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_stops_listing_at_oversized_page(self, mock_request, db_session):
+        """Teste: Deve encerrar a paginação com stop_reason max_bytes quando uma página passa do limite de tamanho"""
+        # Arrange
+        def page(method, url, params=None, **kwargs):
+            number = params["page"]
+            size = 40 if number == 3 else 2
+            return _json_response(200, {"data": [{"id": f"{number}-{i}"} for i in range(size)],
+                                        "meta": {"total_pages": 4}})
+        mock_request.side_effect = page
+        db_session.add(models.Action(name="Big Listing", description="d", endpoint="https://api.example.com/big",
+                                     method="GET", action_type="custom",
+                                     config={"max_response_bytes": 300, "oversize": "truncate",
+                                             "pagination": {"style": "page", "concurrency": 1}}))
+        db_session.commit()
+
+        # Act
+        listing = ActionManager.execute_action(db_session, "Big Listing", {}, {})
+        with patch('app.response_stream.ijson', None):
+            without_ijson = ActionManager.execute_action(db_session, "Big Listing", {}, {})
+
+        # Assert
+        for result in (listing, without_ijson):
+            assert result["success"] is True
+            assert result["result"]["pagination"]["stop_reason"] == "max_bytes"
+            assert result["result"]["pagination"]["pages"] == 3
+            assert result["result"]["truncated"] is True
+        ids = [item["id"] for item in listing["result"]["data"]["data"]]
+        assert ids[:4] == ["1-0", "1-1", "2-0", "2-1"]
+        assert len(ids) > 4 and all(item.startswith("3-") for item in ids[4:])
+        assert [item["id"] for item in without_ijson["result"]["data"]["data"]] == ["1-0", "1-1", "2-0", "2-1"]
+
+    @patch('app.action_manager.http_pool.request')
+    def test_execute_custom_action_follows_cursor_and_links(self, mock_request, db_session):
+        """Teste: Deve seguir cursores e o cabeçalho Link até a última página, sem sair do host da API"""
+        # Arrange
+        def page(method, url, params=None, **kwargs):
+            if "cursor" in url:
+                cursor = (params or {}).get("cursor")
+                return _json_response(200, {"items": [cursor or "first"], "next": {"cursor": None if cursor else "c2"}})
+            response = _json_response(200, [url.rsplit("=", 1)[-1] if "=" in url else "1"])
+            if url.endswith("/linked"):
+                response.headers["Link"] = '</linked?p=2>; rel="next"'
+            elif url.endswith("p=2"):
+                response.headers["Link"] = '<https://evil.example.org/linked?p=3>; rel="next"'
+            return response
+        mock_request.side_effect = page
+        db_session.add(models.Action(name="Cursor List", description="d", endpoint="https://api.example.com/cursor",
+                                     method="GET", action_type="custom",
+                                     config={"pagination": {"style": "cursor", "items_path": "items",
+                                                            "next_cursor_path": "next.cursor"}}))
+        db_session.add(models.Action(name="Linked List", description="d", endpoint="https://api.example.com/linked",
+                                     method="GET", action_type="custom",
+                                     config={"pagination": {"style": "link", "items_path": ""}}))
+        db_session.commit()
+
+        # Act
+        cursor = ActionManager.execute_action(db_session, "Cursor List", {}, {})
+        linked = ActionManager.execute_action(db_session, "Linked List", {}, {})
+
+        # Assert
+        assert cursor["result"]["data"]["items"] == ["first", "c2"]
+        assert cursor["result"]["pagination"]["complete"] is True
+        assert linked["result"]["data"] == ["1", "2"]
+        assert linked["result"]["pagination"]["stop_reason"] == "foreign_link"
+        assert not any("evil" in call.args[1] for call in mock_request.call_args_list)
+
+    @patch('app.action_manager.http_pool.request')
     def test_execute_custom_action_http_error(self, mock_get, db_session):
         """Teste: Deve tratar erro HTTP em ação customizada"""
         # Arrange
@@ -269,7 +633,45 @@ class TestActionManager:
         assert result["id"]["required"] is True
         assert result["limit"]["type"] == "integer"
         assert result["limit"]["required"] is False
-    
+
+    def test_spec_helpers_resolve_component_refs(self):
+        """Teste: Deve resolver $ref de parâmetros, respostas e schemas, inclusive referências circulares"""
+        # Arrange
+        spec = {
+            "paths": {"/incidents/{id}": {"get": {
+                "parameters": [{"$ref": "#/components/parameters/IncidentId"}],
+                "responses": {"200": {"$ref": "#/components/responses/IncidentResponse"}}
+            }}},
+            "components": {
+                "parameters": {"IncidentId": {"name": "id", "in": "path", "required": True,
+                                              "schema": {"$ref": "#/components/schemas/Id"}}},
+                "responses": {"IncidentResponse": {"content": {"application/json": {
+                    "schema": {"$ref": "#/components/schemas/Incident"}}}}},
+                "schemas": {
+                    "Id": {"type": "integer"},
+                    "Incident": {"type": "object", "properties": {
+                        "id": {"$ref": "#/components/schemas/Id"},
+                        "parent": {"$ref": "#/components/schemas/Incident"},
+                        "tags": {"type": "array", "items": {"type": "string"}}}}
+                }
+            }
+        }
+
+        # Act
+        parameters = ActionManager._parameters_from_spec(spec)
+        schema = ActionManager._response_schema_from_spec(spec)
+        preview = ActionManager._generate_schema_preview(schema, spec)
+        filtered = ActionManager.filter_response_by_schema(
+            {"id": 1, "secret": "x", "parent": {"id": 2, "secret": "y"}}, schema, spec)
+
+        # Assert
+        assert parameters["id"] == {"type": "integer", "required": True, "description": ""}
+        assert schema["properties"]["parent"] == {"$ref": "#/components/schemas/Incident"}
+        assert preview["id"] == "<integer>"
+        assert preview["tags"] == ["<string>"]
+        assert preview["parent"]["parent"] == "<Incident>"
+        assert filtered == {"id": 1, "parent": {"id": 2}}
+
     def test_mask_sensitive_data(self):
         """Teste: Deve mascarar dados sensíveis"""
         # Arrange
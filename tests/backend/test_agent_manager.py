@@ -2,8 +2,15 @@
 Testes para AgentManager seguindo TDD
 """
 import pytest
+import threading
+import time
 from unittest.mock import Mock, patch
+from datetime import datetime, timedelta
 from app.agent_manager import AgentManager
+from app.checkpoint_manager import CheckpointManager, RunAlreadyExecuting
+from app.telemetry import speculation_stats
+from app.action_cache import cache_bypassed
+from app.deadline import DeadlineExceeded
 from app import models, schemas
 
 
@@ -357,3 +364,344 @@ class TestAgentManager:
         
         # Assert
         assert result is False
+
+
+class TestAgentCheckpoints:
+    """Testes para checkpoints de execução e retomada exata"""
+
+    @pytest.fixture
+    def branching_agent(self, db_session, created_llm):
+        agent = models.Agent(
+            name="Branching Agent",
+            description="Agent with a conditional flow",
+            system_prompt="Test",
+            llm_id=created_llm.id,
+            actions=[
+                {"action_name": "Thinking", "prompt": "Think", "flow_type": "main"},
+                {"action_name": "Choice", "prompt": "Is it valid?", "flow_type": "main"}
+            ],
+            conditional_flows=[
+                {
+                    "choice_action": "Choice",
+                    "valid_flow": [
+                        {"action_name": "GetIncident", "prompt": "Fetch", "flow_type": "valid_flow"},
+                        {"action_name": "Wait", "prompt": "Need more info", "flow_type": "valid_flow"},
+                        {"action_name": "Respond", "prompt": "", "flow_type": "valid_flow"}
+                    ],
+                    "invalid_flow": []
+                }
+            ],
+            config={}
+        )
+        db_session.add(agent)
+        db_session.commit()
+        db_session.refresh(agent)
+        return agent
+
+    @staticmethod
+    def fake_execute_action(executed):
+        results = {
+            "Thinking": {"type": "thinking", "content": "analysis", "background": True},
+            "Choice": {"type": "choice", "decision": "valid", "background": True, "conditional_flow": True},
+            "GetIncident": {"type": "custom_action", "success": True, "result": {"data": {"id": "1"}}, "background": False},
+            "Wait": {"type": "wait", "content": "Need more info", "prompt": "?", "pause_execution": True},
+            "Respond": {"type": "response", "content": "Incident 1 is open", "background": False, "user_message": True}
+        }
+
+        def execute(db, action_name, parameters, context=None):
+            executed.append(action_name)
+            return dict(results[action_name])
+        return execute
+
+    def test_run_agent_checkpoints_cursor_inside_branch(self, db_session, branching_agent):
+        """Teste: Deve salvar o cursor com a pilha de fluxos ao pausar no Wait"""
+        executed = []
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=self.fake_execute_action(executed)), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            result = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+
+        assert result["wait_required"] is True
+        assert result["session_context"]["run_id"] == result["run_id"]
+
+        checkpoint = CheckpointManager.get_checkpoint(db_session, result["run_id"])
+        assert checkpoint.status == "waiting"
+        main_frame, branch_frame = checkpoint.cursor
+        assert main_frame == {"flow_type": "main", "choice_action": None, "index": 2}
+        assert {key: branch_frame[key] for key in ("flow_type", "choice_action", "index")} == {
+            "flow_type": "valid_flow", "choice_action": "Choice", "index": 2
+        }
+        assert branch_frame["choice_entry"]["choice_decision"] == "valid"
+        assert [action["action"] for action in checkpoint.results["background_actions"]] == ["Thinking", "GetIncident"]
+        assert checkpoint.step_count == 4
+        assert "GetIncident_data" in checkpoint.context
+
+    def test_continue_agent_resumes_exactly_after_wait(self, db_session, branching_agent):
+        """Teste: Deve retomar do cursor salvo sem repetir passos concluídos"""
+        executed = []
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=self.fake_execute_action(executed)), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            waiting = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+            result = AgentManager.continue_agent(db_session, branching_agent.id, {
+                "session_context": waiting["session_context"],
+                "additional_input": "it is urgent"
+            })
+
+        assert executed == ["Thinking", "Choice", "GetIncident", "Wait", "Respond"]
+        assert result["response"] == "Incident 1 is open"
+        assert result["actions_used"] == executed
+        checkpoint = CheckpointManager.get_checkpoint(db_session, waiting["run_id"])
+        assert checkpoint.status == "completed"
+        # The Choice is recorded after the actions of its branch
+        background = checkpoint.results["background_actions"]
+        assert [(action["action"], action["iteration"]) for action in background] == [
+            ("Thinking", 1), ("GetIncident", 2), ("Choice", 3)
+        ]
+        assert checkpoint.input == "incident 1 it is urgent"
+
+    def test_recover_in_flight_runs_skips_completed_steps(self, db_session, branching_agent):
+        """Teste: Deve retomar execuções órfãs a partir do último checkpoint"""
+        checkpoint = CheckpointManager.create_checkpoint(
+            db_session, branching_agent.id, "incident 1",
+            {"user_input": "incident 1", "agent_name": branching_agent.name}, owner="crashed-worker"
+        )
+        CheckpointManager.save_checkpoint(
+            db_session, checkpoint.run_id,
+            [{"flow_type": "main", "choice_action": None, "index": 1}],
+            {"user_input": "incident 1", "agent_name": branching_agent.name},
+            {"actions_used": ["Thinking"], "background_actions": [], "user_facing_actions": []}
+        )
+        checkpoint.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db_session.commit()
+
+        executed = []
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=self.fake_execute_action(executed)), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            recovered = AgentManager.recover_in_flight_runs(db_session)
+
+        assert recovered == [checkpoint.run_id]
+        assert executed == ["Choice", "GetIncident", "Wait"]
+        db_session.refresh(checkpoint)
+        assert checkpoint.status == "waiting"
+        assert checkpoint.results["actions_used"] == ["Thinking", "Choice", "GetIncident", "Wait"]
+
+    def test_speculative_prefetch_uses_chosen_branch_and_counts_waste(self, db_session, branching_agent):
+        """Teste: Deve antecipar o GET de cada ramo durante o Choice, usar o vencedor e contar o desperdício"""
+        # Arrange
+        for name in ("GetIncident", "ListIncidents"):
+            db_session.add(models.Action(name=name, description=name, endpoint="https://api.example.com/x",
+                                         method="GET", action_type="custom"))
+        branching_agent.config = {"speculative_prefetch": True}
+        branching_agent.conditional_flows = [{
+            **branching_agent.conditional_flows[0],
+            "invalid_flow": [{"action_name": "ListIncidents", "prompt": "List", "flow_type": "invalid_flow"}]
+        }]
+        db_session.commit()
+
+        executed = []
+        execute = self.fake_execute_action(executed)
+
+        def execute_with_list(db, action_name, parameters, context=None):
+            if action_name == "ListIncidents":
+                executed.append(action_name)
+                return {"type": "custom_action", "success": True, "result": {"data": []}, "background": False}
+            if action_name == "Choice":
+                time.sleep(0.1)  # the LLM decision; both prefetches start meanwhile
+            return execute(db, action_name, parameters, context)
+
+        before = speculation_stats.snapshot()
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=execute_with_list), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            result = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+
+        # Assert
+        after = speculation_stats.snapshot()
+        assert result["wait_required"] is True
+        assert result["actions_used"] == ["Thinking", "Choice", "GetIncident", "Wait"]
+        assert executed.count("GetIncident") == 1
+        assert after["used"] - before["used"] == 1
+        assert after["started"] - before["started"] == 2
+        assert after["wasted"] - before["wasted"] == 1
+        assert after["wasted_by_action"].get("ListIncidents", 0) >= 1
+
+    def test_run_deadline_returns_partial_results_and_resumes(self, db_session, branching_agent):
+        """Teste: Deve parar ao esgotar o prazo, devolver resultados parciais e retomar do passo seguinte"""
+        # Arrange
+        executed = []
+        execute = self.fake_execute_action(executed)
+
+        def slow_execute(db, action_name, parameters, context=None):
+            if action_name == "Thinking":
+                time.sleep(0.2)
+            return execute(db, action_name, parameters, context)
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=slow_execute), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            partial = AgentManager.run_agent(db_session, branching_agent.id,
+                                             schemas.AgentRun(input="incident 1", deadline_seconds=0.1))
+            resumed = AgentManager.continue_agent(db_session, branching_agent.id, {"run_id": partial["run_id"]})
+
+        # Assert
+        assert partial["status"] == "deadline_exceeded"
+        assert partial["actions_used"] == ["Thinking"]
+        assert resumed["wait_required"] is True
+        assert executed == ["Thinking", "Choice", "GetIncident", "Wait"]
+
+    def test_resume_run_refuses_run_claimed_by_another_execution(self, db_session, branching_agent):
+        """Teste: Deve permitir que apenas uma execução retome uma run pausada"""
+        # Arrange
+        executed = []
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=self.fake_execute_action(executed)), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            waiting = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+
+        # Act
+        first_claim = CheckpointManager.claim_run(db_session, waiting["run_id"], "execution-a")
+        second_claim = CheckpointManager.claim_run(db_session, waiting["run_id"], "execution-b")
+
+        # Assert
+        assert first_claim is True
+        assert second_claim is False
+        with pytest.raises(RunAlreadyExecuting):
+            AgentManager.resume_run(db_session, waiting["run_id"], additional_input="again")
+        assert executed == ["Thinking", "Choice", "GetIncident", "Wait"]
+
+    def test_keep_alive_renews_heartbeat_while_step_runs(self, db_session, branching_agent):
+        """Teste: Deve renovar o heartbeat durante um passo longo para a run não parecer órfã"""
+        # Arrange
+        checkpoint = CheckpointManager.create_checkpoint(
+            db_session, branching_agent.id, "incident 1", {}, owner="execution-a"
+        )
+        checkpoint.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db_session.commit()
+
+        # Act
+        with CheckpointManager.keep_alive(db_session.get_bind(), checkpoint.run_id, "execution-a",
+                                          interval_seconds=0.05):
+            time.sleep(0.3)
+        stale = CheckpointManager.claim_stale_runs(db_session, "recovery", stale_after_seconds=60)
+
+        # Assert
+        assert stale == []
+        db_session.refresh(checkpoint)
+        assert checkpoint.owner == "execution-a"
+
+    def test_bypass_cache_is_kept_out_of_the_forwarded_context(self, db_session, branching_agent):
+        """Teste: Deve aplicar o bypass de cache sem incluí-lo no contexto enviado às APIs"""
+        # Arrange
+        executed, seen = [], []
+        execute = self.fake_execute_action(executed)
+
+        def execute_and_observe(db, action_name, parameters, context=None):
+            seen.append((cache_bypassed(), "cache_bypass" in (context or {})))
+            return execute(db, action_name, parameters, context)
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=execute_and_observe), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            waiting = AgentManager.run_agent(db_session, branching_agent.id,
+                                             schemas.AgentRun(input="incident 1", bypass_cache=True))
+            AgentManager.continue_agent(db_session, branching_agent.id, {"run_id": waiting["run_id"]})
+
+        # Assert
+        assert executed == ["Thinking", "Choice", "GetIncident", "Wait", "Respond"]
+        assert seen == [(True, False)] * len(executed)
+        assert cache_bypassed() is False
+
+    def test_speculative_prefetches_are_settled_when_choice_fails(self, db_session, branching_agent):
+        """Teste: Deve contabilizar as antecipações pendentes quando a run termina no próprio Choice"""
+        # Arrange
+        for name in ("GetIncident", "ListIncidents"):
+            db_session.add(models.Action(name=name, description=name, endpoint="https://api.example.com/x",
+                                         method="GET", action_type="custom"))
+        branching_agent.config = {"speculative_prefetch": True}
+        branching_agent.conditional_flows = [{
+            **branching_agent.conditional_flows[0],
+            "invalid_flow": [{"action_name": "ListIncidents", "prompt": "List", "flow_type": "invalid_flow"}]
+        }]
+        db_session.commit()
+
+        prefetching = threading.Semaphore(0)
+        execute = self.fake_execute_action([])
+
+        def execute_failing_choice(db, action_name, parameters, context=None):
+            if action_name in ("GetIncident", "ListIncidents"):
+                prefetching.release()
+                return {"type": "custom_action", "success": True, "result": {"data": []}, "background": False}
+            if action_name == "Choice":
+                assert prefetching.acquire(timeout=5) and prefetching.acquire(timeout=5)
+                raise RuntimeError("LLM unavailable")
+            return execute(db, action_name, parameters, context)
+
+        before = speculation_stats.snapshot()
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=execute_failing_choice), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            result = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+
+        # Assert
+        after = speculation_stats.snapshot()
+        assert "LLM unavailable" in result["error"]
+        assert after["started"] - before["started"] == 2
+        assert after["wasted"] - before["wasted"] == 2
+        assert after["used"] == before["used"]
+
+    def test_step_cut_short_by_deadline_is_not_marked_done(self, db_session, branching_agent):
+        """Teste: Deve manter o cursor no passo interrompido pelo prazo para que a retomada o repita"""
+        # Arrange
+        executed = []
+        execute = self.fake_execute_action(executed)
+        calls = {"Choice": 0}
+
+        def choice_times_out_once(db, action_name, parameters, context=None):
+            if action_name == "Choice" and calls["Choice"] == 0:
+                calls["Choice"] += 1
+                raise DeadlineExceeded("Run deadline exceeded")
+            return execute(db, action_name, parameters, context)
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=choice_times_out_once), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            partial = AgentManager.run_agent(db_session, branching_agent.id,
+                                             schemas.AgentRun(input="incident 1", deadline_seconds=30))
+            checkpoint = CheckpointManager.get_checkpoint(db_session, partial["run_id"])
+            cursor = checkpoint.cursor
+            resumed = AgentManager.continue_agent(db_session, branching_agent.id, {"run_id": partial["run_id"]})
+
+        # Assert
+        assert partial["status"] == "deadline_exceeded"
+        assert partial["actions_used"] == ["Thinking"]
+        assert cursor == [{"flow_type": "main", "choice_action": None, "index": 1}]
+        assert resumed["wait_required"] is True
+        assert executed == ["Thinking", "Choice", "GetIncident", "Wait"]
+
+    def test_continue_records_turns_instead_of_growing_the_input(self, db_session, branching_agent):
+        """Teste: Deve registrar os turnos na memória e passar às ações apenas a nova entrada"""
+        # Arrange
+        executed, inputs = [], []
+        execute = self.fake_execute_action(executed)
+
+        def execute_and_capture(db, action_name, parameters, context=None):
+            inputs.append(parameters["input"])
+            return execute(db, action_name, parameters, context)
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=execute_and_capture), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            waiting = AgentManager.run_agent(db_session, branching_agent.id, schemas.AgentRun(input="incident 1"))
+            AgentManager.continue_agent(db_session, branching_agent.id, {
+                "run_id": waiting["run_id"], "additional_input": "it is urgent"
+            })
+
+        # Assert
+        checkpoint = CheckpointManager.get_checkpoint(db_session, waiting["run_id"])
+        turns = checkpoint.context["conversation_memory"]["turns"]
+        assert [(turn["role"], turn["content"]) for turn in turns] == [
+            ("user", "incident 1"), ("assistant", "Need more info"),
+            ("user", "it is urgent"), ("assistant", "Incident 1 is open")
+        ]
+        assert inputs[-1] == "it is urgent"
+        assert "additional_inputs" not in checkpoint.context
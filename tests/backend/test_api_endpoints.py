@@ -3,6 +3,12 @@ Testes para endpoints da API seguindo TDD
 """
 import pytest
 import json
+import threading
+import time
+import requests
+from unittest.mock import patch
+from app.checkpoint_manager import RunAlreadyExecuting
+from app.action_manager import ActionManager
 from app import models
 
 
@@ -146,6 +152,42 @@ paths:
         assert "headers" in data
         assert "endpoint" in data
         assert "response_schema" in data
+
+    def test_parse_yaml_endpoint_parses_each_spec_once(self, client):
+        """Teste: POST /actions/parse-yaml/ deve analisar o YAML uma vez e reutilizar a análise"""
+        # Arrange
+        yaml_spec = """
+openapi: 3.0.0
+servers:
+  - url: https://api.example.com/v2
+paths:
+  /alerts/{id}:
+    get:
+      parameters:
+        - {name: id, in: path, required: true, schema: {type: string}}
+      responses:
+        '200':
+          content:
+            application/json:
+              schema: {type: object, properties: {id: {type: string}}}
+components:
+  securitySchemes:
+    bearer: {type: apiKey, in: header, name: Authorization}
+"""
+
+        # Act
+        with patch('app.spec_analysis.ActionManager.parse_yaml_spec',
+                   wraps=ActionManager.parse_yaml_spec) as parse:
+            first = client.post("/actions/parse-yaml/", json={"yaml_spec": yaml_spec, "api_key": "key-1"}).json()
+            second = client.post("/actions/parse-yaml/", json={"yaml_spec": yaml_spec}).json()
+
+        # Assert
+        assert parse.call_count == 1
+        assert first["endpoint"] == "https://api.example.com/v2/alerts/{id}"
+        assert first["parameters"]["id"]["required"] is True
+        assert first["schema_preview"] == {"id": "<string>"}
+        assert first["headers"] == {"Authorization": "Bearer key-1"}
+        assert second["headers"] == {"Authorization": "{{ bearer }}"}
     
     def test_test_action_endpoint(self, client, created_action):
         """Teste: POST /actions/{id}/test deve testar ação"""
@@ -159,6 +201,48 @@ paths:
         with pytest.raises(Exception):  # Expect error as it's custom action without mock
             response = client.post(f"/actions/{created_action.id}/test", json=test_data)
 
+    def test_test_batch_endpoint_runs_parameter_sets_concurrently(self, client, created_action):
+        """Teste: POST /actions/{id}/test-batch deve executar cada conjunto de parâmetros com concorrência limitada"""
+        # Arrange
+        lock, active, peak = threading.Lock(), [0], [0]
+
+        def fake_request(method, url, params=None, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            response = requests.Response()
+            response.status_code = 404 if params["param1"] == "missing" else 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps({"id": params["param1"]}).encode("utf-8")
+            response._content_consumed = True
+            return response
+
+        parameter_sets = [{"param1": f"id-{i}"} for i in range(9)] + [{"param1": "missing"}]
+
+        # Act
+        with patch('app.action_manager.http_pool.request', side_effect=fake_request):
+            response = client.post(f"/actions/{created_action.id}/test-batch?concurrency=3&include_results=true",
+                                   json={"parameters": parameter_sets})
+        invalid = client.post(f"/actions/{created_action.id}/test-batch", json={"parameters": {"param1": "x"}})
+        not_found = client.post("/actions/999/test-batch", json={"parameters": [{}]})
+
+        # Assert
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["index"] for item in data["items"]] == list(range(10))
+        assert data["items"][0]["status"] == "success"
+        assert data["items"][0]["result"]["result"]["data"] == {"id": "id-0"}
+        assert data["items"][9]["status"] == "failed"
+        assert all(item["latency_ms"] >= 20 and item["result_bytes"] > 0 for item in data["items"])
+        assert data["summary"]["by_status"] == {"success": 9, "failed": 1}
+        assert set(data["summary"]["latency"]) == {"min_ms", "mean_ms", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "max_ms"}
+        assert 1 < peak[0] <= 3
+        assert invalid.status_code == 400
+        assert not_found.status_code == 404
+
 
 class TestAgentEndpoints:
     """Testes para endpoints de Agent"""
@@ -211,6 +295,45 @@ class TestAgentEndpoints:
         # Assert
         assert response.status_code == 404
     
+    def test_run_batch_endpoint_streams_ndjson(self, client, created_agent):
+        """Teste: POST /agents/{id}/run-batch deve devolver uma linha NDJSON por entrada e um resumo"""
+        # Arrange
+        def fake_execute(db, action_name, parameters, context=None):
+            if action_name == "Respond":
+                return {"type": "response", "content": f"answer to {parameters['input']}", "background": False}
+            return {"type": "thinking", "content": "analysis", "background": True}
+
+        # Act
+        with patch('app.agent_manager.ActionManager.execute_action', side_effect=fake_execute), \
+             patch('app.agent_manager.AgentManager.extract_parameters_from_context', return_value={}):
+            response = client.post(f"/agents/{created_agent.id}/run-batch?concurrency=2",
+                                   json={"inputs": ["a", {"input": "b"}, 5]})
+            streamed = client.post(f"/agents/{created_agent.id}/run-batch",
+                                   content=b'"c"\n{"input": "d"}\nnot json\n',
+                                   headers={"Content-Type": "application/x-ndjson"})
+
+        # Assert
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        items = {line["index"]: line for line in lines[:-1]}
+        assert sorted(items) == [0, 1, 2]
+        assert items[0]["result"]["response"] == "answer to a"
+        assert items[1]["status"] == "completed"
+        assert items[2]["status"] == "invalid"
+        assert lines[-1]["summary"]["by_status"] == {"completed": 2, "invalid": 1}
+
+        streamed_lines = [json.loads(line) for line in streamed.text.splitlines()]
+        assert streamed_lines[-1]["summary"]["by_status"] == {"completed": 2, "invalid": 1}
+
+    def test_run_batch_endpoint_not_found(self, client):
+        """Teste: POST /agents/{id}/run-batch deve retornar 404 para agent inexistente"""
+        # Act
+        response = client.post("/agents/999/run-batch", json={"inputs": ["a"]})
+
+        # Assert
+        assert response.status_code == 404
+
     def test_continue_agent_endpoint_not_found(self, client):
         """Teste: POST /agents/{id}/continue deve retornar 404 para agent inexistente"""
         # Arrange
@@ -225,6 +348,17 @@ class TestAgentEndpoints:
         # Assert
         assert response.status_code == 404
 
+    def test_continue_agent_endpoint_conflict(self, client):
+        """Teste: POST /agents/{id}/continue deve retornar 409 se a run já está em execução"""
+        # Arrange
+        with patch('app.main.AgentManager.continue_agent',
+                   side_effect=RunAlreadyExecuting("Run abc is already being executed by worker")):
+            # Act
+            response = client.post("/agents/1/continue", json={"run_id": "abc"})
+
+        # Assert
+        assert response.status_code == 409
+
 
 class TestRootEndpoint:
     """Testes para endpoint raiz"""
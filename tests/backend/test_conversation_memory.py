@@ -0,0 +1,85 @@
+"""
+Testes para a memória de conversa com orçamento de tokens
+"""
+import threading
+from unittest.mock import patch
+from app import conversation_memory
+from app.conversation_memory import add_turn, compact, memory_view, estimate_tokens
+
+
+class TestConversationMemory:
+    """Testes para compactação e resumo incremental da conversa"""
+
+    def test_compact_keeps_recent_turns_and_summarizes_older_ones(self):
+        """Teste: Deve manter os últimos turnos literais e dobrar os antigos no resumo em background"""
+        # Arrange
+        context = {}
+        for i in range(5):
+            add_turn(context, "user", f"question {i}")
+            add_turn(context, "assistant", f"answer {i}")
+        summarized = threading.Event()
+
+        def summarizer(summary, turns):
+            summarized.set()
+            return f"{len(turns)} turns about questions 0-{len(turns) // 2 - 1}"
+
+        # Act
+        compact(context, "run-memory-1", summarizer=summarizer, recent_turns=4)
+        queued = list(context["conversation_memory"]["pending"])
+        assert summarized.wait(5)
+        conversation_memory._pending_summaries["run-memory-1"]["future"].result(5)
+        compact(context, "run-memory-1", summarizer=summarizer, recent_turns=4)
+
+        # Assert
+        memory = context["conversation_memory"]
+        assert [turn["content"] for turn in queued] == [f"{kind} {i}" for i in range(3) for kind in ("question", "answer")]
+        assert [turn["content"] for turn in memory["turns"]] == ["question 3", "answer 3", "question 4", "answer 4"]
+        assert memory["pending"] == []
+        assert memory["summary"] == "6 turns about questions 0-2"
+        assert memory["summarized_turns"] == 6
+        assert memory_view(context).startswith("Summary of earlier conversation: 6 turns")
+
+    def test_view_stays_within_budget_in_long_sessions(self):
+        """Teste: Deve manter a visão compactada limitada mesmo sem resumo disponível"""
+        # Arrange
+        context = {}
+        add_turn(context, "user", "only turn")
+        assert memory_view(context) == ""
+
+        for i in range(200):
+            add_turn(context, "user", f"incident {i} " + "details " * 20)
+            add_turn(context, "assistant", f"status of incident {i} " + "text " * 20)
+            compact(context, token_budget=400, recent_turns=4)
+
+        # Act
+        view = memory_view(context, token_budget=400)
+
+        # Assert
+        assert estimate_tokens(view) <= 400 + 50
+        assert "incident 199" in view
+        assert len(context["conversation_memory"]["turns"]) <= 4
+
+    def test_summaries_of_runs_not_resumed_expire(self):
+        """Teste: Deve descartar resumos pendentes de runs não retomadas após o TTL"""
+        # Arrange
+        release = threading.Event()
+        stale, fresh = {}, {}
+        for context in (stale, fresh):
+            for i in range(4):
+                add_turn(context, "user", f"question {i}")
+
+        def summarizer(summary, turns):
+            release.wait(5)
+            return "summary"
+
+        # Act
+        compact(stale, "run-memory-stale", summarizer=summarizer, recent_turns=1)
+        with patch('app.conversation_memory.MEMORY_SUMMARY_TTL_SECONDS', 0):
+            compact(fresh, "run-memory-fresh", summarizer=summarizer, recent_turns=1)
+        release.set()
+
+        # Assert
+        assert "run-memory-stale" not in conversation_memory._pending_summaries
+        assert "run-memory-fresh" in conversation_memory._pending_summaries
+        assert stale["conversation_memory"]["pending"]
+        conversation_memory.forget("run-memory-fresh")
@@ -0,0 +1,36 @@
+"""
+Testes para os prazos de execução propagados às chamadas externas
+"""
+import pytest
+from unittest.mock import patch
+from app.deadline import run_deadline, call_timeout, deadline_exceeded, DeadlineExceeded
+
+
+class TestDeadline:
+    """Testes para o orçamento de tempo de uma execução"""
+
+    def test_call_timeout_is_capped_by_remaining_budget(self):
+        """Teste: Deve usar o menor entre o timeout padrão e o tempo restante"""
+        with patch('app.deadline.time.monotonic', return_value=100.0):
+            # Act
+            assert call_timeout(30) == 30
+            with run_deadline(10):
+                long_call = call_timeout(30)
+                short_call = call_timeout(5)
+                with run_deadline(60):  # an inner deadline cannot extend the outer one
+                    nested = call_timeout(None)
+
+        # Assert
+        assert long_call == 10
+        assert short_call == 5
+        assert nested == 10
+
+    def test_exhausted_budget_raises(self):
+        """Teste: Deve recusar novas chamadas quando o prazo já passou"""
+        with patch('app.deadline.time.monotonic', return_value=100.0):
+            with run_deadline(1):
+                with patch('app.deadline.time.monotonic', return_value=101.5):
+                    # Act / Assert
+                    assert deadline_exceeded() is True
+                    with pytest.raises(DeadlineExceeded):
+                        call_timeout(30)
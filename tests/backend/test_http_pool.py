@@ -0,0 +1,69 @@
+"""
+Testes para o pool de sessões HTTP keep-alive das ações customizadas
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.http_pool import HTTPSessionPool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestHTTPSessionPool:
+    """Testes para reutilização de conexões por host"""
+
+    def test_requests_to_same_host_reuse_the_connection(self, api_server):
+        """Teste: Deve reutilizar a conexão aberta para chamadas ao mesmo host"""
+        # Arrange
+        pool = HTTPSessionPool(max_connections=2, max_hosts=4)
+
+        # Act
+        responses = [pool.request("GET", f"{api_server}/incidents/{i}", timeout=5) for i in range(3)]
+        stats = pool.stats()
+        pool.close()
+
+        # Assert
+        assert all(response.json() == {"ok": True} for response in responses)
+        host = stats["hosts"][api_server]
+        assert host["connections_created"] == 1
+        assert host["requests"] == 3
+        assert host["reused"] == 2
+        assert host["idle"] == 1
+        assert "gzip" in stats["accept_encoding"]
+
+    def test_least_recently_used_host_is_closed(self):
+        """Teste: Deve limitar o número de hosts com sessão aberta"""
+        # Arrange
+        pool = HTTPSessionPool(max_connections=2, max_hosts=2)
+
+        # Act
+        first = pool.session_for("https://a.example.com/x")
+        pool.session_for("https://b.example.com/x")
+        pool.session_for("https://c.example.com/x")
+
+        # Assert
+        assert list(pool.stats()["hosts"]) == ["https://b.example.com", "https://c.example.com"]
+        assert pool.session_for("https://A.example.com/y") is not first
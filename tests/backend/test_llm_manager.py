@@ -2,8 +2,10 @@
 Testes para LLMManager seguindo TDD
 """
 import pytest
+import time
 from unittest.mock import Mock, patch
 from app.llm_manager import LLMManager
+from app.deadline import run_deadline, DeadlineExceeded
 from app import models, schemas
 
 
@@ -84,6 +86,25 @@ class TestLLMManager:
         assert result == "Test response"
         mock_client.chat.completions.create.assert_called_once()
     
+    @patch('app.llm_manager.OpenAI')
+    def test_call_openai_timeout_at_deadline_raises(self, mock_openai_class):
+        """Teste: Deve desativar retries e propagar o estouro de prazo em vez de devolver texto de erro"""
+        # Arrange
+        def slow_create(**kwargs):
+            time.sleep(kwargs["timeout"])
+            raise TimeoutError("Request timed out.")
+
+        mock_client = Mock()
+        mock_client.chat.completions.create.side_effect = slow_create
+        mock_openai_class.return_value = mock_client
+        llm = models.LLM(name="Test LLM", provider="openai", api_key="test-key", model_name="gpt-3.5-turbo")
+
+        # Act / Assert
+        with run_deadline(0.1):
+            with pytest.raises(DeadlineExceeded):
+                LLMManager.call_llm(llm, "Test prompt")
+        assert mock_openai_class.call_args.kwargs["max_retries"] == 0
+
     @patch('app.llm_manager.requests.post')
     def test_call_ollama_success(self, mock_post):
         """Teste: Deve chamar Ollama API com sucesso"""
@@ -0,0 +1,59 @@
+"""
+Testes para a configuração de logging do motor de execução
+"""
+import json
+import logging
+from app.logging_config import (
+    ContextFilter, SamplingFilter, JSONFormatter, log_context, parse_levels
+)
+
+
+def make_record(level=logging.DEBUG, msg="Executing action %d", args=(1,), **extra):
+    record = logging.LogRecord("app.agent_manager", level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+class TestLoggingConfig:
+    """Testes para filtros, formatação e níveis por logger"""
+
+    def test_sampling_filter_rate_limits_debug_only(self):
+        """Teste: Deve limitar DEBUG por template de mensagem sem descartar INFO"""
+        # Arrange
+        sampling = SamplingFilter(sample_rate=1.0, rate_limit=3)
+
+        # Act
+        debug_passed = sum(sampling.filter(make_record(args=(i,))) for i in range(10))
+        info_passed = sum(sampling.filter(make_record(level=logging.INFO, args=(i,))) for i in range(10))
+
+        # Assert
+        assert debug_passed == 3
+        assert info_passed == 10
+        assert sampling.dropped == 7
+
+    def test_records_carry_run_and_step_ids(self):
+        """Teste: Deve anexar run_id do contexto e permitir sobrescrever a etapa via extra"""
+        # Arrange
+        context_filter = ContextFilter()
+        record = make_record(level=logging.INFO, step=2, action="GetIncident")
+
+        # Act
+        with log_context(run_id="run-1", agent_id=7, step=1):
+            context_filter.filter(record)
+        entry = json.loads(JSONFormatter().format(record))
+
+        # Assert
+        assert entry["run_id"] == "run-1"
+        assert entry["agent_id"] == 7
+        assert entry["step"] == 2
+        assert entry["action"] == "GetIncident"
+        assert entry["message"] == "Executing action 1"
+
+    def test_parse_levels(self):
+        """Teste: Deve interpretar níveis por logger e ignorar entradas inválidas"""
+        # Act
+        levels = parse_levels("app.agent_manager=debug, app.run_queue=WARNING,broken,app.x=LOUD")
+
+        # Assert
+        assert levels == {"app.agent_manager": logging.DEBUG, "app.run_queue": logging.WARNING}
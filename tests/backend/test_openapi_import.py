@@ -0,0 +1,131 @@
+"""
+Testes para a importação de especificações OpenAPI completas
+"""
+import json
+import requests
+import yaml
+from unittest.mock import patch
+from app import models
+from app.action_manager import ActionManager
+from app.openapi_import import import_openapi_spec
+
+
+def _spec(operations: int) -> str:
+    """Especificação com `operations` recursos, cada um com GET e POST referenciando componentes"""
+    paths, schemas = {}, {"Meta": {"type": "object", "properties": {"page": {"type": "integer"}}}}
+    for i in range(operations):
+        schemas[f"Item{i}"] = {"type": "object", "properties": {
+            "id": {"type": "string"}, "meta": {"$ref": "#/components/schemas/Meta"}}}
+        paths[f"/items{i}/{{id}}"] = {
+            "parameters": [{"$ref": "#/components/parameters/ItemId"}],
+            "get": {"operationId": f"getItem{i}", "summary": f"Get item {i}",
+                    "parameters": [{"name": "expand", "in": "query", "schema": {"type": "boolean"}}],
+                    "responses": {200: {"content": {"application/json": {
+                        "schema": {"$ref": f"#/components/schemas/Item{i}"}}}}}},
+            "post": {"operationId": f"updateItem{i}",
+                     "requestBody": {"content": {"application/json": {"schema": {
+                         "type": "object", "required": ["title"],
+                         "properties": {"title": {"type": "string"}}}}}},
+                     "responses": {"201": {"description": "ok"}}},
+            "patch": {"operationId": f"patchItem{i}", "responses": {}}
+        }
+    return yaml.safe_dump({
+        "openapi": "3.0.0",
+        "servers": [{"url": "https://api.example.com/v1"}],
+        "paths": paths,
+        "components": {
+            "schemas": schemas,
+            "parameters": {"ItemId": {"name": "id", "in": "path", "required": True, "schema": {"type": "string"}}},
+            "securitySchemes": {"token": {"type": "apiKey", "in": "header", "name": "Authorization"}}
+        }
+    })
+
+
+class TestOpenAPIImport:
+    """Testes para a criação de uma Action por operação"""
+
+    def test_import_creates_one_action_per_operation(self, db_session):
+        """Teste: Deve criar uma Action por operationId com método, parâmetros e schema próprios"""
+        # Arrange
+        yaml_spec = _spec(60)
+
+        # Act
+        events = list(import_openapi_spec(db_session, yaml_spec, name_prefix="ex_"))
+        again = list(import_openapi_spec(db_session, yaml_spec, name_prefix="ex_"))[-1]["summary"]
+
+        # Assert
+        summary = events[-1]["summary"]
+        assert len(summary["created"]) == 120
+        assert sum(1 for skip in summary["skipped"] if skip["reason"] == "unsupported method") == 60
+        assert [event["done"] for event in events if event.get("phase") == "building"] == [50, 100]
+        assert set(summary["timings_ms"]) == {"parse", "build", "insert", "total"}
+        get_action = db_session.query(models.Action).filter_by(name="ex_getItem7").one()
+        assert get_action.method == "GET"
+        assert get_action.endpoint == "https://api.example.com/v1/items7/{id}"
+        assert get_action.parameters["id"]["in"] == "path" and get_action.parameters["expand"]["type"] == "boolean"
+        assert get_action.headers == {"Authorization": "{{ token }}"}
+        document = yaml.safe_load(get_action.yaml_spec)
+        assert set(document["components"]["schemas"]) == {"Item7", "Meta"}
+        compiled = db_session.query(models.CompiledActionSpec).filter_by(spec_hash=get_action.spec_hash).one()
+        assert compiled.compiled["response_schema"]["properties"]["meta"] == {"$ref": "#/components/schemas/Meta"}
+        post_action = db_session.query(models.Action).filter_by(name="ex_updateItem7").one()
+        assert post_action.parameters["title"] == {"type": "string", "required": True, "description": "", "in": "body"}
+        assert again["created"] == [] and len(again["skipped"]) == 180
+
+    @patch('app.action_manager.http_pool.request')
+    def test_imported_action_sends_each_parameter_where_declared(self, mock_request, db_session):
+        """Teste: Deve enviar cada parâmetro de uma Action importada no local declarado na especificação"""
+        # Arrange
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content, response._content_consumed = b'{"id": "r1"}', True
+        mock_request.return_value = response
+        yaml_spec = yaml.safe_dump({
+            "openapi": "3.0.0",
+            "servers": [{"url": "https://api.example.com/v1"}],
+            "paths": {"/reports/{id}": {
+                "parameters": [{"name": "id", "in": "path", "required": True, "schema": {"type": "string"}}],
+                "get": {"operationId": "getReport",
+                        "parameters": [{"name": "fields", "in": "query", "schema": {"type": "string"}},
+                                       {"name": "X-Tenant", "in": "header", "schema": {"type": "string"}},
+                                       {"name": "session", "in": "cookie", "schema": {"type": "string"}}],
+                        "responses": {"200": {"description": "ok"}}},
+                "put": {"operationId": "putReport",
+                        "parameters": [{"name": "dry_run", "in": "query", "schema": {"type": "boolean"}}],
+                        "requestBody": {"content": {"application/json": {"schema": {
+                            "type": "object", "properties": {"title": {"type": "string"}}}}}},
+                        "responses": {"200": {"description": "ok"}}}
+            }}
+        })
+        list(import_openapi_spec(db_session, yaml_spec))
+
+        # Act
+        ActionManager.execute_action(db_session, "getReport",
+                                     {"id": "7", "fields": "title", "X-Tenant": "acme", "session": "s1"}, {})
+        get_call = mock_request.call_args
+        ActionManager.execute_action(db_session, "putReport", {"id": "7", "dry_run": True, "title": "Q3"}, {})
+        put_call = mock_request.call_args
+
+        # Assert
+        assert get_call.args == ("GET", "https://api.example.com/v1/reports/7")
+        assert get_call.kwargs["params"] == {"fields": "title"}
+        assert get_call.kwargs["headers"]["X-Tenant"] == "acme"
+        assert get_call.kwargs["headers"]["Cookie"] == "session=s1"
+        assert "json" not in get_call.kwargs
+        assert put_call.args == ("PUT", "https://api.example.com/v1/reports/7")
+        assert put_call.kwargs["params"] == {"dry_run": True}
+        assert put_call.kwargs["json"] == {"title": "Q3"}
+
+    def test_import_endpoint_streams_progress(self, client):
+        """Teste: Deve transmitir eventos de progresso em NDJSON terminando com o resumo"""
+        # Act
+        response = client.post("/actions/import-openapi/", json={"yaml_spec": _spec(30), "stream": True})
+        invalid = client.post("/actions/import-openapi/", json={"yaml_spec": "openapi: 3.0.0"})
+
+        # Assert
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert response.status_code == 200
+        assert lines[0]["phase"] == "parsed" and lines[0]["operations"] == 60
+        assert len(lines[-1]["summary"]["created"]) == 60
+        assert invalid.status_code == 400
@@ -0,0 +1,139 @@
+"""
+Testes para retentativas e circuit breakers das chamadas de ações
+"""
+import pytest
+import requests
+from unittest.mock import patch
+from app import resilience
+from app.resilience import (
+    CircuitBreaker, CircuitOpenError, OutboundLimitExceeded, OutboundLimits, retry_policy, send_with_retries
+)
+
+
+def _response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content, response._content_consumed = b"{}", True
+    return response
+
+
+class TestResilience:
+    """Testes para a política de retentativa e o estado dos circuit breakers"""
+
+    @patch('app.resilience.time.sleep')
+    def test_retries_idempotent_calls_honouring_retry_after(self, mock_sleep):
+        """Teste: Deve repetir chamadas idempotentes respeitando Retry-After e não repetir POST"""
+        # Arrange
+        resilience.circuit_breakers.reset()
+        responses = [_response(429, {"Retry-After": "2"}), _response(503), _response(200)]
+        posts = [_response(503), _response(200)]
+        policy = retry_policy({"retry": {"max_attempts": 3, "backoff_seconds": 0.5}}, "GET")
+
+        # Act
+        result = send_with_retries("https://retry.example.com/items", lambda: responses.pop(0), policy)
+        post_result = send_with_retries("https://retry.example.com/items", lambda: posts.pop(0),
+                                        retry_policy({"retry": {"max_attempts": 3}}, "POST"))
+
+        # Assert
+        assert result.status_code == 200
+        assert mock_sleep.call_args_list[0].args[0] == 2.0
+        assert 0 <= mock_sleep.call_args_list[1].args[0] <= 1.0
+        assert post_result.status_code == 503
+        assert mock_sleep.call_count == 2
+
+    @patch('app.resilience.time.sleep')
+    def test_long_retry_after_returns_response_without_retrying(self, mock_sleep):
+        """Teste: Deve devolver a resposta 429 sem repetir quando o Retry-After passa do limite de espera"""
+        # Arrange
+        resilience.circuit_breakers.reset()
+        responses = [_response(429, {"Retry-After": "60"}), _response(200)]
+        policy = retry_policy({"retry": {"max_attempts": 3, "max_wait_seconds": 10}}, "GET")
+
+        # Act
+        result = send_with_retries("https://slow-down.example.com/items", lambda: responses.pop(0), policy)
+
+        # Assert
+        assert result.status_code == 429
+        assert result.headers["Retry-After"] == "60"
+        assert mock_sleep.call_count == 0
+        assert len(responses) == 1
+
+    def test_circuit_opens_after_failures_and_probes_after_cool_down(self):
+        """Teste: Deve abrir o circuito após falhas seguidas e liberar uma única chamada de prova depois"""
+        # Arrange
+        breaker = CircuitBreaker("https://down.example.com", failure_threshold=2, reset_seconds=0.05)
+
+        # Act
+        for _ in range(2):
+            breaker.before_call()
+            breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        opened = breaker.snapshot()
+        with patch('app.resilience.time.monotonic', return_value=breaker.opened_at + 1):
+            breaker.before_call()
+            with pytest.raises(CircuitOpenError):
+                breaker.before_call()
+        breaker.record_success()
+
+        # Assert
+        assert opened["state"] == "open" and opened["short_circuited"] == 1
+        assert breaker.snapshot()["state"] == "closed"
+        assert breaker.snapshot()["short_circuited"] == 2
+
+    def test_bulkhead_queues_then_rejects_calls_over_the_limit(self):
+        """Teste: Deve limitar chamadas simultâneas por host e recusar além da fila configurada"""
+        # Arrange
+        limits = OutboundLimits()
+        config = {"concurrency": {"limit": 1, "queue": 0, "wait_seconds": 0}}
+        bulkhead, _ = limits.for_call(1, "https://slow.example.com/tickets", config)
+        other_action, _ = limits.for_call(2, "https://slow.example.com/users", config)
+        isolated, _ = limits.for_call(3, "https://slow.example.com/x",
+                                      {"concurrency": {"limit": 1, "scope": "action"}})
+
+        # Act
+        bulkhead[0].acquire(bulkhead[1])
+        with pytest.raises(OutboundLimitExceeded) as full:
+            other_action[0].acquire(other_action[1])
+        isolated[0].acquire(isolated[1])
+        bulkhead[0].release()
+        other_action[0].acquire(other_action[1])
+
+        # Assert
+        assert full.value.reason == "bulkhead_full"
+        assert other_action[0] is bulkhead[0]
+        snapshot = {bulkhead["scope"]: bulkhead for bulkhead in limits.snapshot()["bulkheads"]}
+        assert snapshot["host:https://slow.example.com"]["rejected"] == 1
+        assert snapshot["action:3"]["in_use"] == 1
+
+    @patch('app.resilience.time.sleep')
+    def test_token_bucket_waits_for_tokens_or_fails_fast(self, mock_sleep):
+        """Teste: Deve esperar por tokens dentro do limite de espera e falhar rápido sem espera"""
+        # Arrange
+        limits = OutboundLimits()
+        host_limits = {"api.rootly.com": {"rate_limit": {"per_second": 5, "burst": 10}}}
+
+        # Act
+        _, unlimited = limits.for_call(4, "https://api.rootly.com/v1/alerts", None)
+        with patch('app.resilience.time.monotonic', return_value=1000.0), \
+             patch.dict('app.resilience.ACTION_HOST_LIMITS', host_limits):
+            _, waiting = limits.for_call(1, "https://api.rootly.com/v1/incidents",
+                                         {"rate_limit": {"per_second": 2, "burst": 1, "wait_seconds": 5}})
+            _, fail_fast = limits.for_call(2, "https://other.example.com/",
+                                           {"rate_limit": {"per_second": 1, "burst": 1, "wait_seconds": 0}})
+            _, rootly_default = limits.for_call(3, "https://api.rootly.com/v1/alerts", None)
+            waiting[0].acquire(waiting[1])
+            with pytest.raises(OutboundLimitExceeded):
+                # No sleep advances the clock, so the wait budget runs out
+                waiting[0].acquire(waiting[1])
+            fail_fast[0].acquire(fail_fast[1])
+            with pytest.raises(OutboundLimitExceeded) as limited:
+                fail_fast[0].acquire(fail_fast[1])
+
+        # Assert
+        assert mock_sleep.call_args_list[0].args[0] == 0.5
+        assert limited.value.reason == "rate_limited"
+        assert rootly_default[0].name == "host:https://api.rootly.com"
+        assert rootly_default[0] is not waiting[0] and rootly_default[0].per_second == 5
+        assert resilience.ACTION_HOST_LIMITS == {} and unlimited is None
@@ -0,0 +1,111 @@
+"""
+Testes para a projeção de respostas compilada a partir do schema
+"""
+import json
+import requests
+from unittest.mock import patch
+from app.response_projection import compile_projection, build_projector, ProjectionBuilder, project_events
+from app.response_stream import read_response
+
+
+class TestResponseProjection:
+    """Testes para filtragem de respostas por schema OpenAPI"""
+
+    def test_projection_filters_arrays_refs_and_composition(self):
+        """Teste: Deve filtrar itens de listas, seguir $ref e unir os campos de allOf/oneOf"""
+        # Arrange
+        spec = {"components": {"schemas": {
+            "Base": {"type": "object", "properties": {"id": {"type": "string"}}},
+            "Incident": {"allOf": [
+                {"$ref": "#/components/schemas/Base"},
+                {"type": "object", "properties": {
+                    "title": {"type": "string"},
+                    "owner": {"oneOf": [
+                        {"type": "object", "properties": {"email": {"type": "string"}}},
+                        {"type": "object", "properties": {"team": {"type": "string"}}}
+                    ]},
+                    "labels": {"type": "object", "additionalProperties": {
+                        "type": "object", "properties": {"value": {"type": "string"}}}}
+                }}
+            ]}
+        }}}
+        schema = {"type": "object", "properties": {
+            "data": {"type": "array", "items": {"$ref": "#/components/schemas/Incident"}}}}
+        response = {"data": [
+            {"id": "1", "title": "DB down", "raw": "x" * 100,
+             "owner": {"email": "a@b.c", "phone": "123"},
+             "labels": {"sev": {"value": "1", "color": "red"}}},
+            {"id": "2", "title": "API slow", "owner": {"team": "core"}}
+        ], "meta": {"page": 1}}
+
+        # Act
+        plan = compile_projection(schema, spec)
+        projected = build_projector(plan)(response)
+
+        # Assert
+        json.dumps(plan)
+        assert projected == {"data": [
+            {"id": "1", "title": "DB down", "owner": {"email": "a@b.c"}, "labels": {"sev": {"value": "1"}}},
+            {"id": "2", "title": "API slow", "owner": {"team": "core"}}
+        ]}
+
+    def test_projection_handles_recursive_schemas(self):
+        """Teste: Deve projetar schemas recursivos sem entrar em laço na compilação"""
+        # Arrange
+        spec = {"components": {"schemas": {"Node": {"type": "object", "properties": {
+            "name": {"type": "string"},
+            "children": {"type": "array", "items": {"$ref": "#/components/schemas/Node"}}}}}}}
+        response = {"name": "root", "extra": 1, "children": [
+            {"name": "leaf", "extra": 2, "children": []}]}
+
+        # Act
+        projector = build_projector(compile_projection({"$ref": "#/components/schemas/Node"}, spec))
+
+        # Assert
+        assert projector(response) == {"name": "root", "children": [{"name": "leaf", "children": []}]}
+
+    def test_event_builder_skips_dropped_fields_and_keeps_partial_results(self):
+        """Teste: Deve projetar a partir de eventos do parser e devolver o parcial de uma entrada cortada"""
+        # Arrange
+        plan = compile_projection({"type": "array", "items": {"type": "object", "properties": {
+            "id": {"type": "string"}, "tags": {"type": "array"}}}})
+        events = [("start_array", None),
+                  ("start_map", None), ("map_key", "id"), ("string", "1"),
+                  ("map_key", "blob"), ("start_map", None), ("map_key", "id"), ("string", "hidden"), ("end_map", None),
+                  ("map_key", "tags"), ("start_array", None), ("string", "a"), ("end_array", None),
+                  ("end_map", None),
+                  ("start_map", None), ("map_key", "id"), ("string", "2")]
+
+        # Act
+        complete = project_events(events + [("end_map", None), ("end_array", None)], plan)
+        builder = ProjectionBuilder(plan)
+        for event, value in events:
+            builder.event(event, value)
+
+        # Assert
+        assert complete == [{"id": "1", "tags": ["a"]}, {"id": "2"}]
+        assert builder.complete is False
+        assert builder.partial() == [{"id": "1", "tags": ["a"]}, {"id": "2"}]
+
+    def test_read_response_projects_while_parsing_with_ijson(self):
+        """Teste: Deve projetar o corpo durante o parse incremental (ijson) sem materializar os campos descartados"""
+        # Arrange
+        plan = compile_projection({"type": "object", "properties": {"data": {"type": "array", "items": {
+            "type": "object", "properties": {"id": {"type": "integer"}}}}}})
+        payload = {"data": [{"id": i, "blob": "x" * 1000} for i in range(50)], "meta": {"total": 50}}
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(payload).encode("utf-8")
+        response._content_consumed = True
+
+        # Act
+        with patch('app.response_stream.ProjectionBuilder', wraps=ProjectionBuilder) as builder:
+            body = read_response(response, plan=plan, projector=build_projector(plan))
+
+        # Assert
+        assert builder.call_count == 1
+        assert body["value"] is None
+        assert body["projected"] == {"data": [{"id": i} for i in range(50)]}
+        assert body["bytes_read"] == len(response._content)
+        assert body["truncated"] is False
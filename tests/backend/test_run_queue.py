@@ -0,0 +1,293 @@
+"""
+Testes para o pool de execuções assíncronas
+"""
+import pytest
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from app.run_queue import RunWorkerPool, SQLiteRunQueue, RunQueueFullError
+from app.checkpoint_manager import CheckpointManager, worker_identity
+from app import schemas
+
+
+class TestRunWorkerPool:
+    """Testes para o RunWorkerPool"""
+
+    def test_submit_returns_immediately_and_completes(self, test_db):
+        """Teste: Deve enfileirar a execução e concluí-la em background"""
+        # Arrange
+        pool = RunWorkerPool(workers=1, max_queue_depth=5, session_factory=test_db)
+        done = threading.Event()
+
+        def fake_run(db, agent_id, input_data, run_id=None):
+            done.set()
+            return {"response": "ok", "run_id": run_id}
+
+        # Act
+        with patch('app.run_queue.AgentManager.run_agent', side_effect=fake_run):
+            job = pool.submit(1, schemas.AgentRun(input="hello"))
+            assert job["status"] == "queued"
+            assert done.wait(5)
+            pool.shutdown()
+
+        # Assert
+        finished = pool.get_job(job["run_id"])
+        assert finished["status"] == "completed"
+        assert finished["result"]["response"] == "ok"
+
+    def test_queue_depth_limit_and_priorities(self, test_db):
+        """Teste: Deve recusar quando a fila está cheia e atender interativos primeiro"""
+        # Arrange
+        pool = RunWorkerPool(workers=1, max_queue_depth=2, session_factory=test_db)
+        release = threading.Event()
+        order = []
+
+        def fake_run(db, agent_id, input_data, run_id=None):
+            order.append(input_data.input)
+            release.wait(5)
+            return {"response": "ok"}
+
+        with patch('app.run_queue.AgentManager.run_agent', side_effect=fake_run):
+            pool.submit(1, schemas.AgentRun(input="first"))
+            while not order:
+                threading.Event().wait(0.01)
+
+            # Act
+            pool.submit(1, schemas.AgentRun(input="batch"), priority="batch")
+            pool.submit(1, schemas.AgentRun(input="interactive"))
+            with pytest.raises(RunQueueFullError):
+                pool.submit(1, schemas.AgentRun(input="overflow"))
+
+            release.set()
+            pool.shutdown()
+
+        # Assert
+        assert order == ["first", "interactive", "batch"]
+
+    def test_cancel_queued_run(self, test_db):
+        """Teste: Deve cancelar uma execução ainda na fila"""
+        # Arrange
+        pool = RunWorkerPool(workers=1, max_queue_depth=5, session_factory=test_db)
+        job = {"run_id": "queued-run", "status": "queued"}
+        pool._jobs["queued-run"] = job
+        pool._queued = 1
+        db = test_db()
+
+        # Act
+        cancelled = pool.cancel(db, "queued-run")
+        db.close()
+
+        # Assert
+        assert cancelled is True
+        assert pool.get_job("queued-run")["status"] == "cancelled"
+        assert pool.stats()["queued"] == 0
+
+    def test_cancel_running_run_flags_checkpoint(self, db_session, test_db):
+        """Teste: Deve sinalizar o cancelamento de uma execução em andamento"""
+        # Arrange
+        pool = RunWorkerPool(workers=1, session_factory=test_db)
+        checkpoint = CheckpointManager.create_checkpoint(db_session, 1, "input", {})
+
+        # Act
+        cancelled = pool.cancel(db_session, checkpoint.run_id)
+
+        # Assert
+        assert cancelled is True
+        db_session.refresh(checkpoint)
+        assert checkpoint.cancel_requested is True
+        status = pool.get_run_status(db_session, checkpoint.run_id)
+        assert status["status"] == "running"
+        assert status["partial_results"]["actions_used"] == []
+
+    def test_cancel_waiting_run_drops_pending_summary(self, db_session):
+        """Teste: Deve cancelar na hora uma execução em espera e descartar o resumo de conversa pendente"""
+        # Arrange
+        checkpoint = CheckpointManager.create_checkpoint(db_session, 1, "input", {})
+        checkpoint.status = "waiting"
+        db_session.commit()
+
+        # Act
+        with patch('app.checkpoint_manager.conversation_memory.forget') as forget:
+            cancelled = CheckpointManager.request_cancel(db_session, checkpoint.run_id)
+
+        # Assert
+        assert cancelled is True
+        db_session.refresh(checkpoint)
+        assert checkpoint.status == "cancelled"
+        forget.assert_called_once_with(checkpoint.run_id)
+
+
+class TestSQLiteRunQueue:
+    """Testes para a fila durável em SQLite"""
+
+    def test_submit_and_claim_by_priority(self, test_db, db_session):
+        """Teste: Deve persistir jobs e entregá-los por prioridade"""
+        # Arrange
+        run_queue = SQLiteRunQueue(max_queue_depth=2, session_factory=test_db)
+        batch = run_queue.submit(1, schemas.AgentRun(input="batch"), priority="batch")
+        interactive = run_queue.submit(1, schemas.AgentRun(input="interactive"))
+
+        # Act
+        with pytest.raises(RunQueueFullError):
+            run_queue.submit(1, schemas.AgentRun(input="overflow"))
+        first = run_queue.claim_next(db_session, "worker-a")
+        second = run_queue.claim_next(db_session, "worker-b")
+
+        # Assert
+        assert first.run_id == interactive["run_id"]
+        assert second.run_id == batch["run_id"]
+        assert run_queue.claim_next(db_session, "worker-c") is None
+        assert run_queue.get_job(first.run_id)["status"] == "running"
+
+    def test_expired_lease_is_reclaimed(self, test_db, db_session):
+        """Teste: Deve reatribuir jobs cujo lease expirou"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db, lease_seconds=60)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        claimed = run_queue.claim_next(db_session, "crashed-worker")
+        claimed.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db_session.commit()
+
+        # Act
+        reclaimed = run_queue.claim_next(db_session, "worker-b")
+
+        # Assert
+        assert reclaimed.run_id == job["run_id"]
+        assert reclaimed.lease_owner == "worker-b"
+        assert reclaimed.attempts == 2
+        assert run_queue.renew_lease(db_session, reclaimed.id, "crashed-worker") is False
+
+    def test_job_fails_after_max_attempts(self, test_db, db_session):
+        """Teste: Deve marcar como falho o job cujo lease expirou na última tentativa permitida"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db, max_attempts=2)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        checkpoint = CheckpointManager.create_checkpoint(db_session, 1, "hello", {}, run_id=job["run_id"])
+        for owner in ("worker-a", "worker-b"):
+            claimed = run_queue.claim_next(db_session, owner)
+            claimed.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+            db_session.commit()
+
+        # Act
+        reclaimed = run_queue.claim_next(db_session, "worker-c")
+
+        # Assert
+        assert reclaimed is None
+        stored = run_queue.get_job(job["run_id"])
+        assert stored["status"] == "failed"
+        assert stored["attempts"] == 2
+        assert "Gave up after 2 attempts" in stored["error"]
+        db_session.refresh(checkpoint)
+        assert checkpoint.status == "failed"
+
+    def test_execute_job_records_result(self, test_db, db_session):
+        """Teste: Deve executar o job reivindicado e gravar o resultado"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        claimed = run_queue.claim_next(db_session, "worker-a")
+
+        # Act
+        with patch('app.run_queue.AgentManager.run_agent', return_value={"response": "done"}) as mock_run:
+            status = run_queue.execute_job(claimed.id, "worker-a")
+
+        # Assert
+        assert status == "completed"
+        assert mock_run.call_args.kwargs["run_id"] == job["run_id"]
+        stored = run_queue.get_job(job["run_id"])
+        assert stored["status"] == "completed"
+        assert stored["result"] == {"response": "done"}
+
+    def test_job_deadline_is_persisted_and_applied(self, test_db, db_session):
+        """Teste: Deve guardar o prazo no job e aplicá-lo quando o worker executa a run"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db)
+        run_queue.submit(1, schemas.AgentRun(input="hello", deadline_seconds=12.5))
+        claimed = run_queue.claim_next(db_session, "worker-a")
+
+        # Act
+        with patch('app.run_queue.AgentManager.run_agent', return_value={"response": "done"}) as mock_run:
+            run_queue.execute_job(claimed.id, "worker-a")
+
+        # Assert
+        assert claimed.deadline_seconds == 12.5
+        assert mock_run.call_args.args[2].deadline_seconds == 12.5
+
+    def test_reclaimed_job_resumes_from_checkpoint(self, test_db, db_session):
+        """Teste: Deve retomar do checkpoint em vez de reexecutar a run"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        claimed = run_queue.claim_next(db_session, "worker-a")
+        CheckpointManager.create_checkpoint(db_session, 1, "hello", {}, run_id=job["run_id"], owner="crashed-worker")
+
+        # Act
+        with patch('app.run_queue.AgentManager.resume_run', return_value={"response": "resumed"}) as mock_resume, \
+             patch('app.run_queue.AgentManager.run_agent') as mock_run:
+            status = run_queue.execute_job(claimed.id, "worker-a")
+
+        # Assert
+        assert status == "completed"
+        mock_resume.assert_called_once()
+        mock_run.assert_not_called()
+        checkpoint = CheckpointManager.get_checkpoint(db_session, job["run_id"])
+        assert checkpoint.owner.startswith(worker_identity())
+        assert mock_resume.call_args.kwargs["owner"] == checkpoint.owner
+
+    def test_finished_checkpoint_status_is_recorded_on_job(self, test_db, db_session):
+        """Teste: Deve gravar no job o status do checkpoint de uma run já encerrada"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        claimed = run_queue.claim_next(db_session, "worker-a")
+        CheckpointManager.create_checkpoint(db_session, 1, "hello", {}, run_id=job["run_id"])
+        CheckpointManager.set_status(db_session, job["run_id"], "deadline_exceeded")
+
+        # Act
+        with patch('app.run_queue.AgentManager.resume_run') as mock_resume:
+            status = run_queue.execute_job(claimed.id, "worker-a")
+
+        # Assert
+        assert status == "deadline_exceeded"
+        mock_resume.assert_not_called()
+        assert run_queue.get_job(job["run_id"])["status"] == "deadline_exceeded"
+
+    def test_lost_lease_releases_the_run(self, test_db, db_session):
+        """Teste: Deve liberar o checkpoint ao perder o lease para que o motor pare"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db, lease_seconds=0.15)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+        claimed = run_queue.claim_next(db_session, "worker-a")
+        observed = {}
+
+        def run_and_lose_lease(db, agent_id, input_data, run_id=None, owner=None):
+            CheckpointManager.create_checkpoint(db, agent_id, "hello", {}, run_id=run_id, owner=owner)
+            claimed.lease_owner = "worker-b"
+            db_session.commit()
+            time.sleep(0.3)
+            checkpoint = CheckpointManager.save_checkpoint(db, run_id, [], {}, {}, owner=owner)
+            observed["owner"] = checkpoint.owner
+            return {"cancelled": True}
+
+        # Act
+        with patch('app.run_queue.AgentManager.run_agent', side_effect=run_and_lose_lease):
+            run_queue.execute_job(claimed.id, "worker-a")
+
+        # Assert
+        assert observed["owner"] is None
+        assert CheckpointManager.get_checkpoint(db_session, job["run_id"]).step_count == 0
+
+    def test_cancel_queued_job(self, test_db, db_session):
+        """Teste: Deve cancelar um job ainda na fila"""
+        # Arrange
+        run_queue = SQLiteRunQueue(session_factory=test_db)
+        job = run_queue.submit(1, schemas.AgentRun(input="hello"))
+
+        # Act
+        cancelled = run_queue.cancel(db_session, job["run_id"])
+
+        # Assert
+        assert cancelled is True
+        assert run_queue.claim_next(db_session, "worker-a") is None
+        assert run_queue.stats()["by_status"] == {"cancelled": 1}
@@ -0,0 +1,107 @@
+"""
+Testes para a telemetria de execuções
+"""
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from app.telemetry import (
+    TelemetryWriter, TelemetryManager, track_step, record_llm_call,
+    record_llm_usage, record_http_call, hash_input, collect_run_timings, time_phase
+)
+from app import models
+
+
+class TestTelemetry:
+    """Testes para coleta, gravação e consultas de telemetria"""
+
+    def test_track_step_collects_llm_and_http_metrics(self, test_db):
+        """Teste: Deve acumular latência, tokens e bytes da etapa atual"""
+        # Arrange
+        writer = TelemetryWriter(session_factory=test_db, enabled=True)
+
+        # Act
+        with patch('app.telemetry.telemetry_writer', writer):
+            with track_step("run-1", 1, 1, "GetIncident", "main") as step:
+                record_llm_call(120.0)
+                record_llm_usage(50, 10)
+                record_http_call(80.0, request_bytes=0, response_bytes=2048)
+        record_http_call(999.0)  # outside a step: ignored
+        writer.flush()
+
+        # Assert
+        assert step["llm_ms"] == 120.0
+        assert step["prompt_tokens"] == 50
+        assert step["http_calls"] == 1
+        assert step["response_bytes"] == 2048
+        db = test_db()
+        stored = db.query(models.RunStep).one()
+        assert stored.action_name == "GetIncident"
+        assert stored.http_ms == 80.0
+        db.close()
+
+    def test_collect_run_timings_breaks_down_each_step(self, db_session):
+        """Teste: Deve separar extração, execução, contexto e banco por etapa e montar o Server-Timing"""
+        # Arrange / Act
+        with collect_run_timings() as run_timings:
+            with track_step(None, 1, 1, "GetIncident", "main") as step:
+                with time_phase("extraction"):
+                    db_session.query(models.Action).all()
+                with time_phase("action"):
+                    record_llm_call(5.0)
+            with time_phase("context", step):
+                pass
+
+        # Assert
+        summary = run_timings.summary()
+        assert [s["action"] for s in summary["steps"]] == ["GetIncident"]
+        assert summary["steps"][0]["extraction_ms"] > 0
+        assert summary["steps"][0]["db_ms"] > 0
+        assert summary["steps"][0]["llm_ms"] == 5.0
+        assert summary["phases_ms"]["db"] >= summary["steps"][0]["db_ms"]
+        assert summary["total_ms"] >= summary["steps"][0]["duration_ms"]
+        header = run_timings.server_timing_header()
+        assert 'extraction;dur=' in header and 'context;dur=' in header and header.split(", ")[-1].startswith("total;dur=")
+
+    def test_writer_merges_run_segments(self, test_db):
+        """Teste: Deve consolidar segmentos da mesma execução (antes e depois do Wait)"""
+        # Arrange
+        writer = TelemetryWriter(session_factory=test_db, enabled=True)
+        base = {"agent_id": 1, "input_hash": hash_input("hi"), "started_at": datetime.utcnow(),
+                "finished_at": datetime.utcnow(), "error": None}
+
+        # Act
+        writer._write([("run", {**base, "run_id": "r1", "status": "waiting", "duration_ms": 100.0, "step_count": 2})])
+        writer._write([("run", {**base, "run_id": "r1", "status": "completed", "duration_ms": 50.0, "step_count": 1})])
+
+        # Assert
+        db = test_db()
+        run = db.query(models.Run).filter(models.Run.run_id == "r1").one()
+        assert run.status == "completed"
+        assert run.duration_ms == 150.0
+        assert run.step_count == 3
+        db.close()
+
+    def test_queries_report_percentiles_errors_and_slowest(self, test_db, db_session):
+        """Teste: Deve calcular p95 por agente, taxas de erro e etapas mais lentas"""
+        # Arrange
+        now = datetime.utcnow()
+        for i in range(1, 21):
+            db_session.add(models.Run(run_id=f"r{i}", agent_id=1, input_hash="h", status="failed" if i <= 2 else "completed",
+                                      started_at=now, finished_at=now, duration_ms=float(i * 100), step_count=1))
+        db_session.add(models.RunStep(run_id="r1", agent_id=1, step_index=1, action_name="Slow", status="error",
+                                      started_at=now, finished_at=now, duration_ms=9000.0))
+        db_session.add(models.RunStep(run_id="r2", agent_id=1, step_index=1, action_name="Fast", status="success",
+                                      started_at=now, finished_at=now, duration_ms=10.0))
+        db_session.commit()
+
+        # Act
+        latency = TelemetryManager.latency_by_agent(db_session)
+        errors = TelemetryManager.error_rates(db_session)
+        slowest = TelemetryManager.slowest_steps(db_session, limit=1)
+
+        # Assert
+        assert latency[0]["runs"] == 20
+        assert latency[0]["p95_ms"] == pytest.approx(1905.0)
+        assert errors["agents"][0]["error_rate"] == pytest.approx(0.1)
+        assert {a["action_name"]: a["failed"] for a in errors["actions"]} == {"Slow": 1, "Fast": 0}
+        assert slowest[0]["action_name"] == "Slow"